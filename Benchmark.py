@@ -0,0 +1,195 @@
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import Circuit
+import Codegen
+from Netlist import BACKENDS, np, exhaustive_words, int_to_bits
+
+DEFAULT_COMPONENTS = ["XorGate", "FullAdder", "TwoBitAddressDecoder", "TwoToOneMultiplexer", "EightBitBinaryAdder",
+                      "EightBit2sComplementAdderSubtractor", "AdderSubtractor:16", "AdderSubtractor:32",
+                      "AdderSubtractor:64"]
+
+# Timings where bigger is worse, throughput is the other way around
+TIME_METRICS = ["construct_seconds", "compile_seconds", "latency_seconds", "exhaustive_seconds",
+                "batch_exhaustive_seconds"]
+RATE_METRICS = ["vectors_per_second"]
+MIN_SAMPLE_SECONDS = 0.05
+# Every benchmark runs this many times, each round going through all of them, and a metric is the median of its
+# rounds. The machine can run noticeably faster or slower for a few seconds, which only moves one of the rounds.
+ROUNDS = 5
+# Smallest slowdown in seconds that counts as a regression, below it timer noise dominates. latency_seconds is per
+# evaluate() and also bounds the time per vector of the rate metrics.
+MIN_SLOWDOWN = {"construct_seconds": 1e-3, "compile_seconds": 1e-3, "latency_seconds": 1e-6, "exhaustive_seconds": 1e-3,
+                "batch_exhaustive_seconds": 1e-3}
+
+
+def available_backends():
+    backends = ["reference"] + list(BACKENDS)
+    if np is None:
+        backends.remove("numpy")
+    return backends
+
+
+def build(spec):
+    # "FullAdder" or "AdderSubtractor:32" for classes taking a width
+    name, _, width = spec.partition(":")
+    component_class = getattr(Circuit, name, None)
+    if not isinstance(component_class, type) or not issubclass(component_class, Circuit.Component):
+        raise ValueError(f"Unknown component class {name}")
+    return component_class(int(width)) if width else component_class()
+
+
+def seconds_per_call(function):
+    # Enough calls per sample that timer resolution and scheduling noise don't show in microsecond timings
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        seconds = timer.timeit(number)
+        if seconds >= MIN_SAMPLE_SECONDS:
+            return seconds / number
+        number *= 10
+
+
+def time_once(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def compile_cold(component, backend):
+    # set_backend() would return the code generated by an earlier run from Codegen's caches, so codegen is compiled
+    # into an empty cache directory instead
+    if backend != "codegen":
+        component.set_backend(backend)
+        return
+    Codegen._generated.clear()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        component.backend = Codegen.compile_generated(component, cache_dir)
+
+
+def benchmark(spec, backend, vectors=2000, max_exhaustive_inputs=12, max_batch_inputs=20):
+    # One round of measurements, see ROUNDS
+    result = {"component": spec, "backend": backend}
+    result["construct_seconds"] = time_once(lambda: build(spec))
+
+    component = build(spec)
+    result["compile_seconds"] = time_once(lambda: compile_cold(component, backend))
+
+    tracemalloc.start()
+    component = build(spec)
+    compile_cold(component, backend)
+    result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    width = len(component.inputs)
+    result["inputs"] = width
+    component.set_inputs_from_array([1] * width)
+    result["latency_seconds"] = seconds_per_call(component.evaluate)
+
+    random_vectors = [int_to_bits(random.getrandbits(width), width) for _ in range(vectors)]
+
+    def random_sweep():
+        for vector in random_vectors:
+            component.set_inputs_from_array(vector)
+            component.evaluate()
+    result["vectors_per_second"] = vectors / seconds_per_call(random_sweep)
+
+    def exhaustive_sweep():
+        for vector in range(2 ** width):
+            component.set_inputs_from_array(int_to_bits(vector, width))
+            component.evaluate()
+    result["exhaustive_seconds"] = time_once(exhaustive_sweep) if width <= max_exhaustive_inputs else None
+
+    # Same sweep with every vector packed into one word per input
+    result["batch_exhaustive_seconds"] = None
+    if component.backend is not None and width <= max_batch_inputs:
+        words, mask = exhaustive_words(width)
+        result["batch_exhaustive_seconds"] = time_once(lambda: component.backend.evaluate_words(words, mask))
+    return result
+
+
+def median_result(rounds):
+    # Median of every metric over the rounds of one benchmark
+    result = dict(rounds[0])
+    for metric in TIME_METRICS + RATE_METRICS + ["peak_memory_bytes"]:
+        if result[metric] is not None:
+            result[metric] = statistics.median(round_result[metric] for round_result in rounds)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Returns a line for every metric that got worse than the baseline by more than threshold (0.2 is 20%) and by more
+    # than MIN_SLOWDOWN
+    previous = {(result["component"], result["backend"]): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["component"], result["backend"]))
+        if old is None:
+            continue
+        for metric in TIME_METRICS:
+            if result.get(metric) is not None and old.get(metric):
+                if result[metric] > old[metric] * (1 + threshold) and \
+                        result[metric] - old[metric] > MIN_SLOWDOWN[metric]:
+                    regressions.append(f"{result['component']} {result['backend']} {metric}: "
+                                       f"{old[metric]:.3g} -> {result[metric]:.3g}")
+        for metric in RATE_METRICS:
+            if result.get(metric) is not None and old.get(metric):
+                if result[metric] < old[metric] / (1 + threshold) and \
+                        1 / result[metric] - 1 / old[metric] > MIN_SLOWDOWN["latency_seconds"]:
+                    regressions.append(f"{result['component']} {result['backend']} {metric}: "
+                                       f"{old[metric]:.3g} -> {result[metric]:.3g}")
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the built-in components on every backend")
+    parser.add_argument("components", nargs="*", default=DEFAULT_COMPONENTS,
+                        help="class names from Circuit, Class:width for the parametric ones")
+    parser.add_argument("--backends", nargs="+", default=available_backends(), choices=available_backends())
+    parser.add_argument("--vectors", type=int, default=2000, help="random vectors for the throughput run")
+    parser.add_argument("--max-exhaustive-inputs", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before failing, 0.2 is 20%%. Compare runs made on the same machine in "
+                             "the same state, CPU boost alone can be worth more than that")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="runs of every benchmark, metrics are the median")
+    options = parser.parse_args()
+
+    rounds = {(spec, backend): [] for spec in options.components for backend in options.backends}
+    for _ in range(options.rounds):
+        # Every round evaluates the same random vectors
+        random.seed(options.seed)
+        for (spec, backend), round_results in rounds.items():
+            round_results.append(benchmark(spec, backend, options.vectors, options.max_exhaustive_inputs))
+    results = []
+    for (spec, backend), round_results in rounds.items():
+        results.append(median_result(round_results))
+        print(f"{spec:40} {backend:10} {results[-1]['latency_seconds'] * 1e6:10.1f} us "
+              f"{results[-1]['vectors_per_second']:12.0f} vectors/s", file=sys.stderr)
+    report = {"python": platform.python_version(), "platform": platform.platform(), "time": time.time(),
+              "results": results}
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, options.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
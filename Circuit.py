@@ -1,4 +1,6 @@
 class Component:
+    # Subclasses declare empty __slots__ too, so no instance carries a __dict__
+    __slots__ = ("inputs", "outputs", "inner_links", "inner_components", "backend")
 
     def __init__(self):
         # [value, [[inner_component1_index, inner_component1_input_index], [], ... ]]
@@ -8,6 +10,23 @@ class Component:
         # {inner_component_index: [[inner_component_output_index, inner_component_index, inner_component_input_index]]]}
         self.inner_links = {}
         self.inner_components = []
+        # Compiled simulator used by evaluate() instead of walking inner_components, see set_backend()
+        self.backend = None
+
+    def set_backend(self, name):
+        # "reference" walks the tree in evaluate(), the others compile the current wiring once,
+        # so call it again after rewiring the component
+        if name == "reference":
+            self.backend = None
+        else:
+            from Netlist import compile_backend
+            self.backend = compile_backend(self, name)
+
+    def validate(self, ignore=()):
+        # Raises ValueError for dangling or multiply driven inputs, combinational cycles and inner components that
+        # read outputs of later ones, anywhere in the tree. ignore lists kinds of Connectivity.problems() to allow.
+        from Connectivity import validate
+        validate(self, ignore)
 
     def set_input(self, index, value):
         self.inputs[index][0] = value
@@ -30,25 +49,41 @@ class Component:
         return outputs
 
     def connect_input(self, index, inner_component_index, inner_component_input_index, default_value=0):
-        if index > len(self.inputs):
+        if index < 0 or index > len(self.inputs):
             raise ValueError(f"Next index has to be {len(self.inputs)}")
         if index < len(self.inputs):
             inp = self.inputs[index]
             connections = inp[1]
             connections.append([inner_component_index, inner_component_input_index])
         else:
-            self.inputs.insert(index, [default_value, [[inner_component_index, inner_component_input_index]]])
+            self.inputs.append([default_value, [[inner_component_index, inner_component_input_index]]])
 
     def disconnect_input(self, index, inner_component_index, inner_component_input_index):
-        if index > len(self.inputs):
+        if index < 0 or index >= len(self.inputs):
             raise ValueError(f"Index out of range of array of inputs")
         inp = self.inputs[index]
         connections = inp[1]
+        # Connectivity.ConnectionGraph removes connections without searching the list
         connections.remove([inner_component_index, inner_component_input_index])
 
     def connect_output(self, index, inner_component_index, inner_component_output_index):
         self.outputs.append([index, inner_component_index, inner_component_output_index])
 
+    def add_inner_component(self, inner_component):
+        self.inner_components.append(inner_component)
+        return len(self.inner_components) - 1
+
+    def clone(self):
+        # Copies the input and output values but shares the wiring lists with self,
+        # so don't call connect_* or disconnect_* on a clone or on the component it was cloned from
+        component = object.__new__(type(self))
+        component.inputs = [list(inp) for inp in self.inputs]
+        component.outputs = [list(out) for out in self.outputs]
+        component.inner_links = self.inner_links
+        component.inner_components = [inner_component.clone() for inner_component in self.inner_components]
+        component.backend = None
+        return component
+
     def connect_inner_components(self, out_component_index, out_component_output_index, in_component_index, in_component_input_index):
         link = self.inner_links.get(out_component_index)
         if link is None:
@@ -56,7 +91,55 @@ class Component:
         else:
             link.append([out_component_output_index, in_component_index, in_component_input_index])
 
+    def tick(self):
+        # Rising clock edge, flip-flops capture the value the last evaluate() left on their input
+        if self.backend is not None:
+            self.backend.tick()
+            return
+        for inner_component in self.inner_components:
+            inner_component.tick()
+
+    def get_state(self):
+        state = [out[0] for out in self.outputs]
+        for inner_component in self.inner_components:
+            state.extend(inner_component.get_state())
+        return state
+
+    def settle(self, max_iterations=64):
+        # Evaluates until no output in the tree changes, for feedback in inner_links or inner components out of order
+        if not self.inner_components:
+            self.evaluate()
+            return
+        if self.backend is not None:
+            # The compiled netlist iterates feedback itself
+            Component.evaluate(self)
+            return
+        state = self.get_state()
+        seen = {tuple(state)}
+        for _ in range(max_iterations):
+            Component.evaluate(self)
+            new_state = self.get_state()
+            if new_state == state:
+                return
+            key = tuple(new_state)
+            if key in seen:
+                raise ValueError(f"{type(self).__name__} oscillates")
+            seen.add(key)
+            state = new_state
+        raise ValueError(f"{type(self).__name__} did not settle in {max_iterations} evaluations")
+
+    def step(self, n_cycles=1):
+        for _ in range(n_cycles):
+            self.settle()
+            self.tick()
+        self.settle()
+
     def evaluate(self):
+        if self.backend is not None:
+            outputs = self.backend.evaluate([inp[0] for inp in self.inputs])
+            for out, value in zip(self.outputs, outputs):
+                out[0] = value
+            return
         for inp in self.inputs:
             value = inp[0]
             inner_components = inp[1]
@@ -80,6 +163,7 @@ class Component:
 
 
 class AndGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -88,12 +172,13 @@ class AndGate(Component):
 
     def evaluate(self):
         if self.get_input(0) and self.get_input(1):
-            self.outputs[0] = [1, None, None]
+            self.outputs[0][0] = 1
         else:
-            self.outputs[0] = [0, None, None]
+            self.outputs[0][0] = 0
 
 
 class OrGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -102,12 +187,13 @@ class OrGate(Component):
 
     def evaluate(self):
         if self.get_input(0) or self.get_input(1):
-            self.outputs[0] = [1, None, None]
+            self.outputs[0][0] = 1
         else:
-            self.outputs[0] = [0, None, None]
+            self.outputs[0][0] = 0
 
 
 class NandGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -116,12 +202,13 @@ class NandGate(Component):
 
     def evaluate(self):
         if self.get_input(0) and self.get_input(1):
-            self.outputs[0] = [0, None, None]
+            self.outputs[0][0] = 0
         else:
-            self.outputs[0] = [1, None, None]
+            self.outputs[0][0] = 1
 
 
 class NorGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -130,12 +217,13 @@ class NorGate(Component):
 
     def evaluate(self):
         if not self.get_input(0) and not self.get_input(1):
-            self.outputs[0] = [1, None, None]
+            self.outputs[0][0] = 1
         else:
-            self.outputs[0] = [0, None, None]
+            self.outputs[0][0] = 0
 
 
 class NotGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -144,12 +232,39 @@ class NotGate(Component):
 
     def evaluate(self):
         if self.get_input(0):
-            self.outputs[0] = [0, None, None]
+            self.outputs[0][0] = 0
         else:
-            self.outputs[0] = [1, None, None]
+            self.outputs[0][0] = 1
+
+
+class DFlipFlop(Component):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = [[0, None, None]]
+        self.outputs = [[0, None, None]]
+
+    def evaluate(self):
+        # Q only changes on the clock edge
+        pass
+
+    def tick(self):
+        self.outputs[0][0] = self.inputs[0][0]
+
+
+class TieLow(AndGate):
+    # Constant 0 with nothing connected to its inputs, Connectivity.validate() accepts its open inputs
+    __slots__ = ()
+
+
+class TieHigh(NotGate):
+    # Constant 1 with nothing connected to its input
+    __slots__ = ()
 
 
 class XorGate(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -164,6 +279,7 @@ class XorGate(Component):
 
 
 class HalfAdder(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -178,31 +294,34 @@ class HalfAdder(Component):
 
 
 class TwoBitAddressDecoder(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
+        # The NotGates come first so their outputs are settled before the AndGates that read them
         # A and B
-        self.connect_input(0, 0, 0)
-        self.connect_input(1, 0, 1)
+        self.connect_input(0, 2, 0)
+        self.connect_input(1, 2, 1)
         # A and not B
-        self.connect_input(0, 1, 0)
-        self.connect_input(1, 2, 0)
-        # not A and B
         self.connect_input(0, 3, 0)
+        self.connect_input(1, 0, 0)
+        # not A and B
+        self.connect_input(0, 1, 0)
         self.connect_input(1, 4, 1)
         # A nor B
         self.connect_input(0, 5, 0)
         self.connect_input(1, 5, 1)
-        self.connect_output(0, 0, 0)
-        self.connect_output(1, 1, 0)
+        self.connect_output(0, 2, 0)
+        self.connect_output(1, 3, 0)
         self.connect_output(2, 4, 0)
         self.connect_output(3, 5, 0)
-        self.connect_inner_components(2, 0, 1, 1)
-        self.connect_inner_components(3, 0, 4, 0)
-        self.inner_components = [AndGate(), AndGate(), NotGate(), NotGate(), AndGate(), NorGate()]
+        self.connect_inner_components(0, 0, 3, 1)
+        self.connect_inner_components(1, 0, 4, 0)
+        self.inner_components = [NotGate(), NotGate(), AndGate(), AndGate(), AndGate(), NorGate()]
 
 
 class TwoToOneMultiplexer(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -218,6 +337,7 @@ class TwoToOneMultiplexer(Component):
 
 
 class FullAdder(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -241,6 +361,7 @@ class FullAdder(Component):
 
 
 class EightBitBinaryAdder(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -280,6 +401,7 @@ class EightBitBinaryAdder(Component):
 
 
 class TwoBit2sComplementAdderSubtractor(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -294,6 +416,7 @@ class TwoBit2sComplementAdderSubtractor(Component):
 
 
 class EightBit2sComplementAdderSubtractor(Component):
+    __slots__ = ()
 
     def __init__(self):
         super().__init__()
@@ -343,6 +466,304 @@ class EightBit2sComplementAdderSubtractor(Component):
                                  TwoBit2sComplementAdderSubtractor(), TwoBit2sComplementAdderSubtractor()]
 
 
+class SRLatch(Component):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        self.connect_input(0, 1, 0)  # Inp S to NorGate 1 Inp 0
+        self.connect_input(1, 0, 0)  # Inp R to NorGate 0 Inp 0
+        self.connect_inner_components(0, 0, 1, 1)  # NorGate 0 output Q to NorGate 1 Inp 1
+        self.connect_inner_components(1, 0, 0, 1)  # NorGate 1 output not Q to NorGate 0 Inp 1
+        self.connect_output(0, 0, 0)  # Out 0 Q
+        self.connect_output(1, 1, 0)  # Out 1 not Q
+        self.inner_components = [NorGate(), NorGate()]
+
+    def evaluate(self):
+        # The NorGates feed each other, so a single pass isn't enough
+        self.settle()
+
+
+class DLatch(Component):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        self.connect_input(0, 0, 0)  # Inp D to NotGate Inp 0
+        self.connect_input(0, 1, 0)  # Inp D to AndGate 0 Inp 0
+        self.connect_input(1, 1, 1)  # Inp Enable to AndGate 0 Inp 1
+        self.connect_input(1, 2, 1)  # Inp Enable to AndGate 1 Inp 1
+        self.connect_inner_components(0, 0, 2, 0)  # NotGate output to AndGate 1 Inp 0
+        self.connect_inner_components(1, 0, 3, 0)  # AndGate 0 output to SRLatch S
+        self.connect_inner_components(2, 0, 3, 1)  # AndGate 1 output to SRLatch R
+        self.connect_output(0, 3, 0)  # Out 0 Q
+        self.connect_output(1, 3, 1)  # Out 1 not Q
+        self.inner_components = [NotGate(), AndGate(), AndGate(), SRLatch()]
+
+
+class EightBitRegister(Component):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        # The DFlipFlops come first so the multiplexers see their current Q
+        for i in range(8):
+            self.connect_input(i, 8 + i, 0)  # Inp i to Multiplexer i Inp 0
+        for i in range(8):
+            self.connect_input(8, 8 + i, 2)  # Inp 8 load to Multiplexer i selector
+        for i in range(8):
+            self.connect_inner_components(i, 0, 8 + i, 1)  # DFlipFlop i Q to Multiplexer i Inp 1, kept when not loading
+            self.connect_inner_components(8 + i, 0, i, 0)  # Multiplexer i to DFlipFlop i D
+            self.connect_output(i, i, 0)  # DFlipFlop i Q to Out i
+        self.inner_components = [DFlipFlop() for _ in range(8)] + [TwoToOneMultiplexer() for _ in range(8)]
+
+
+class EightBitAccumulator(Component):
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__()
+        for i in range(8):
+            self.connect_input(i, 1, 8 + i)  # Inp i to Adder Inp 8 + i
+        self.connect_input(8, 0, 8)  # Inp 8 to Register load, the sum is stored on each clock edge while it is 1
+        for i in range(8):
+            self.connect_inner_components(0, i, 1, i)  # Register Out i to Adder Inp i
+            self.connect_inner_components(1, i + 1, 0, i)  # Adder sum bit i to Register Inp i, the carry is dropped
+            self.connect_output(i, 0, i)  # Register Out i to Out i
+        self.inner_components = [EightBitRegister(), EightBitBinaryAdder()]
+
+
+# {component_class: instance built once and cloned by instantiate()}
+_templates = {}
+
+
+def instantiate(component_class):
+    # Cheaper than component_class() for classes without constructor arguments,
+    # the template is only built the first time a class is asked for
+    template = _templates.get(component_class)
+    if template is None:
+        template = component_class()
+        _templates[component_class] = template
+    return template.clone()
+
+
+class RippleCarryAdder(Component):
+    __slots__ = ()
+
+    def __init__(self, n):
+        super().__init__()
+        # Same layout as EightBitBinaryAdder: Inp 0 to n - 1 are A and Inp n to 2n - 1 are B, most significant bit first,
+        # Out 0 is the carry and Out 1 to n the sum, most significant bit first. Adder 0 is the HalfAdder on bit 0.
+        for i in range(n):
+            self.connect_input(i, n - 1 - i, 1)  # Inp i to Adder n - 1 - i Inp 1
+        for i in range(n):
+            self.connect_input(n + i, n - 1 - i, 0)  # Inp n + i to Adder n - 1 - i Inp 0
+        for i in range(n - 1):
+            self.connect_inner_components(i, 1, i + 1, 2)  # Adder i carry to Adder i + 1 Inp 2
+        self.connect_output(0, n - 1, 1)  # Last Adder carry to Out 0
+        for i in range(n):
+            self.connect_output(1 + i, n - 1 - i, 0)  # Adder n - 1 - i sum to Out 1 + i
+        self.inner_components = [instantiate(HalfAdder)] + [instantiate(FullAdder) for _ in range(n - 1)]
+
+
+class AdderSubtractor(Component):
+    __slots__ = ()
+
+    def __init__(self, n):
+        super().__init__()
+        # Same layout as EightBit2sComplementAdderSubtractor with Inp 2n as the subtract signal
+        for i in range(n):
+            self.connect_input(i, n - 1 - i, 0)  # Inp i to Adder n - 1 - i Inp 0
+        for i in range(n):
+            self.connect_input(n + i, n - 1 - i, 1)  # Inp n + i to Adder n - 1 - i Inp 1
+        for i in range(n):
+            self.connect_input(2 * n, n - 1 - i, 2)  # Inp 2n to Adder n - 1 - i Inp 2
+        self.connect_input(2 * n, 0, 3)  # Inp 2n to Adder 0 carry inp
+        for i in range(n - 1):
+            self.connect_inner_components(i, 1, i + 1, 3)  # Adder i carry to Adder i + 1 carry inp
+        self.connect_output(0, n - 1, 1)  # Last Adder carry to Out 0
+        for i in range(n):
+            self.connect_output(1 + i, n - 1 - i, 0)  # Adder n - 1 - i sum to Out 1 + i
+        self.inner_components = [instantiate(TwoBit2sComplementAdderSubtractor) for _ in range(n)]
+
+
+class Wiring:
+    # Builds a component one inner component at a time. Signals are (None, input index) for the inputs of the
+    # component and (inner component index, output index) for everything else. Inner components are appended
+    # in the order they are created, which keeps them topologically sorted.
+
+    def __init__(self, component):
+        self.component = component
+        # {input index: [[inner_component_index, inner_component_input_index]]}, connected in order by finish()
+        self.input_connections = {}
+
+    def add(self, component_class, *signals):
+        index = self.component.add_inner_component(instantiate(component_class))
+        for input_index, (source_index, source_output_index) in enumerate(signals):
+            if source_index is None:
+                self.input_connections.setdefault(source_output_index, []).append([index, input_index])
+            else:
+                self.component.connect_inner_components(source_index, source_output_index, index, input_index)
+        return index
+
+    def gate(self, component_class, *signals):
+        return self.add(component_class, *signals), 0
+
+    def tree(self, component_class, signals):
+        # Balanced tree of two input gates, for wide ANDs and ORs
+        while len(signals) > 1:
+            paired = [self.gate(component_class, signals[i], signals[i + 1]) for i in range(0, len(signals) - 1, 2)]
+            if len(signals) % 2:
+                paired.append(signals[-1])
+            signals = paired
+        return signals[0]
+
+    def finish(self):
+        for index in sorted(self.input_connections):
+            for inner_component_index, inner_component_input_index in self.input_connections[index]:
+                self.component.connect_input(index, inner_component_index, inner_component_input_index)
+
+
+class FastAdderSubtractor(Component):
+    __slots__ = ()
+
+    def __init__(self, n=8):
+        if type(self) in (FastAdderSubtractor, PrefixAdderSubtractor):
+            raise TypeError(f"{type(self).__name__} only holds the shared wiring, use CarryLookaheadAdderSubtractor, "
+                            f"CarrySelectAdderSubtractor, KoggeStoneAdderSubtractor or BrentKungAdderSubtractor")
+        super().__init__()
+        # Same layout as EightBit2sComplementAdderSubtractor, subclasses only differ in how the carries are computed
+        wiring = Wiring(self)
+        subtract = (None, 2 * n)
+        generate = []
+        propagate = []
+        for i in range(n):  # i is the bit number, 0 is the least significant bit
+            a = (None, n - 1 - i)
+            b = wiring.gate(XorGate, (None, 2 * n - 1 - i), subtract)  # B or its 1s complement
+            generate.append(wiring.gate(AndGate, a, b))
+            propagate.append(wiring.gate(XorGate, a, b))
+        # carries[i] is the carry into bit i, carries[n] the carry out. Subtracting adds 1 through the carry in.
+        carries, sums = self.build_carries(wiring, generate, propagate, subtract)
+        if sums is None:
+            sums = [wiring.gate(XorGate, propagate[i], carries[i]) for i in range(n)]
+        self.connect_output(0, *carries[n])
+        for i in range(n):
+            self.connect_output(1 + i, *sums[n - 1 - i])
+        wiring.finish()
+
+    def build_carries(self, wiring, generate, propagate, carry_in):
+        # Returns the carries and optionally the sum bits, None to have them computed from the carries.
+        # Every subclass overrides it, __init__() refuses to build the base classes.
+        raise NotImplementedError(f"{type(self).__name__} doesn't implement build_carries()")
+
+
+class CarryLookaheadAdderSubtractor(FastAdderSubtractor):
+    __slots__ = ()
+    BLOCK_SIZE = 4
+
+    def build_carries(self, wiring, generate, propagate, carry_in):
+        # Two level lookahead inside each block, the block carries ripple from one block to the next
+        carries = [carry_in]
+        for start in range(0, len(generate), self.BLOCK_SIZE):
+            block_carry_in = carries[start]
+            for j in range(start, min(start + self.BLOCK_SIZE, len(generate))):
+                # c[j + 1] = g[j] + p[j] g[j - 1] + ... + p[j] ... p[start] c[start]
+                terms = [generate[j]]
+                for t in range(j - 1, start - 1, -1):
+                    terms.append(wiring.tree(AndGate, propagate[t + 1:j + 1] + [generate[t]]))
+                terms.append(wiring.tree(AndGate, propagate[start:j + 1] + [block_carry_in]))
+                carries.append(wiring.tree(OrGate, terms))
+        return carries, None
+
+
+class CarrySelectAdderSubtractor(FastAdderSubtractor):
+    __slots__ = ()
+    BLOCK_SIZE = 4
+
+    def ripple(self, wiring, generate, propagate, carry):
+        # Ripple carry over one block, carry is a signal or the constants 0 and 1
+        sums = []
+        for g, p in zip(generate, propagate):
+            if carry == 0:
+                sums.append(p)
+                carry = g
+            elif carry == 1:
+                sums.append(wiring.gate(NotGate, p))
+                carry = wiring.gate(OrGate, g, p)
+            else:
+                sums.append(wiring.gate(XorGate, p, carry))
+                carry = wiring.gate(OrGate, g, wiring.gate(AndGate, p, carry))
+        return sums, carry
+
+    def build_carries(self, wiring, generate, propagate, carry_in):
+        # Each block after the first computes its sum for both carry ins and the real carry picks one
+        n = len(generate)
+        sums, carry = self.ripple(wiring, generate[:self.BLOCK_SIZE], propagate[:self.BLOCK_SIZE], carry_in)
+        carries = [None] * n + [None]
+        for start in range(self.BLOCK_SIZE, n, self.BLOCK_SIZE):
+            block = slice(start, start + self.BLOCK_SIZE)
+            sums_0, carry_0 = self.ripple(wiring, generate[block], propagate[block], 0)
+            sums_1, carry_1 = self.ripple(wiring, generate[block], propagate[block], 1)
+            # The multiplexer outputs Inp 0 when its selector is 1
+            for sum_0, sum_1 in zip(sums_0, sums_1):
+                sums.append(wiring.gate(TwoToOneMultiplexer, sum_1, sum_0, carry))
+            carry = wiring.gate(TwoToOneMultiplexer, carry_1, carry_0, carry)
+        carries[n] = carry
+        return carries, sums
+
+
+class PrefixAdderSubtractor(FastAdderSubtractor):
+    __slots__ = ()
+
+    def combine(self, wiring, high, low):
+        # (G, P) o (G', P') = (G + P G', P P'), P is None once the span reaches the carry in
+        g, p = high
+        low_g, low_p = low
+        new_g = wiring.gate(OrGate, g, wiring.gate(AndGate, p, low_g))
+        new_p = wiring.gate(AndGate, p, low_p) if low_p is not None else None
+        return new_g, new_p
+
+    def build_carries(self, wiring, generate, propagate, carry_in):
+        # Element 0 is the carry in, element i + 1 is bit i. After the prefix element i holds the carry into bit i.
+        spans = [(carry_in, None)] + list(zip(generate, propagate))
+        self.prefix(wiring, spans)
+        return [g for g, p in spans], None
+
+    def prefix(self, wiring, spans):
+        # Combines spans in place until element i covers bits 0 to i - 1 and the carry in
+        raise NotImplementedError(f"{type(self).__name__} doesn't implement prefix()")
+
+
+class KoggeStoneAdderSubtractor(PrefixAdderSubtractor):
+    __slots__ = ()
+
+    def prefix(self, wiring, spans):
+        # log2(n) levels, every element combines with the one distance positions below it
+        distance = 1
+        while distance < len(spans):
+            previous = list(spans)
+            for i in range(distance, len(spans)):
+                spans[i] = self.combine(wiring, previous[i], previous[i - distance])
+            distance *= 2
+
+
+class BrentKungAdderSubtractor(PrefixAdderSubtractor):
+    __slots__ = ()
+
+    def prefix(self, wiring, spans):
+        # Up sweep builds power of two spans, down sweep fills in the elements in between
+        distance = 1
+        while distance < len(spans):
+            for i in range(2 * distance - 1, len(spans), 2 * distance):
+                spans[i] = self.combine(wiring, spans[i], spans[i - distance])
+            distance *= 2
+        distance //= 2
+        while distance >= 1:
+            for i in range(3 * distance - 1, len(spans), 2 * distance):
+                spans[i] = self.combine(wiring, spans[i], spans[i - distance])
+            distance //= 2
+
+
 if __name__ == "__main__":
     and_gate = AndGate()
     assert and_gate.get_output(0) == 0
@@ -740,3 +1161,91 @@ if __name__ == "__main__":
     adder_subtractor.evaluate()
     assert adder_subtractor.get_all_outputs() == [0, 1, 0, 1, 0, 0, 1, 0, 1]
 
+    sr_latch = SRLatch()
+    sr_latch.set_input(0, 1)  # Set
+    sr_latch.set_input(1, 0)
+    sr_latch.evaluate()
+    assert sr_latch.get_all_outputs() == [1, 0]
+    sr_latch.set_input(0, 0)  # Hold
+    sr_latch.evaluate()
+    assert sr_latch.get_all_outputs() == [1, 0]
+    sr_latch.set_input(1, 1)  # Reset
+    sr_latch.evaluate()
+    assert sr_latch.get_all_outputs() == [0, 1]
+    sr_latch.set_input(1, 0)  # Hold
+    sr_latch.evaluate()
+    assert sr_latch.get_all_outputs() == [0, 1]
+
+    d_latch = DLatch()
+    d_latch.set_inputs_from_array([1, 1])
+    d_latch.evaluate()
+    assert d_latch.get_output(0) == 1
+    d_latch.set_inputs_from_array([0, 0])  # Disabled, keeps 1
+    d_latch.evaluate()
+    assert d_latch.get_output(0) == 1
+    d_latch.set_inputs_from_array([0, 1])
+    d_latch.evaluate()
+    assert d_latch.get_output(0) == 0
+
+    register = EightBitRegister()
+    register.set_inputs_from_array([1, 0, 1, 0, 1, 0, 1, 0, 1])
+    register.step()
+    assert register.get_all_outputs() == [1, 0, 1, 0, 1, 0, 1, 0]
+    register.set_inputs_from_array([0, 0, 0, 0, 0, 0, 0, 0, 0])  # Not loading
+    register.step()
+    assert register.get_all_outputs() == [1, 0, 1, 0, 1, 0, 1, 0]
+
+    accumulator = EightBitAccumulator()
+    accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 1, 1, 1])  # Add 3 on every clock edge
+    accumulator.step(5)
+    assert accumulator.get_all_outputs() == [0, 0, 0, 0, 1, 1, 1, 1]  # 15
+    accumulator.step(81)
+    assert accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 0, 1, 0]  # 258 & 0xFF
+
+    oscillator = Component()
+    oscillator.connect_output(0, 0, 0)
+    oscillator.connect_inner_components(0, 0, 0, 0)  # NotGate output back to its own input
+    oscillator.inner_components = [NotGate()]
+    try:
+        oscillator.settle()
+        assert False
+    except ValueError:
+        pass
+
+    ripple_adder = RippleCarryAdder(8)
+    ripple_adder.set_inputs_from_array([1, 0, 1, 0, 1, 0, 1, 0,
+                                        1, 1, 0, 0, 1, 1, 0, 0])
+    ripple_adder.evaluate()
+    assert ripple_adder.get_all_outputs() == [1, 0, 1, 1, 1, 0, 1, 1, 0]
+    wide_adder = RippleCarryAdder(16)
+    wide_adder.set_inputs_from_array([1] * 16 + [0] * 15 + [1])  # 0xFFFF + 1
+    wide_adder.evaluate()
+    assert wide_adder.get_all_outputs() == [1] + [0] * 16
+
+    wide_adder_subtractor = AdderSubtractor(16)
+    wide_adder_subtractor.set_inputs_from_array([0] * 13 + [1, 0, 1] +  # 5
+                                                [0] * 9 + [1, 1, 0, 0, 0, 0, 0] +  # 96
+                                                [1])  # Subtract
+    wide_adder_subtractor.evaluate()
+    assert wide_adder_subtractor.get_all_outputs() == [0] + [1] * 9 + [0, 1, 0, 0, 1, 0, 1]  # -91
+    assert len(AdderSubtractor(8).inputs) == len(EightBit2sComplementAdderSubtractor().inputs)
+
+    for fast_adder_class in [CarryLookaheadAdderSubtractor, CarrySelectAdderSubtractor, KoggeStoneAdderSubtractor,
+                             BrentKungAdderSubtractor]:
+        fast_adder = fast_adder_class()
+        for inputs in [[0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 0],  # 96 + 5
+                       [0, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 1],  # 96 - 5
+                       [0, 0, 0, 0, 0, 1, 0, 1, 0, 1, 1, 0, 0, 0, 0, 0, 1],  # 5 - 96
+                       [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0]]:  # 255 + 255
+            adder_subtractor.set_inputs_from_array(inputs)
+            adder_subtractor.evaluate()
+            fast_adder.set_inputs_from_array(inputs)
+            fast_adder.evaluate()
+            assert fast_adder.get_all_outputs() == adder_subtractor.get_all_outputs(), fast_adder_class.__name__
+
+    for base_class in [FastAdderSubtractor, PrefixAdderSubtractor]:
+        try:
+            base_class(8)
+            assert False
+        except TypeError as error:
+            assert "KoggeStoneAdderSubtractor" in str(error)
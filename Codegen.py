@@ -0,0 +1,199 @@
+import os
+
+from Netlist import AND, OR, NAND, NOR, NOT, CONST_0, CONST_1, COMPILER_HASH, compile_component, structural_hash
+
+# Bump when the generated code changes so stale files in the cache are ignored, changes to compile_component() are
+# covered by COMPILER_HASH
+CODEGEN_VERSION = 1
+
+CACHE_DIR = os.environ.get("CIRCUIT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "circuit-simulation"))
+
+# {cache key: (function, initial_state)} for everything generated or loaded by this process
+_generated = {}
+
+
+def net_name(net):
+    # m is 1 for single vectors and the all-ones mask for packed words
+    if net == CONST_0:
+        return "0"
+    if net == CONST_1:
+        return "m"
+    return f"n{net}"
+
+
+def live_gates(netlist):
+    # Gates whose output reaches an output or a DFlipFlop, walking the topological order backwards
+    needed = set(netlist.output_nets)
+    needed.update(d for d, q, initial in netlist.registers)
+    live = []
+    for gate in reversed(netlist.gates):
+        if gate[3] in needed:
+            live.append(gate)
+            needed.add(gate[1])
+            needed.add(gate[2])
+    live.reverse()
+    return live
+
+
+def generate_source(netlist, title="circuit"):
+    if netlist.feedback:
+        raise ValueError("Straight-line code can't be generated for combinational feedback")
+    lines = [f"# Generated from {title}, do not edit",
+             f"INITIAL_STATE = {[initial for d, q, initial in netlist.registers]}",
+             "",
+             "",
+             "def evaluate(inputs, state, m=1):"]
+    if netlist.input_nets:
+        lines.append(f"    {', '.join(net_name(net) for net in netlist.input_nets)}, = inputs")
+    if netlist.registers:
+        lines.append(f"    {', '.join(net_name(q) for d, q, initial in netlist.registers)}, = state")
+    for op, a, b, out in live_gates(netlist):
+        a = net_name(a)
+        b = net_name(b)
+        if op == AND:
+            expression = f"{a} & {b}"
+        elif op == OR:
+            expression = f"{a} | {b}"
+        elif op == NAND:
+            expression = f"m ^ ({a} & {b})"
+        elif op == NOR:
+            expression = f"m ^ ({a} | {b})"
+        elif op == NOT:
+            expression = f"m ^ {a}"
+        else:
+            expression = a
+        lines.append(f"    {net_name(out)} = {expression}")
+    outputs = ", ".join(net_name(net) for net in netlist.output_nets)
+    next_state = ", ".join(net_name(d) for d, q, initial in netlist.registers)
+    lines.append(f"    return [{outputs}], [{next_state}]")
+    return "\n".join(lines) + "\n"
+
+
+def load_source(source, filename):
+    namespace = {}
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["evaluate"], namespace["INITIAL_STATE"]
+
+
+class GeneratedCircuit:
+
+    def __init__(self, function, initial_state, component=None):
+        self.function = function
+        self.initial_state = initial_state
+        # Compiled only when evaluate_words() is asked for nets the generated code doesn't return
+        self.component = component
+        self.netlist = None
+        self.reset()
+
+    def reset(self):
+        self.state = list(self.initial_state)
+        self.next_state = self.state
+
+    def evaluate(self, inputs):
+        outputs, self.next_state = self.function(inputs, self.state)
+        return outputs
+
+    def evaluate_words(self, words, mask, input_nets=None, output_nets=None):
+        # Same generated code on packed words, like Netlist.evaluate_words() DFlipFlop outputs read as 0. Other nets
+        # than the component inputs and outputs go through the netlist of the component.
+        if input_nets is not None or output_nets is not None:
+            if self.netlist is None:
+                self.netlist = compile_component(self.component)
+            return self.netlist.evaluate_words(words, mask, input_nets, output_nets)
+        outputs, next_state = self.function(words, [mask ^ mask] * len(self.state), mask)
+        return outputs
+
+    def tick(self):
+        self.state = self.next_state
+
+
+def compile_generated(component, cache_dir=CACHE_DIR):
+    key = f"{structural_hash(component)}-v{CODEGEN_VERSION}-{COMPILER_HASH}"
+    generated = _generated.get(key)
+    if generated is None:
+        path = os.path.join(cache_dir, f"{key}.py") if cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                source = file.read()
+        else:
+            source = generate_source(compile_component(component), type(component).__name__)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                temporary_path = f"{path}.{os.getpid()}.tmp"
+                with open(temporary_path, "w") as file:
+                    file.write(source)
+                os.replace(temporary_path, path)
+        generated = load_source(source, path or f"<generated {key}>")
+        _generated[key] = generated
+    return GeneratedCircuit(*generated, component)
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import timeit
+
+    from Circuit import EightBit2sComplementAdderSubtractor, EightBitAccumulator, Component, AndGate, OrGate
+    from Netlist import exhaustive_words, int_to_bits
+
+    with tempfile.TemporaryDirectory() as temporary_cache_dir:
+        adder_subtractor = EightBit2sComplementAdderSubtractor()
+        netlist = compile_component(adder_subtractor)
+        generated = compile_generated(adder_subtractor, temporary_cache_dir)
+        assert len(os.listdir(temporary_cache_dir)) == 1
+        for _ in range(500):
+            vector = int_to_bits(random.getrandbits(17), 17)
+            assert generated.evaluate(vector) == netlist.evaluate(vector)
+        words, mask = exhaustive_words(17)
+        assert generated.evaluate_words(words, mask) == netlist.evaluate_words(words, mask)
+
+        # A second process would read the source back from the cache directory
+        _generated.clear()
+        again = compile_generated(EightBit2sComplementAdderSubtractor(), temporary_cache_dir)
+        assert again.evaluate([1] * 17) == netlist.evaluate([1] * 17)
+
+        reference_time = timeit.timeit(adder_subtractor.evaluate, number=200)
+        generated_time = timeit.timeit(lambda: generated.evaluate([1] * 17), number=200)
+        assert generated_time * 10 < reference_time
+
+        accumulator = EightBitAccumulator()
+        accumulator.backend = compile_generated(accumulator, temporary_cache_dir)
+        accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+        accumulator.step(86)
+        assert accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 0, 1, 0]
+
+        # The register state and tied inputs are baked into the source, so they are part of the cache key
+        accumulator = EightBitAccumulator()
+        accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+        accumulator.step(5)
+        compile_generated(accumulator, temporary_cache_dir)
+        fresh = compile_generated(EightBitAccumulator(), temporary_cache_dir)
+        assert fresh.evaluate([0] * 9) == [0] * 8
+
+        # Packed words take the same net selections as the netlist backends
+        netlist = compile_component(accumulator)
+        generated = compile_generated(accumulator, temporary_cache_dir)
+        words, mask = exhaustive_words(9)
+        assert generated.evaluate_words(words, mask) == netlist.evaluate_words(words, mask)
+        q_nets = [q for d, q, initial in netlist.registers]
+        d_nets = [d for d, q, initial in netlist.registers]
+        words, mask = exhaustive_words(17)
+        assert generated.evaluate_words(words, mask, netlist.input_nets + q_nets, d_nets) == \
+            netlist.evaluate_words(words, mask, netlist.input_nets + q_nets, d_nets)
+        for tied_value in (1, 0):
+            tied = Component()
+            tied.connect_input(0, 0, 0)
+            tied.connect_output(0, 0, 0)
+            tied.inner_components = [AndGate()]
+            tied.inner_components[0].set_input(1, tied_value)
+            assert compile_generated(tied, temporary_cache_dir).evaluate([1]) == [tied_value]
+
+    # The OrGate doesn't reach the output and is left out of the generated code
+    dead_gate = Component()
+    dead_gate.connect_input(0, 0, 0)
+    dead_gate.connect_input(1, 0, 1)
+    dead_gate.connect_input(0, 1, 0)
+    dead_gate.connect_input(1, 1, 1)
+    dead_gate.connect_output(0, 0, 0)
+    dead_gate.inner_components = [AndGate(), OrGate()]
+    assert "|" not in generate_source(compile_component(dead_gate))
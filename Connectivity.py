@@ -0,0 +1,425 @@
+from Circuit import Component, DFlipFlop, TieLow, TieHigh
+
+# Kinds of problems found by problems(). Inputs left open on purpose go through a TieLow or TieHigh, any other inner
+# input nothing drives is dangling.
+DANGLING = "dangling input"
+MULTIPLY_DRIVEN = "multiply driven input"
+CYCLE = "combinational cycle"
+OUT_OF_ORDER = "out of order"
+INVALID = "invalid connection"
+
+
+class ConnectionGraph:
+    # Index over the wiring of one component level. Signals follow Wiring: sources are (None, input index) for the
+    # inputs of the component and (inner component index, output index) for inner outputs, sinks are
+    # (inner component index, input index) for inner inputs and (None, output index) for the outputs of the component.
+    # connect() and disconnect() keep component.inputs, inner_links and outputs up to date, so the component
+    # evaluates and compiles as before. Like connect_* on Component, don't use it on a clone or on a template.
+    # The graph is only built once, so once it exists it has to be the only thing rewiring the component: calling
+    # connect_* or disconnect_input() on the component directly leaves the graph out of date.
+
+    def __init__(self, component):
+        self.component = component
+        # {source: {sink: None}} and {sink: {source: None}}, dicts keep the connection order
+        self.fanout_of = {}
+        self.fanin_of = {}
+        # {(source, sink): position of the connection in its list in component.inputs or inner_links}
+        self.positions = {}
+        for index, inp in enumerate(component.inputs):
+            if inp[1] is None:
+                continue
+            for position, (inner_component_index, inner_component_input_index) in enumerate(inp[1]):
+                self.add_edge((None, index), (inner_component_index, inner_component_input_index), position)
+        for out_component_index, links in component.inner_links.items():
+            for position, (out_index, in_component_index, in_input_index) in enumerate(links):
+                self.add_edge((out_component_index, out_index), (in_component_index, in_input_index), position)
+        for index, out in enumerate(component.outputs):
+            if out[1] is not None:
+                self.add_edge((out[1], out[2]), (None, index), index)
+
+    def add_edge(self, source, sink, position):
+        key = (source, sink)
+        if key in self.positions:
+            raise ValueError(f"{source} is already connected to {sink}")
+        self.positions[key] = position
+        self.fanout_of.setdefault(source, {})[sink] = None
+        self.fanin_of.setdefault(sink, {})[source] = None
+
+    def remove_edge(self, source, sink):
+        position = self.positions.pop((source, sink))
+        sinks = self.fanout_of[source]
+        del sinks[sink]
+        if not sinks:
+            del self.fanout_of[source]
+        sources = self.fanin_of[sink]
+        del sources[source]
+        if not sources:
+            del self.fanin_of[sink]
+        return position
+
+    def connections(self, source):
+        # The list in the component that holds the connections of source
+        if source[0] is None:
+            return self.component.inputs[source[1]][1]
+        return self.component.inner_links[source[0]]
+
+    def connect(self, source, sink):
+        # Connects an input of the component or an inner output to an inner input, a source one past the last input
+        # adds an input to the component
+        component = self.component
+        if sink[0] is None:
+            raise ValueError("Use connect_output() for the outputs of the component")
+        if source[0] is None:
+            if source[1] < 0 or source[1] > len(component.inputs):
+                raise ValueError(f"Next index has to be {len(component.inputs)}")
+            if source[1] == len(component.inputs):
+                component.inputs.append([0, []])
+            connections = component.inputs[source[1]][1]
+            entry = [sink[0], sink[1]]
+        else:
+            connections = component.inner_links.setdefault(source[0], [])
+            entry = [source[1], sink[0], sink[1]]
+        self.add_edge(source, sink, len(connections))
+        connections.append(entry)
+
+    def disconnect(self, source, sink):
+        # The last connection of the list takes the place of the removed one, nothing has to be searched or shifted
+        if (source, sink) not in self.positions:
+            raise ValueError(f"{source} isn't connected to {sink}")
+        if sink[0] is None:
+            raise ValueError("Use connect_output() for the outputs of the component")
+        position = self.remove_edge(source, sink)
+        connections = self.connections(source)
+        last = connections.pop()
+        if position < len(connections):
+            connections[position] = last
+            moved = (last[0], last[1]) if source[0] is None else (last[1], last[2])
+            self.positions[(source, moved)] = position
+        if not connections and source[0] is not None:
+            # Keeps the inner_links of a component the same as if the link had never been made
+            del self.component.inner_links[source[0]]
+
+    def connect_output(self, index, source):
+        # Drives output index of the component from an inner output, index one past the last output adds an output
+        outputs = self.component.outputs
+        if index < 0 or index > len(outputs):
+            raise ValueError(f"Next index has to be {len(outputs)}")
+        if index == len(outputs):
+            outputs.append([0, source[0], source[1]])
+        else:
+            old = (outputs[index][1], outputs[index][2])
+            if old[0] is not None:
+                self.remove_edge(old, (None, index))
+            outputs[index][1] = source[0]
+            outputs[index][2] = source[1]
+        self.add_edge(source, (None, index), index)
+
+    def fanin(self, sink):
+        # Sources driving sink, more than one is a multiply driven input
+        return list(self.fanin_of.get(sink, ()))
+
+    def fanout(self, source):
+        return list(self.fanout_of.get(source, ()))
+
+    def problems(self, ignore=()):
+        return [problem for problem in level_problems(self.component, type(self.component).__name__, {}, self)[1]
+                if problem[0] not in ignore]
+
+
+def strongly_connected(successors):
+    # Tarjan's algorithm without recursion, the components come out with the ones nothing leaves first
+    count = len(successors)
+    order = [-1] * count
+    low = [0] * count
+    on_stack = [False] * count
+    stack = []
+    components = []
+    counter = 0
+    for root in range(count):
+        if order[root] >= 0:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [[root, 0]]
+        while work:
+            node, position = work[-1]
+            edges = successors[node]
+            if position < len(edges):
+                work[-1][1] = position + 1
+                successor = edges[position]
+                if order[successor] < 0:
+                    order[successor] = low[successor] = counter
+                    counter += 1
+                    stack.append(successor)
+                    on_stack[successor] = True
+                    work.append([successor, 0])
+                elif on_stack[successor] and order[successor] < low[node]:
+                    low[node] = order[successor]
+                continue
+            work.pop()
+            if work and low[node] < low[work[-1][0]]:
+                low[work[-1][0]] = low[node]
+            if low[node] == order[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+def structure_key(component):
+    # Clones share their inner_links, leaves only differ by class
+    if not component.inner_components:
+        return type(component)
+    return type(component), id(component.inner_links)
+
+
+def combinational_paths(component, memo):
+    # [mask of the outputs each input reaches without passing a DFlipFlop], memo holds them per structure_key()
+    key = structure_key(component)
+    paths = memo.get(key)
+    if paths is None:
+        if component.inner_components:
+            paths = level_problems(component, "", memo)[0]
+        elif isinstance(component, DFlipFlop):
+            paths = [0] * len(component.inputs)
+        else:
+            paths = [(1 << len(component.outputs)) - 1] * len(component.inputs)
+        memo[key] = paths
+    return paths
+
+
+def level_problems(component, path, memo, graph=None):
+    # Checks the wiring of one level as a graph of pins: the inputs and outputs of the component and of every inner
+    # component, linked by the connections and inside each inner component from an input to the outputs it reaches.
+    # Returns ([mask of the outputs each input reaches], [[kind, path, message]]).
+    if graph is None:
+        graph = ConnectionGraph(component)
+    inner_components = component.inner_components
+    found = []
+    input_count = len(component.inputs)
+    output_count = len(component.outputs)
+    # Pin numbers of input 0 and output 0 of every inner component
+    input_base = []
+    output_base = []
+    # Inner component of every pin, None for the pins of the component itself
+    owner = [None] * (input_count + output_count)
+    for index, inner_component in enumerate(inner_components):
+        input_base.append(len(owner))
+        owner.extend([index] * len(inner_component.inputs))
+        output_base.append(len(owner))
+        owner.extend([index] * len(inner_component.outputs))
+    pin_count = len(owner)
+    successors = [[] for _ in range(pin_count)]
+    inner_paths = [combinational_paths(inner_component, memo) for inner_component in inner_components]
+
+    def name(index):
+        return f"inner component {index} ({type(inner_components[index]).__name__})"
+
+    def pin(signal, is_source):
+        index, pin_index = signal
+        if index is None:
+            if 0 <= pin_index < (input_count if is_source else output_count):
+                return pin_index if is_source else input_count + pin_index
+            return None
+        if not 0 <= index < len(inner_components):
+            return None
+        inner_component = inner_components[index]
+        if 0 <= pin_index < len(inner_component.outputs if is_source else inner_component.inputs):
+            return (output_base if is_source else input_base)[index] + pin_index
+        return None
+
+    for (source, sink) in graph.positions:
+        source_pin = pin(source, True)
+        sink_pin = pin(sink, False)
+        if source_pin is None or sink_pin is None:
+            found.append([INVALID, path, f"{source} to {sink} connects a pin that doesn't exist"])
+            continue
+        successors[source_pin].append(sink_pin)
+    for index, paths in enumerate(inner_paths):
+        for input_index, mask in enumerate(paths):
+            while mask:
+                bit = mask & -mask
+                successors[input_base[index] + input_index].append(output_base[index] + bit.bit_length() - 1)
+                mask ^= bit
+    # Outputs each pin reaches, worked out from the components nothing leaves back to the inputs
+    component_of = [0] * pin_count
+    reach = [0] * pin_count
+    for index in range(output_count):
+        reach[input_count + index] = 1 << index
+    components = strongly_connected(successors)
+    for number, members in enumerate(components):
+        mask = 0
+        for member in members:
+            component_of[member] = number
+            mask |= reach[member]
+            for successor in successors[member]:
+                mask |= reach[successor]
+        for member in members:
+            reach[member] = mask
+    for members in components:
+        if len(members) > 1:
+            involved = sorted({owner[member] for member in members if owner[member] is not None})
+            names = ", ".join(f"{index} ({type(inner_components[index]).__name__})" for index in involved)
+            found.append([CYCLE, path, f"inner components {names} feed back into each other"])
+    for index, inner_component in enumerate(inner_components):
+        tied = isinstance(inner_component, (TieLow, TieHigh))
+        for input_index in range(len(inner_component.inputs)):
+            sources = graph.fanin((index, input_index))
+            if tied:
+                if sources:
+                    found.append([INVALID, path, f"input {input_index} of {name(index)} has to stay open"])
+            elif not sources:
+                found.append([DANGLING, path, f"input {input_index} of {name(index)} is not connected"])
+            elif len(sources) > 1:
+                found.append([MULTIPLY_DRIVEN, path, f"input {input_index} of {name(index)} is driven by " +
+                                 ", ".join(str(source) for source in sources)])
+    # evaluate() sets an input once the inner component that drives it has run, too late for an earlier one that
+    # passes it on in the same evaluation
+    for (source, sink) in graph.positions:
+        if source[0] is None or sink[0] is None or sink[0] > source[0]:
+            continue
+        source_pin = pin(source, True)
+        sink_pin = pin(sink, False)
+        if source_pin is None or sink_pin is None or component_of[source_pin] == component_of[sink_pin]:
+            continue
+        if inner_paths[sink[0]][sink[1]]:
+            found.append([OUT_OF_ORDER, path, f"{name(sink[0])} reads output {source[1]} of {name(source[0])}, "
+                                                 f"which is evaluated after it"])
+    return [reach[index] for index in range(input_count)], found
+
+
+def problems(component, ignore=()):
+    # [[kind, instance path, message]] for every level of the tree, each structure is only checked once
+    memo = {}
+    checked = set()
+    found = []
+    # [[component, instance path]]
+    stack = [[component, type(component).__name__]]
+    while stack:
+        current, path = stack.pop()
+        key = structure_key(current)
+        if not current.inner_components or key in checked:
+            continue
+        checked.add(key)
+        paths, level = level_problems(current, path, memo)
+        memo[key] = paths
+        found.extend(problem for problem in level if problem[0] not in ignore)
+        for index in range(len(current.inner_components) - 1, -1, -1):
+            inner_component = current.inner_components[index]
+            stack.append([inner_component, f"{path}/[{index}]/{type(inner_component).__name__}"])
+    return found
+
+
+def validate(component, ignore=()):
+    found = problems(component, ignore)
+    if found:
+        raise ValueError(f"{len(found)} wiring problems:\n" +
+                         "\n".join(f"{kind} in {path}: {message}" for kind, path, message in found))
+
+
+if __name__ == "__main__":
+    import time
+
+    import Circuit
+    from Netlist import compile_component
+
+    # Everything in Circuit.py is wired properly, apart from the latches that are built around their feedback
+    for name in ("XorGate", "FullAdder", "EightBit2sComplementAdderSubtractor", "EightBitRegister",
+                 "EightBitAccumulator", "TwoBitAddressDecoder", "TwoToOneMultiplexer"):
+        getattr(Circuit, name)().validate()
+    for width in (1, 8, 33):
+        for cls in (Circuit.AdderSubtractor, Circuit.KoggeStoneAdderSubtractor, Circuit.BrentKungAdderSubtractor,
+                    Circuit.CarryLookaheadAdderSubtractor, Circuit.CarrySelectAdderSubtractor):
+            cls(width).validate()
+    found = problems(Circuit.DLatch())
+    assert [(kind, path) for kind, path, message in found] == [(CYCLE, "DLatch/[3]/SRLatch")]
+    Circuit.DLatch().validate(ignore=(CYCLE,))
+
+    # Out of order: the AndGate reads the OrGate that comes after it, and its second input is left open
+    broken = Component()
+    broken.connect_input(0, 1, 0)
+    broken.connect_input(1, 1, 1)
+    broken.connect_input(1, 0, 1)
+    broken.connect_inner_components(1, 0, 0, 0)
+    broken.connect_output(0, 0, 0)
+    broken.inner_components = [Circuit.AndGate(), Circuit.OrGate(), Circuit.NotGate()]
+    found = problems(broken)
+    assert sorted(kind for kind, path, message in found) == [DANGLING, OUT_OF_ORDER]
+    assert "input 0 of inner component 2 (NotGate)" in found[0][2] + found[1][2]
+    try:
+        broken.validate()
+        assert False
+    except ValueError as error:
+        assert str(error).startswith("2 wiring problems")
+    graph = ConnectionGraph(broken)
+    graph.connect((None, 0), (0, 0))
+    assert graph.fanin((0, 0)) == [(1, 0), (None, 0)]
+    assert MULTIPLY_DRIVEN in [kind for kind, path, message in graph.problems()]
+    graph.disconnect((1, 0), (0, 0))
+    graph.connect((0, 0), (2, 0))
+    assert graph.problems() == [] and broken.inner_links == {0: [[0, 2, 0]]}
+    graph.connect_output(1, (2, 0))
+    broken.validate()
+    for vector, expected in (([0, 0], [0, 1]), ([1, 1], [1, 0]), ([0, 1], [0, 1])):
+        broken.set_inputs_from_array(vector)
+        broken.evaluate()
+        assert broken.get_all_outputs() == expected and compile_component(broken).evaluate(vector) == expected
+
+    # Constants of imported files come from a TieLow and a TieHigh, an AndGate tied the same way is still dangling
+    import io
+
+    import Formats
+    modules, top = Formats.read_verilog(io.StringIO("module t (y, z, a);\n  output y, z;\n  input a;\n"
+                                                    "  and g (y, a, 1'b1);\n  or h (z, a, 1'b0);\nendmodule\n"))
+    Formats.build_component(modules, top).validate()
+    tied = Component()
+    tied.connect_input(0, 1, 0)
+    tied.connect_output(0, 1, 0)
+    tied.inner_components = [Circuit.TieHigh(), Circuit.AndGate()]
+    assert [kind for kind, path, message in problems(tied)] == [DANGLING]
+    ConnectionGraph(tied).connect((0, 0), (1, 1))
+    tied.validate()
+    ConnectionGraph(tied).connect((None, 0), (0, 0))
+    assert [kind for kind, path, message in problems(tied)] == [INVALID]
+
+    # A combinational loop through two inner components
+    loop = Component()
+    loop.connect_input(0, 0, 0)
+    loop.connect_inner_components(0, 0, 1, 0)
+    loop.connect_inner_components(1, 0, 0, 1)
+    loop.connect_output(0, 1, 0)
+    loop.inner_components = [Circuit.AndGate(), Circuit.NotGate()]
+    assert [kind for kind, path, message in problems(loop)] == [CYCLE]
+
+    # The bounds of Component.connect_input() and disconnect_input()
+    for call in (lambda: loop.connect_input(-1, 0, 0), lambda: loop.connect_input(2, 0, 0),
+                 lambda: loop.disconnect_input(1, 0, 0), lambda: loop.disconnect_input(-1, 0, 0)):
+        try:
+            call()
+            assert False
+        except ValueError:
+            pass
+
+    # Rewiring a wide component is linear in the number of connections, where disconnect_input() searches the list
+    count = 200000
+    wide = Component()
+    wide.inner_components = [Circuit.NotGate() for _ in range(count)]
+    graph = ConnectionGraph(wide)
+    started = time.perf_counter()
+    for index in range(count):
+        graph.connect((None, 0), (index, 0))
+    assert len(graph.fanout((None, 0))) == count and graph.fanin((count - 1, 0)) == [(None, 0)]
+    for index in range(0, count, 2):
+        graph.disconnect((None, 0), (index, 0))
+    seconds = time.perf_counter() - started
+    assert sorted(wide.inputs[0][1]) == [[index, 0] for index in range(1, count, 2)]
+    assert all(graph.positions[((None, 0), tuple(entry))] == position
+               for position, entry in enumerate(wide.inputs[0][1]))
+    print(f"{count} connections made and {count // 2} removed in {seconds:.2f}s")
@@ -0,0 +1,248 @@
+import time
+
+from Netlist import AND, OR, NAND, NOR, NOT, CONST_1, Netlist, compile_component
+
+# BDD operations besides AND and OR of Netlist
+XOR = 6
+
+FALSE = 0
+TRUE = 1
+
+
+class BDD:
+
+    def __init__(self, variable_count, max_nodes=1000000):
+        # Reduced ordered BDD over variables 0 to variable_count - 1, variable 0 is tested first.
+        # Node 0 is the constant 0 and node 1 the constant 1, the terminals sit below the last variable.
+        self.variable_count = variable_count
+        self.max_nodes = max_nodes
+        self.level = [variable_count, variable_count]
+        self.low = [FALSE, TRUE]
+        self.high = [FALSE, TRUE]
+        # {(level, low, high): node}, so every function has exactly one node
+        self.unique = {}
+        # {(op, f, g): node} of every apply() so far
+        self.computed = {}
+
+    def node(self, level, low, high):
+        if low == high:
+            return low
+        key = (level, low, high)
+        node = self.unique.get(key)
+        if node is None:
+            node = len(self.level)
+            if node >= self.max_nodes:
+                raise ValueError(f"BDD grew past {self.max_nodes} nodes, try another variable order")
+            self.level.append(level)
+            self.low.append(low)
+            self.high.append(high)
+            self.unique[key] = node
+        return node
+
+    def variable(self, index):
+        return self.node(index, FALSE, TRUE)
+
+    def apply(self, op, f, g):
+        if f > g:
+            f, g = g, f
+        if g <= TRUE:
+            if op == AND:
+                return f & g
+            if op == OR:
+                return f | g
+            return f ^ g
+        if op == AND:
+            if f == FALSE or f == g:
+                return f
+            if f == TRUE:
+                return g
+        elif op == OR:
+            if f == TRUE or f == g:
+                return f
+            if f == FALSE:
+                return g
+        else:
+            if f == g:
+                return FALSE
+            if f == FALSE:
+                return g
+        key = (op, f, g)
+        node = self.computed.get(key)
+        if node is not None:
+            return node
+        level_f = self.level[f]
+        level_g = self.level[g]
+        level = min(level_f, level_g)
+        f_low, f_high = (self.low[f], self.high[f]) if level_f == level else (f, f)
+        g_low, g_high = (self.low[g], self.high[g]) if level_g == level else (g, g)
+        node = self.node(level, self.apply(op, f_low, g_low), self.apply(op, f_high, g_high))
+        self.computed[key] = node
+        return node
+
+    def negate(self, f):
+        return self.apply(XOR, f, TRUE)
+
+    def satisfy(self, f):
+        # {variable: value} of one assignment that makes f 1, variables left out can be anything
+        if f == FALSE:
+            raise ValueError("The function is never 1")
+        assignment = {}
+        while f > TRUE:
+            if self.low[f] != FALSE:
+                assignment[self.level[f]] = 0
+                f = self.low[f]
+            else:
+                assignment[self.level[f]] = 1
+                f = self.high[f]
+        return assignment
+
+    def gate(self, op, a, b):
+        if op == AND or op == OR:
+            return self.apply(op, a, b)
+        if op == NAND:
+            return self.negate(self.apply(AND, a, b))
+        if op == NOR:
+            return self.negate(self.apply(OR, a, b))
+        if op == NOT:
+            return self.negate(a)
+        return a
+
+
+def free_inputs(netlist, constant_inputs):
+    return [index for index in range(len(netlist.input_nets)) if index not in constant_inputs]
+
+
+def variable_order(netlist, inputs):
+    # Input indexes taken from the outputs with the fewest inputs first, each output adding the inputs it needs that
+    # aren't ordered yet. Inputs that meet in the same outputs end up next to each other, like the bits of the two
+    # operands of an adder from the least significant up, which keeps the BDDs small.
+    # Support of every net as a mask with bit i set when input i reaches it
+    support = [0] * netlist.net_count
+    for index, net in enumerate(netlist.input_nets):
+        support[net] = 1 << index
+    for op, a, b, out in netlist.gates:
+        support[out] = support[a] | support[b]
+    wanted = 0
+    for index in inputs:
+        wanted |= 1 << index
+    order = []
+    ordered = 0
+    for net in sorted(netlist.output_nets, key=lambda output_net: support[output_net].bit_count()):
+        new = support[net] & wanted & ~ordered
+        ordered |= new
+        while new:
+            bit = new & -new
+            order.append(bit.bit_length() - 1)
+            new ^= bit
+    return order + [index for index in inputs if not (ordered >> index) & 1]
+
+
+def build_outputs(bdd, netlist, input_nodes):
+    # BDD node of every output of a combinational netlist, input_nodes is {input net: node}
+    nodes = [FALSE] * netlist.net_count
+    nodes[CONST_1] = TRUE
+    for net, node in input_nodes.items():
+        nodes[net] = node
+    for op, a, b, out in netlist.gates:
+        nodes[out] = bdd.gate(op, nodes[a], nodes[b])
+    return [nodes[net] for net in netlist.output_nets]
+
+
+def as_netlist(circuit):
+    netlist = circuit if isinstance(circuit, Netlist) else compile_component(circuit)
+    if netlist.registers or netlist.feedback:
+        raise ValueError("Equivalence checking needs combinational netlists without DFlipFlops or feedback")
+    return netlist
+
+
+def check_equivalence(first, second, first_constants=None, second_constants=None, order=None, max_nodes=1000000):
+    # Proves that two Components or compiled Netlists compute the same outputs for every input vector, without
+    # enumerating them. first_constants and second_constants are {input index: value} for inputs tied to a constant,
+    # the remaining inputs of both are matched up in index order. order lists the first circuit's free input indexes
+    # in BDD variable order, by default variable_order() takes them from the outputs with the smallest support first.
+    started = time.perf_counter()
+    first_constants = first_constants or {}
+    second_constants = second_constants or {}
+    first_netlist = as_netlist(first)
+    second_netlist = as_netlist(second)
+    first_inputs = free_inputs(first_netlist, first_constants)
+    second_inputs = free_inputs(second_netlist, second_constants)
+    if len(first_inputs) != len(second_inputs):
+        raise ValueError(f"{len(first_inputs)} free inputs can't be matched with {len(second_inputs)}")
+    if len(first_netlist.output_nets) != len(second_netlist.output_nets):
+        raise ValueError(f"{len(first_netlist.output_nets)} outputs can't be matched with "
+                         f"{len(second_netlist.output_nets)}")
+    if order is None:
+        order = variable_order(first_netlist, first_inputs)
+    elif sorted(order) != first_inputs:
+        raise ValueError("order has to list every free input of the first circuit once")
+    bdd = BDD(len(order), max_nodes)
+    # Variable of each free input, paired inputs of the two circuits share it
+    variables = {index: position for position, index in enumerate(order)}
+    pairs = dict(zip(first_inputs, second_inputs))
+    first_nodes = {net: TRUE if value else FALSE for net, value in
+                   ((first_netlist.input_nets[index], value) for index, value in first_constants.items())}
+    second_nodes = {net: TRUE if value else FALSE for net, value in
+                    ((second_netlist.input_nets[index], value) for index, value in second_constants.items())}
+    for index, position in variables.items():
+        node = bdd.variable(position)
+        first_nodes[first_netlist.input_nets[index]] = node
+        second_nodes[second_netlist.input_nets[pairs[index]]] = node
+    first_outputs = build_outputs(bdd, first_netlist, first_nodes)
+    second_outputs = build_outputs(bdd, second_netlist, second_nodes)
+    # Both sides share the unique table, so equal functions are the same node
+    mismatched = [index for index, (f, g) in enumerate(zip(first_outputs, second_outputs)) if f != g]
+    counterexample = None
+    if mismatched:
+        index = mismatched[0]
+        assignment = bdd.satisfy(bdd.apply(XOR, first_outputs[index], second_outputs[index]))
+        first_vector = [0] * len(first_netlist.input_nets)
+        second_vector = [0] * len(second_netlist.input_nets)
+        for input_index, value in first_constants.items():
+            first_vector[input_index] = 1 if value else 0
+        for input_index, value in second_constants.items():
+            second_vector[input_index] = 1 if value else 0
+        for input_index, position in variables.items():
+            first_vector[input_index] = second_vector[pairs[input_index]] = assignment.get(position, 0)
+        counterexample = {"first": first_vector, "second": second_vector,
+                          "first_outputs": first_netlist.evaluate(first_vector),
+                          "second_outputs": second_netlist.evaluate(second_vector)}
+    return {"equivalent": not mismatched, "mismatched_outputs": mismatched, "counterexample": counterexample,
+            "inputs": len(order), "nodes": len(bdd.level), "seconds": time.perf_counter() - started}
+
+
+if __name__ == "__main__":
+    from Circuit import (AndGate, OrGate, NandGate, NotGate, XorGate, EightBitBinaryAdder,
+                         EightBit2sComplementAdderSubtractor, RippleCarryAdder, AdderSubtractor,
+                         KoggeStoneAdderSubtractor, BrentKungAdderSubtractor, CarryLookaheadAdderSubtractor)
+    from Optimizer import optimize
+
+    assert check_equivalence(NandGate(), NandGate())["equivalent"]
+    report = check_equivalence(AndGate(), OrGate())
+    assert not report["equivalent"] and report["counterexample"]["first"] in ([0, 1], [1, 0])
+    assert check_equivalence(XorGate(), XorGate(), order=[1, 0])["equivalent"]
+    try:
+        check_equivalence(NotGate(), AndGate())
+        assert False
+    except ValueError as error:
+        assert "free inputs" in str(error)
+
+    # With the subtract bit tied to 0 the adder-subtractor is an adder, tied to 1 it isn't
+    report = check_equivalence(EightBitBinaryAdder(), EightBit2sComplementAdderSubtractor(), second_constants={16: 0})
+    assert report["equivalent"] and report["inputs"] == 16
+    report = check_equivalence(EightBitBinaryAdder(), EightBit2sComplementAdderSubtractor(), second_constants={16: 1})
+    counterexample = report["counterexample"]
+    assert not report["equivalent"] and counterexample["second"][16] == 1
+    assert counterexample["first"] == counterexample["second"][:16]
+    assert counterexample["first_outputs"] != counterexample["second_outputs"]
+    assert check_equivalence(EightBitBinaryAdder(), RippleCarryAdder(8))["equivalent"]
+
+    # The optimizer's output against the tree it came from, with far more inputs than exhaustive simulation handles
+    component = KoggeStoneAdderSubtractor(32)
+    assert check_equivalence(component, optimize(component)[0])["equivalent"]
+
+    for width in (32, 64):
+        reference = AdderSubtractor(width)
+        for fast_class in (KoggeStoneAdderSubtractor, BrentKungAdderSubtractor, CarryLookaheadAdderSubtractor):
+            report = check_equivalence(reference, fast_class(width))
+            assert report["equivalent"] and report["inputs"] == 2 * width + 1, (fast_class.__name__, width)
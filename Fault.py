@@ -0,0 +1,160 @@
+import random
+
+from Netlist import AND, OR, NAND, NOR, NOT, BUF, CONST_1, Netlist, compile_component, int_to_bits
+
+
+class FaultSimulator:
+
+    def __init__(self, component):
+        # component is a Component or a compiled Netlist. Faults are stuck-at-0 and stuck-at-1 on every input and
+        # every gate output net, BUF gates only copy a net to a second output and get no faults of their own.
+        if isinstance(component, Netlist):
+            self.netlist = component
+        else:
+            self.netlist = compile_component(component, ports=True)
+        if self.netlist.feedback:
+            raise ValueError("Fault simulation needs a netlist without combinational feedback")
+        nets = list(self.netlist.input_nets) + [out for op, a, b, out in self.netlist.gates if op != BUF]
+        # [[net, stuck value]], fault i is bit i of the detection masks
+        self.faults = [[net, value] for net in nets for value in (0, 1)]
+        self.net_names = {}
+        if self.netlist.ports:
+            # The outermost instance an output net belongs to names it, the inputs are those of the top component
+            for path, (input_nets, output_nets) in self.netlist.ports.items():
+                if not self.net_names:
+                    for index, net in enumerate(input_nets):
+                        self.net_names[net] = f"{path}/in{index}"
+                for index, net in enumerate(output_nets):
+                    self.net_names.setdefault(net, f"{path}/out{index}")
+
+    def fault_name(self, index):
+        net, value = self.faults[index]
+        return f"{self.net_names.get(net, f'net {net}')} stuck-at-{value}"
+
+    def detect(self, vector, faults=None):
+        # Simulates the fault-free circuit in bit 0 and fault faults[i] in bit i + 1 of every word, all in one pass.
+        # Returns a mask with bit i set when the vector detects faults[i], faults defaults to every fault.
+        netlist = self.netlist
+        if faults is None:
+            faults = range(len(self.faults))
+        mask = (1 << (len(faults) + 1)) - 1
+        # Bits to clear and to set after computing each net
+        stuck_at_0 = {}
+        stuck_at_1 = {}
+        lane = 2
+        for index in faults:
+            net, value = self.faults[index]
+            forced = stuck_at_1 if value else stuck_at_0
+            forced[net] = forced.get(net, 0) | lane
+            lane <<= 1
+        values = [0] * netlist.net_count
+        values[CONST_1] = mask
+        for net, value in zip(netlist.input_nets, vector):
+            values[net] = ((mask if value else 0) & ~stuck_at_0.get(net, 0)) | stuck_at_1.get(net, 0)
+        for d, q, initial in netlist.registers:
+            values[q] = mask if initial else 0
+        for op, a, b, out in netlist.gates:
+            if op == AND:
+                value = values[a] & values[b]
+            elif op == OR:
+                value = values[a] | values[b]
+            elif op == NAND:
+                value = (values[a] & values[b]) ^ mask
+            elif op == NOR:
+                value = (values[a] | values[b]) ^ mask
+            elif op == NOT:
+                value = values[a] ^ mask
+            else:
+                value = values[a]
+            if out in stuck_at_0:
+                value &= ~stuck_at_0[out]
+            if out in stuck_at_1:
+                value |= stuck_at_1[out]
+            values[out] = value
+        difference = 0
+        for net in netlist.output_nets + [d for d, q, initial in netlist.registers]:
+            value = values[net]
+            difference |= value ^ (mask if value & 1 else 0)
+        return difference >> 1
+
+    def grade(self, vectors):
+        # Fault coverage of vectors, detected faults are dropped so later vectors simulate fewer lanes
+        remaining = list(range(len(self.faults)))
+        count = 0
+        for vector in vectors:
+            count += 1
+            detected = self.detect(vector, remaining)
+            if detected:
+                remaining = [index for lane, index in enumerate(remaining) if not (detected >> lane) & 1]
+                if not remaining:
+                    break
+        return self.report(remaining, count)
+
+    def report(self, undetected, vectors):
+        total = len(self.faults)
+        return {"faults": total, "vectors": vectors, "detected": total - len(undetected),
+                "coverage": (total - len(undetected)) / total if total else 1.0,
+                "undetected": [self.fault_name(index) for index in undetected]}
+
+    def generate(self, target=1.0, candidates=None, pool_size=2048, max_exhaustive_inputs=12, seed=None):
+        # Greedy set cover: picks vectors from candidates (every vector for small circuits, random ones otherwise)
+        # until target coverage of the faults any candidate detects, then drops vectors the others make redundant.
+        # Returns (vectors, report).
+        width = len(self.netlist.input_nets)
+        if candidates is None:
+            if width <= max_exhaustive_inputs:
+                candidates = [int_to_bits(value, width) for value in range(2 ** width)]
+            else:
+                generator = random.Random(seed)
+                candidates = [int_to_bits(generator.getrandbits(width), width) for _ in range(pool_size)]
+        detections = [self.detect(vector) for vector in candidates]
+        detectable = 0
+        for detected in detections:
+            detectable |= detected
+        needed = int(target * detectable.bit_count() + 0.999999)
+        chosen = []
+        covered = 0
+        while covered.bit_count() < needed:
+            best = max(range(len(candidates)), key=lambda index: (detections[index] & ~covered).bit_count())
+            if not detections[best] & ~covered:
+                break
+            chosen.append(best)
+            covered |= detections[best]
+        # Later picks cover the hard faults, so earlier picks are the likeliest to have become redundant
+        for index in list(chosen):
+            others = 0
+            for other in chosen:
+                if other != index:
+                    others |= detections[other]
+            if others.bit_count() >= needed:
+                chosen.remove(index)
+        vectors = [candidates[index] for index in chosen]
+        return vectors, self.grade(vectors)
+
+
+if __name__ == "__main__":
+    from Circuit import XorGate, FullAdder, EightBit2sComplementAdderSubtractor
+
+    # Every stuck-at fault of an XorGate shows up with the 4 input vectors, 3 of them are enough
+    simulator = FaultSimulator(XorGate())
+    assert len(simulator.faults) == 2 * (2 + 3)
+    assert simulator.grade([[0, 0], [0, 1], [1, 0], [1, 1]])["coverage"] == 1.0
+    vectors, report = simulator.generate()
+    assert report["coverage"] == 1.0 and len(vectors) == 3
+
+    # A stuck-at-0 carry out of the FullAdder only shows up when the carry should be 1
+    simulator = FaultSimulator(FullAdder())
+    report = simulator.grade([[0, 0, 0], [1, 0, 0]])
+    assert "FullAdder/out1 stuck-at-0" in report["undetected"]
+    assert "FullAdder/out1 stuck-at-1" not in report["undetected"]
+
+    # The (A, B, subtract) vectors of the Circuit.py self-checks against the 8-bit adder-subtractor
+    simulator = FaultSimulator(EightBit2sComplementAdderSubtractor())
+    report = simulator.grade([int_to_bits(a, 8) + int_to_bits(b, 8) + [subtract] for a, b, subtract in
+                              [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 0, 1), (1, 0, 1), (0, 1, 1), (1, 1, 1), (96, 5, 0),
+                               (96, 5, 1), (5, 96, 1)]])
+    assert 0 < report["coverage"] < 1
+    vectors, report = simulator.generate(seed=1)
+    assert report["coverage"] == 1.0 and len(vectors) < 20
+    vectors, report = simulator.generate(target=0.9, seed=1)
+    assert report["coverage"] >= 0.9
@@ -0,0 +1,378 @@
+import hashlib
+from array import array
+
+from Circuit import Component, DFlipFlop, instantiate
+from Netlist import AND, OR, NAND, NOR, NOT, gate_type_of
+from Serialize import collect_definitions, find_class, parse_file
+
+# Program instructions besides the gate operations of Netlist, which take (a, b, out)
+COPY = 6  # (source, destination)
+CALL = 7  # (definition index, offset of the inner instance)
+
+# Every Definition built by this process, instructions refer to them by index
+_definitions = []
+# {digest of the structure: index in _definitions}
+_definition_indexes = {}
+
+
+class Definition:
+    # Everything about a component that doesn't change between instances. An instance is only its region of a
+    # FlyweightCircuit's values: inputs first, then outputs, then the regions of its inner instances in order.
+    __slots__ = ("index", "name", "input_count", "output_count", "size", "leaf", "op", "settles", "program",
+                 "children", "registers", "tick_calls", "ones", "starts_zero")
+
+    def __init__(self, name, input_count, output_count):
+        self.index = len(_definitions)
+        self.name = name
+        self.input_count = input_count
+        self.output_count = output_count
+        self.size = input_count + output_count
+        # Basic logic gates and DFlipFlops, which have no inner instances
+        self.leaf = False
+        # Gate operation for the basic logic gates, their parents run them inline
+        self.op = None
+        # Composite classes overriding evaluate(), like SRLatch, evaluate until their region stops changing
+        self.settles = False
+        self.program = array("I")
+        # (definition index, offset) of every inner instance
+        self.children = array("I")
+        # (d, q) offsets of the DFlipFlops directly inside and (definition index, offset) of inner instances with some
+        self.registers = array("I")
+        self.tick_calls = array("I")
+        # Offsets that are 1 in a new instance, leaving out the ones inside inner instances: the outputs of NOT, NAND
+        # and NOR gates, inner inputs tied to 1 and DFlipFlops holding 1
+        self.ones = array("I")
+        # Nothing in the whole region starts at 1
+        self.starts_zero = True
+
+
+def define_leaf(name, component_class):
+    template = instantiate(component_class)
+    definition = Definition(name, len(template.inputs), len(template.outputs))
+    definition.leaf = True
+    definition.op = gate_type_of(template)
+    if definition.op is not None:
+        definition.program.extend((definition.op, 0, 1 if definition.input_count > 1 else 0, definition.input_count))
+    elif isinstance(template, DFlipFlop):
+        definition.registers.extend((0, 1))
+    definition.ones.extend(index for index, out in enumerate(template.outputs, definition.input_count) if out[0])
+    definition.starts_zero = not definition.ones
+    return definition
+
+
+def define_composite(name, component_class, inputs, outputs, inner_links, children, tied=(), set_flip_flops=()):
+    # Same order of work as Component.evaluate(): inputs to inner inputs, then every inner component followed by its
+    # inner_links, then inner outputs to outputs
+    definition = Definition(name, len(inputs), len(outputs))
+    definition.settles = component_class.evaluate is not Component.evaluate
+    offsets = []
+    for child in children:
+        offsets.append(definition.size)
+        definition.children.extend((child.index, definition.size))
+        definition.size += child.size
+    program = definition.program
+    for index, targets in enumerate(inputs):
+        for inner_index, input_index in targets:
+            program.extend((COPY, index, offsets[inner_index] + input_index))
+    links = dict(inner_links)
+    for inner_index, child in enumerate(children):
+        offset = offsets[inner_index]
+        if child.leaf:
+            if child.op is not None:
+                program.extend((child.op, offset, offset + (1 if child.input_count > 1 else 0),
+                                offset + child.input_count))
+            elif child.registers:
+                definition.registers.extend((offset, offset + 1))
+        else:
+            if child.program:
+                program.extend((CALL, child.index, offset))
+            if child.registers or child.tick_calls:
+                definition.tick_calls.extend((child.index, offset))
+        for output_index, target_index, input_index in links.get(inner_index, ()):
+            program.extend((COPY, offset + child.input_count + output_index, offsets[target_index] + input_index))
+    for index, (inner_index, output_index) in enumerate(outputs):
+        program.extend((COPY, offsets[inner_index] + children[inner_index].input_count + output_index,
+                        len(inputs) + index))
+    definition.ones.extend(offsets[inner_index] + input_index for inner_index, input_index in tied)
+    definition.ones.extend(offsets[inner_index] + 1 for inner_index in set_flip_flops)
+    definition.starts_zero = not definition.ones and all(child.starts_zero for child in children)
+    return definition
+
+
+def define(class_names, definitions, root, classes=None):
+    # Turns the (class names, definitions, root index) of Serialize into a Definition, reusing the Definitions
+    # of every structure seen before
+    indexes = []
+    for record in definitions:
+        name = class_names[record[0]]
+        if len(record) == 1:
+            key = name
+        else:
+            key = hashlib.sha1(repr([name, record[1], record[2], sorted(record[3]),
+                                     [indexes[index] for index in record[4]], record[5],
+                                     record[6]]).encode()).digest()
+        index = _definition_indexes.get(key)
+        if index is None:
+            component_class = find_class(name, classes)
+            if len(record) == 1:
+                definition = define_leaf(name, component_class)
+            else:
+                definition = define_composite(name, component_class, record[1], record[2], record[3],
+                                              [_definitions[indexes[index]] for index in record[4]], record[5],
+                                              record[6])
+            _definitions.append(definition)
+            index = _definition_indexes[key] = definition.index
+        indexes.append(index)
+    return _definitions[indexes[root]]
+
+
+def set_ones(values, definition, base):
+    # Starting values of a new instance, the same as those of a newly built Component
+    for offset in definition.ones:
+        values[base + offset] = 1
+    children = definition.children
+    for i in range(0, len(children), 2):
+        child = _definitions[children[i]]
+        if not child.starts_zero:
+            set_ones(values, child, base + children[i + 1])
+
+
+class FlyweightCircuit:
+
+    def __init__(self, definition, values=None):
+        self.definition = definition
+        # One byte per net of the whole tree
+        if values is None:
+            values = bytearray(definition.size)
+            set_ones(values, definition, 0)
+        self.values = values
+        self.max_iterations = 64
+
+    def clone(self):
+        return FlyweightCircuit(self.definition, bytearray(self.values))
+
+    def set_input(self, index, value):
+        if index >= self.definition.input_count:
+            raise ValueError(f"Input {index} doesn't exist")
+        self.values[index] = 1 if value else 0
+
+    def set_inputs_from_array(self, values):
+        if len(values) != self.definition.input_count:
+            raise ValueError(f"Expected {self.definition.input_count} inputs, got {len(values)}")
+        self.values[:len(values)] = bytes(1 if value else 0 for value in values)
+
+    def get_output(self, index):
+        if index >= self.definition.output_count:
+            raise ValueError(f"Output {index} doesn't exist")
+        return self.values[self.definition.input_count + index]
+
+    def get_all_outputs(self):
+        start = self.definition.input_count
+        return list(self.values[start:start + self.definition.output_count])
+
+    def instance(self, path):
+        # (Definition, offset) of an inner instance, path lists inner component indexes from the top
+        definition = self.definition
+        offset = 0
+        for index in path:
+            if index >= len(definition.children) // 2:
+                raise ValueError(f"{definition.name} has no inner component {index}")
+            offset += definition.children[2 * index + 1]
+            definition = _definitions[definition.children[2 * index]]
+        return definition, offset
+
+    def get_instance_inputs(self, path):
+        definition, offset = self.instance(path)
+        return list(self.values[offset:offset + definition.input_count])
+
+    def get_instance_outputs(self, path):
+        definition, offset = self.instance(path)
+        start = offset + definition.input_count
+        return list(self.values[start:start + definition.output_count])
+
+    def evaluate(self):
+        self.run(self.definition, 0)
+
+    def run(self, definition, base):
+        if definition.settles:
+            self.run_to_fixed_point(definition, base)
+        else:
+            self.run_program(definition.program, base)
+
+    def run_to_fixed_point(self, definition, base):
+        # Like Component.settle(), on the region of one instance
+        values = self.values
+        end = base + definition.size
+        state = values[base:end]
+        seen = {bytes(state)}
+        for _ in range(self.max_iterations):
+            self.run_program(definition.program, base)
+            new_state = values[base:end]
+            if new_state == state:
+                return
+            key = bytes(new_state)
+            if key in seen:
+                raise ValueError(f"{definition.name} oscillates")
+            seen.add(key)
+            state = new_state
+        raise ValueError(f"{definition.name} did not settle in {self.max_iterations} evaluations")
+
+    def run_program(self, program, base):
+        values = self.values
+        position = 0
+        end = len(program)
+        while position < end:
+            op = program[position]
+            if op == COPY:
+                values[base + program[position + 2]] = values[base + program[position + 1]]
+                position += 3
+                continue
+            if op == CALL:
+                self.run(_definitions[program[position + 1]], base + program[position + 2])
+                position += 3
+                continue
+            a = values[base + program[position + 1]]
+            b = values[base + program[position + 2]]
+            if op == AND:
+                value = a & b
+            elif op == OR:
+                value = a | b
+            elif op == NAND:
+                value = 1 ^ (a & b)
+            elif op == NOR:
+                value = 1 ^ (a | b)
+            else:
+                value = 1 ^ a
+            values[base + program[position + 3]] = value
+            position += 4
+
+    def settle(self):
+        self.run_to_fixed_point(self.definition, 0)
+
+    def tick(self):
+        self.tick_instance(self.definition, 0)
+
+    def tick_instance(self, definition, base):
+        values = self.values
+        registers = definition.registers
+        for i in range(0, len(registers), 2):
+            values[base + registers[i + 1]] = values[base + registers[i]]
+        tick_calls = definition.tick_calls
+        for i in range(0, len(tick_calls), 2):
+            self.tick_instance(_definitions[tick_calls[i]], base + tick_calls[i + 1])
+
+    def step(self, n_cycles=1):
+        for _ in range(n_cycles):
+            self.settle()
+            self.tick()
+        self.settle()
+
+
+def from_component(component, classes=None):
+    return FlyweightCircuit(define(*collect_definitions(component), classes))
+
+
+def load(filename, classes=None):
+    # Straight from a Serialize file, the component tree is never built
+    return FlyweightCircuit(define(*parse_file(filename), classes))
+
+
+def definition_bytes(definition, seen=None):
+    # Memory held by definition and everything inside it, each Definition counted once
+    seen = set() if seen is None else seen
+    if definition.index in seen:
+        return 0
+    seen.add(definition.index)
+    total = sum(getattr(definition, name).buffer_info()[1] * 4
+                for name in ["program", "children", "registers", "tick_calls", "ones"])
+    for i in range(0, len(definition.children), 2):
+        total += definition_bytes(_definitions[definition.children[i]], seen)
+    return total
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    import tracemalloc
+
+    from Circuit import (AndGate, EightBit2sComplementAdderSubtractor, EightBitAccumulator, NotGate, RippleCarryAdder,
+                         SRLatch, TwoBitAddressDecoder, KoggeStoneAdderSubtractor)
+    from Netlist import int_to_bits
+    from Serialize import save
+
+    for component in [EightBit2sComplementAdderSubtractor(), TwoBitAddressDecoder(), KoggeStoneAdderSubtractor(16),
+                      SRLatch()]:
+        circuit = from_component(component)
+        width = len(component.inputs)
+        for _ in range(100):
+            vector = int_to_bits(random.getrandbits(width), width)
+            component.set_inputs_from_array(vector)
+            circuit.set_inputs_from_array(vector)
+            component.evaluate()
+            circuit.evaluate()
+            assert circuit.get_all_outputs() == component.get_all_outputs()
+
+    assert circuit.definition is from_component(SRLatch()).definition
+    # Inner instances are looked up by their inner component indexes
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    circuit = from_component(adder_subtractor)
+    adder_subtractor.set_inputs_from_array([1] * 17)
+    circuit.set_inputs_from_array([1] * 17)
+    adder_subtractor.evaluate()
+    circuit.evaluate()
+    full_adder = adder_subtractor.inner_components[3].inner_components[1]
+    assert circuit.get_instance_inputs([3, 1]) == [inp[0] for inp in full_adder.inputs]
+    assert circuit.get_instance_outputs([3, 1, 0]) == [out[0] for out in full_adder.inner_components[0].outputs]
+
+    accumulator = EightBitAccumulator()
+    circuit = from_component(accumulator)
+    for component in [accumulator, circuit]:
+        component.set_inputs_from_array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+        component.step(86)
+    assert circuit.get_all_outputs() == accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 0, 1, 0]
+
+    # Inner inputs tied to 1, DFlipFlops holding 1 and the outputs of NOT gates start like in the component, and
+    # they keep apart definitions that are otherwise the same
+    accumulator = EightBitAccumulator()
+    accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+    accumulator.step(5)
+    tied = Component()
+    tied.connect_input(0, 0, 0)
+    tied.connect_output(0, 0, 0)
+    tied.inner_components = [AndGate()]
+    tied.inner_components[0].set_input(1, 1)
+    inverter = Component()
+    inverter.connect_output(0, 0, 0)
+    inverter.inner_components = [NotGate()]
+    for component, vector in [(accumulator, [0] * 9), (tied, [1]), (inverter, [])]:
+        circuit = from_component(component)
+        if component is not accumulator:
+            assert circuit.get_instance_outputs([0]) == component.inner_components[0].get_all_outputs()
+        component.set_inputs_from_array(vector)
+        circuit.set_inputs_from_array(vector)
+        component.evaluate()
+        circuit.evaluate()
+        assert circuit.get_all_outputs() == component.get_all_outputs()
+    assert accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 1, 0, 1] and tied.get_all_outputs() == [1]
+    assert from_component(EightBitAccumulator()).definition is not from_component(accumulator).definition
+    circuit = from_component(EightBitAccumulator())
+    circuit.set_inputs_from_array([0] * 9)
+    circuit.evaluate()
+    assert circuit.get_all_outputs() == [0] * 8
+
+    # 10,000 FullAdders: the FullAdder program is stored once and the values bytearray takes most of the memory
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "adder.bin")
+        save(RippleCarryAdder(10000), path)
+        tracemalloc.start()
+        circuit = load(path)
+        circuit_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    assert sum(1 for definition in _definitions if definition.name == "FullAdder") == 1
+    assert circuit_bytes < 4 * len(circuit.values)
+    a = random.getrandbits(10000)
+    b = random.getrandbits(10000)
+    circuit.set_inputs_from_array(int_to_bits(a, 10000) + int_to_bits(b, 10000))
+    circuit.evaluate()
+    assert circuit.get_all_outputs() == int_to_bits(a + b, 10001)
@@ -0,0 +1,1155 @@
+import os
+import re
+from array import array
+
+from Circuit import (Component, AndGate, OrGate, NandGate, NorGate, NotGate, XorGate, DFlipFlop, TieLow, TieHigh,
+                     Wiring, instantiate)
+from Netlist import (AND, OR, NAND, NOR, NOT, BUF, CONST_0, CONST_1, GATE_TYPES, Netlist, compile_component,
+                     gate_type_of)
+
+# Cell kinds of a parsed Module besides the gate operations of Netlist, which may take any number of inputs here
+XOR = 6
+XNOR = 7
+DFF = 8
+INSTANCE = 9
+
+# Signals of the constants 0 and 1 in every Module
+ZERO = -1
+ONE = -2
+
+BENCH_KINDS = {"AND": AND, "OR": OR, "NAND": NAND, "NOR": NOR, "NOT": NOT, "BUF": BUF, "BUFF": BUF, "XOR": XOR,
+               "XNOR": XNOR, "DFF": DFF}
+VERILOG_PRIMITIVES = {"and": AND, "or": OR, "nand": NAND, "nor": NOR, "not": NOT, "buf": BUF, "xor": XOR,
+                      "xnor": XNOR}
+# Classes the two input cells are built from
+TREE_CLASSES = {AND: AndGate, OR: OrGate, XOR: XorGate}
+
+# Identifiers, escaped identifiers, sized constants, numbers and single characters of structural Verilog
+_VERILOG_TOKEN = re.compile(r"[A-Za-z_][\w$]*|\\\S+|\d*'[bBdDhHoO][0-9a-fA-F_xXzZ]+|\d+|\S")
+
+
+class Module:
+    # One module, .model or .bench file as cells over integer signals. Cells live in flat arrays so millions of
+    # them stay small: kind, target signal (or instance index) and a slice of operands.
+
+    def __init__(self, name):
+        self.name = name
+        # {signal name: signal} and [signal name]
+        self.signals = {}
+        self.names = []
+        self.inputs = []
+        self.outputs = []
+        self.kinds = array("B")
+        self.targets = array("i")
+        self.starts = array("I", [0])
+        self.operands = array("i")
+        # DFF cells whose flip-flop starts at 1
+        self.set_flip_flops = set()
+        # [module name, [[port name or position, [signals]]]] until resolve(), [module name or None for a DFF,
+        # [input signals], [output signals]] after
+        self.instances = []
+
+    def signal(self, name):
+        signal = self.signals.get(name)
+        if signal is None:
+            signal = self.signals[name] = len(self.names)
+            self.names.append(name)
+        return signal
+
+    def add_cell(self, kind, target, operands):
+        self.kinds.append(kind)
+        self.targets.append(target)
+        self.operands.extend(operands)
+        self.starts.append(len(self.operands))
+
+    def add_instance(self, module_name, connections):
+        self.add_cell(INSTANCE, len(self.instances), ())
+        self.instances.append([module_name, connections])
+
+    def cell_inputs(self, cell):
+        if self.kinds[cell] == INSTANCE:
+            return self.instances[self.targets[cell]][1]
+        return self.operands[self.starts[cell]:self.starts[cell + 1]]
+
+    def cell_outputs(self, cell):
+        if self.kinds[cell] == INSTANCE:
+            return self.instances[self.targets[cell]][2]
+        return [self.targets[cell]]
+
+    def cell_kind(self, cell):
+        # Instances of the built-in dff are flip-flops like the DFF cells
+        kind = self.kinds[cell]
+        if kind == INSTANCE and self.instances[self.targets[cell]][0] is None:
+            return DFF
+        return kind
+
+    def signal_name(self, signal):
+        if signal == ZERO:
+            return "1'b0"
+        if signal == ONE:
+            return "1'b1"
+        return self.names[signal]
+
+
+def text_lines(source):
+    # Lines of a file name or an open text file, read one at a time
+    if isinstance(source, (str, os.PathLike)):
+        with open(source) as file:
+            yield from file
+    else:
+        yield from source
+
+
+def read_bench(source, name="bench"):
+    # ISCAS-85/89 .bench: INPUT(a), OUTPUT(b) and c = NAND(a, b) lines. Returns ({name: Module}, name).
+    module = Module(name)
+    signal = module.signal
+    for line in text_lines(source):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if "=" not in line:
+            keyword, _, rest = line.partition("(")
+            keyword = keyword.strip().upper()
+            port = rest.rstrip(")").strip()
+            if keyword == "INPUT":
+                module.inputs.append(signal(port))
+            elif keyword == "OUTPUT":
+                module.outputs.append(signal(port))
+            else:
+                raise ValueError(f"Unexpected .bench line {line}")
+            continue
+        target, _, expression = line.partition("=")
+        gate, _, arguments = expression.partition("(")
+        kind = BENCH_KINDS.get(gate.strip().upper())
+        if kind is None:
+            raise ValueError(f"Unknown .bench gate {gate.strip()}")
+        operands = [signal(argument.strip()) for argument in arguments.rstrip().rstrip(")").split(",")]
+        module.add_cell(kind, signal(target.strip()), operands)
+    return {name: module}, name
+
+
+def read_blif(source):
+    # BLIF: .model, .inputs, .outputs, .names with single-output covers, .latch and .subckt.
+    # Returns ({name: Module}, name of the first model).
+    modules = {}
+    top = None
+    module = None
+    # [input signals, output signal, [cover lines]] of the .names being read
+    names = None
+    pending = ""
+    for line in text_lines(source):
+        line = pending + line.split("#", 1)[0].strip()
+        if line.endswith("\\"):
+            pending = line[:-1] + " "
+            continue
+        pending = ""
+        if not line:
+            continue
+        if not line.startswith("."):
+            if names is None:
+                raise ValueError(f"Cover line {line} outside of .names")
+            names[2].append(line.split())
+            continue
+        if names is not None:
+            add_cover(module, *names)
+            names = None
+        tokens = line.split()
+        directive = tokens[0]
+        if directive == ".model":
+            module = Module(tokens[1] if len(tokens) > 1 else f"model{len(modules)}")
+            modules[module.name] = module
+            top = top or module.name
+        elif module is None:
+            raise ValueError(f"{directive} before .model")
+        elif directive == ".inputs":
+            module.inputs += [module.signal(token) for token in tokens[1:]]
+        elif directive == ".outputs":
+            module.outputs += [module.signal(token) for token in tokens[1:]]
+        elif directive == ".names":
+            signals = [module.signal(token) for token in tokens[1:]]
+            names = [signals[:-1], signals[-1], []]
+        elif directive == ".latch":
+            module.add_cell(DFF, module.signal(tokens[2]), [module.signal(tokens[1])])
+            if len(tokens) in (4, 6) and tokens[-1] == "1":
+                module.set_flip_flops.add(len(module.kinds) - 1)
+        elif directive == ".subckt":
+            connections = []
+            for token in tokens[2:]:
+                formal, _, actual = token.partition("=")
+                connections.append([formal, [module.signal(actual)]])
+            module.add_instance(tokens[1], connections)
+        elif directive == ".end":
+            module = None
+        elif directive not in (".clock", ".area", ".delay", ".wire_load_slope"):
+            raise ValueError(f"Unsupported BLIF directive {directive}")
+    if names is not None:
+        add_cover(module, *names)
+    if top is None:
+        raise ValueError("No .model in the BLIF input")
+    return modules, top
+
+
+def add_cover(module, inputs, output, cover):
+    # Sum of products: one AND of literals per cube, ORed together. A cover listing the 0s of the output is
+    # NORed instead, no cubes at all is the constant 0.
+    if not cover:
+        module.add_cell(BUF, output, [ZERO])
+        return
+    value = cover[0][-1] if inputs else cover[0][0]
+    terms = []
+    for cube in cover:
+        literals = []
+        for index, bit in enumerate(cube[0] if inputs else ""):
+            if bit == "1":
+                literals.append(inputs[index])
+            elif bit == "0":
+                # One NOT per input, shared by every cube that needs it
+                inverted = f"$not${module.names[inputs[index]]}"
+                if inverted not in module.signals:
+                    module.add_cell(NOT, module.signal(inverted), [inputs[index]])
+                literals.append(module.signals[inverted])
+        if not literals:
+            # A cube of only don't cares is always 1
+            terms = [ONE]
+            break
+        if len(literals) == 1:
+            terms.append(literals[0])
+        else:
+            term = module.signal(f"$cube${module.names[output]}${len(terms)}")
+            module.add_cell(AND, term, literals)
+            terms.append(term)
+    if value == "1":
+        module.add_cell(OR if len(terms) > 1 else BUF, output, terms)
+    else:
+        module.add_cell(NOR if len(terms) > 1 else NOT, output, terms)
+
+
+def verilog_statements(source):
+    # Token lists of the statements of structural Verilog, comments removed, read a line at a time
+    tokens = []
+    in_comment = False
+    for line in text_lines(source):
+        if in_comment:
+            end = line.find("*/")
+            if end < 0:
+                continue
+            line = line[end + 2:]
+            in_comment = False
+        while "/*" in line:
+            start = line.index("/*")
+            end = line.find("*/", start + 2)
+            if end < 0:
+                line = line[:start]
+                in_comment = True
+            else:
+                line = line[:start] + " " + line[end + 2:]
+        line = line.split("//", 1)[0]
+        if line.lstrip().startswith("`"):
+            # Compiler directives like `timescale end with the line, not with a semicolon
+            continue
+        for token in _VERILOG_TOKEN.findall(line):
+            if token == ";":
+                yield tokens
+                tokens = []
+            elif token == "endmodule":
+                if tokens:
+                    yield tokens
+                yield [token]
+                tokens = []
+            else:
+                tokens.append(token)
+    if tokens:
+        raise ValueError("Verilog input ends in the middle of a statement")
+
+
+def split_commas(tokens):
+    # Splits tokens on the commas outside of brackets, parentheses and braces
+    groups = [[]]
+    depth = 0
+    for token in tokens:
+        if token in "([{":
+            depth += 1
+        elif token in ")]}":
+            depth -= 1
+        if token == "," and depth == 0:
+            groups.append([])
+        else:
+            groups[-1].append(token)
+    return groups if groups != [[]] else []
+
+
+def verilog_constant(token):
+    # Signals of a sized or unsized constant, most significant bit first
+    if "'" not in token:
+        return [ONE if int(token) else ZERO]
+    size, _, value = token.partition("'")
+    base = {"b": 2, "o": 8, "d": 10, "h": 16}[value[0].lower()]
+    number = int(value[1:].replace("_", ""), base)
+    width = int(size) if size else max(1, number.bit_length())
+    return [ONE if (number >> bit) & 1 else ZERO for bit in range(width - 1, -1, -1)]
+
+
+class VerilogModule(Module):
+
+    def __init__(self, name):
+        super().__init__(name)
+        # {bus name: [bit indexes, most significant first]}
+        self.buses = {}
+        # Port names in header order and {port name: "input" or "output"}
+        self.ports = []
+        self.directions = {}
+
+    def declare(self, tokens, kind):
+        # input [3:0] a, b and the ANSI header form, returns the names declared
+        bits = None
+        declared = []
+        for group in split_commas(tokens):
+            group = [token for token in group if token not in ("wire", "reg", "signed")]
+            if group and group[0] == "[":
+                close = group.index("]")
+                msb, lsb = int(group[1]), int(group[close - 1])
+                bits = list(range(msb, lsb - 1, -1)) if msb >= lsb else list(range(msb, lsb + 1))
+                group = group[close + 1:]
+            for name in group:
+                if bits is not None:
+                    self.buses[name] = bits
+                declared.append(name)
+                if kind in ("input", "output"):
+                    self.directions[name] = kind
+        return declared
+
+    def port_bits(self, name):
+        bits = self.buses.get(name)
+        return [name] if bits is None else [f"{name}[{bit}]" for bit in bits]
+
+    def expression(self, tokens):
+        # Signals of an identifier, a bit or part select, a constant or a {concatenation}, most significant first
+        if not tokens:
+            return []
+        if tokens[0] == "{":
+            return [signal for group in split_commas(tokens[1:-1]) for signal in self.expression(group)]
+        if tokens[0][0].isdigit() or tokens[0][0] == "'":
+            return verilog_constant(tokens[0])
+        name = tokens[0].lstrip("\\")
+        if len(tokens) == 1:
+            return [self.signal(bit) for bit in self.port_bits(name)]
+        if tokens[1] == "[" and tokens[-1] == "]":
+            if ":" in tokens:
+                colon = tokens.index(":")
+                msb, lsb = int(tokens[2]), int(tokens[colon + 1])
+                step = -1 if msb >= lsb else 1
+                return [self.signal(f"{name}[{bit}]") for bit in range(msb, lsb + step, step)]
+            return [self.signal(f"{name}[{tokens[2]}]")]
+        raise ValueError(f"Only structural Verilog is supported, got {' '.join(tokens)}")
+
+
+def read_verilog(source):
+    # Gate-level structural Verilog: modules with scalar or vector ports, the and, or, nand, nor, xor, xnor, not and
+    # buf primitives, instances of other modules or of dff (Q, D) with named or positional ports, and assign
+    # statements copying signals or constants. Returns ({name: Module}, name of the last module).
+    modules = {}
+    module = None
+    for tokens in verilog_statements(source):
+        keyword = tokens[0]
+        if keyword == "module":
+            module = VerilogModule(tokens[1])
+            modules[module.name] = module
+            if len(tokens) > 2 and tokens[2] == "(":
+                direction = None
+                bus_range = []
+                for group in split_commas(tokens[3:-1]):
+                    if group[0] in ("input", "output", "inout"):
+                        # ANSI header, a direction and range hold for the names after them
+                        direction = group[0]
+                        group = [token for token in group[1:] if token not in ("wire", "reg", "signed")]
+                        bus_range = group[:group.index("]") + 1] if group[0] == "[" else []
+                    elif direction is not None:
+                        group = bus_range + group
+                    if direction is not None:
+                        module.ports += module.declare(group, direction)
+                    else:
+                        module.ports += [token.lstrip("\\") for token in group]
+            continue
+        if module is None:
+            raise ValueError(f"{keyword} outside of a module")
+        if keyword == "endmodule":
+            for port in module.ports:
+                direction = module.directions.get(port)
+                if direction is None:
+                    raise ValueError(f"Port {port} of {module.name} has no direction")
+                signals = module.inputs if direction == "input" else module.outputs
+                signals += [module.signal(bit) for bit in module.port_bits(port)]
+            module = None
+        elif keyword in ("input", "output", "inout", "wire", "reg"):
+            declared = module.declare(tokens[1:], keyword)
+            if keyword == "inout":
+                raise ValueError(f"inout port {declared[0]} of {module.name} is not supported")
+        elif keyword == "assign":
+            for group in split_commas(tokens[1:]):
+                equals = group.index("=")
+                targets = module.expression(group[:equals])
+                sources = module.expression(group[equals + 1:])
+                if len(targets) != len(sources):
+                    raise ValueError(f"assign of {len(sources)} bits to {len(targets)} in {module.name}")
+                for target, signal in zip(targets, sources):
+                    module.add_cell(BUF, target, [signal])
+        elif keyword in VERILOG_PRIMITIVES:
+            kind = VERILOG_PRIMITIVES[keyword]
+            for group in split_commas(tokens[1:]):
+                # Optional instance name, then the terminals, outputs first
+                start = group.index("(")
+                terminals = [module.expression(terminal) for terminal in split_commas(group[start + 1:-1])]
+                terminals = [signal for terminal in terminals for signal in terminal]
+                if kind in (NOT, BUF):
+                    for target in terminals[:-1]:
+                        module.add_cell(kind, target, [terminals[-1]])
+                else:
+                    module.add_cell(kind, terminals[0], terminals[1:])
+        elif keyword in ("timescale", "`timescale", "parameter", "localparam", "supply0", "supply1"):
+            continue
+        else:
+            group = tokens[1:]
+            if group[0] == "#":
+                # Parameters are ignored, gate-level netlists rarely have any
+                close = 2
+                depth = 0
+                for close, token in enumerate(group[1:], 1):
+                    depth += token == "("
+                    depth -= token == ")"
+                    if depth == 0:
+                        break
+                group = group[close + 1:]
+            for instance in split_commas(group):
+                start = instance.index("(")
+                connections = []
+                for position, connection in enumerate(split_commas(instance[start + 1:-1])):
+                    if connection[0] == ".":
+                        connections.append([connection[1], module.expression(connection[3:-1])])
+                    else:
+                        connections.append([position, module.expression(connection)])
+                module.add_instance(keyword, connections)
+    if module is not None:
+        raise ValueError(f"Module {module.name} has no endmodule")
+    if not modules:
+        raise ValueError("No module in the Verilog input")
+    return modules, list(modules)[-1]
+
+
+def resolve(modules):
+    # Matches the connections of every instance to the ports of its module. Instances of dff, or DFF, with
+    # (Q, D), (CK, Q, D) or named Q and D ports become flip-flops unless a module of that name was read.
+    for module in modules.values():
+        for record in module.instances:
+            name, connections = record[0], record[1]
+            if len(record) == 3:
+                continue
+            sub = modules.get(name)
+            if sub is None:
+                if name.lower() != "dff":
+                    raise ValueError(f"{module.name} uses undefined module {name}")
+                named = {str(port).upper(): signals for port, signals in connections}
+                if "Q" in named:
+                    q, d = named["Q"], named.get("D", [])
+                elif len(connections) == 3:
+                    q, d = connections[1][1], connections[2][1]
+                else:
+                    q, d = connections[0][1], connections[1][1] if len(connections) > 1 else []
+                if len(q) != 1 or len(d) != 1:
+                    raise ValueError(f"dff in {module.name} needs one Q and one D")
+                record[1:] = [d, q]
+                record[0] = None
+                continue
+            ports = getattr(sub, "ports", None)
+            if ports is None:
+                # BLIF ports are bits
+                bit_ports = [sub.names[signal] for signal in sub.inputs + sub.outputs]
+            else:
+                bit_ports = [bit for port in ports for bit in sub.port_bits(port)]
+            bits = {}
+            for port, signals in connections:
+                if not signals:
+                    continue
+                if isinstance(port, int):
+                    if ports is None:
+                        names = [bit_ports[port]]
+                    else:
+                        names = sub.port_bits(ports[port])
+                else:
+                    names = sub.port_bits(port) if ports is not None else [port]
+                if len(names) != len(signals):
+                    raise ValueError(f"{len(signals)} bits connected to port {port} of {name} in {module.name}, "
+                                     f"it has {len(names)}")
+                bits.update(zip(names, signals))
+            # Unconnected inputs are 0, unconnected outputs are left alone
+            inputs = [bits.get(sub.names[signal], ZERO) for signal in sub.inputs]
+            outputs = [bits.get(sub.names[signal]) for signal in sub.outputs]
+            outputs = [module.signal(f"$open${len(module.instances)}${index}") if signal is None else signal
+                       for index, signal in enumerate(outputs)]
+            record[1:] = [inputs, outputs]
+
+
+def aliases(module):
+    # {signal: signal it copies} for buffers and one input AND, OR and XOR cells, followed to the end of each chain
+    copies = {}
+    for cell in range(len(module.kinds)):
+        kind = module.kinds[cell]
+        if kind == BUF or (kind in (AND, OR, XOR) and module.starts[cell + 1] - module.starts[cell] == 1):
+            copies[module.targets[cell]] = module.operands[module.starts[cell]]
+    resolved = {}
+    for signal in copies:
+        chain = []
+        source = signal
+        while source in copies and source not in resolved:
+            if source in chain:
+                raise ValueError(f"{module.name} has a loop of buffers through {module.names[source]}")
+            chain.append(source)
+            source = copies[source]
+        source = resolved.get(source, source)
+        for link in chain:
+            resolved[link] = source
+    return resolved
+
+
+def order_cells(module, copies):
+    # Cells other than copies, flip-flops first and then in topological order so Component.evaluate() sees every
+    # input before it is used. Cells on combinational loops keep their file order after the rest.
+    cells = [cell for cell in range(len(module.kinds))
+             if not (module.kinds[cell] != INSTANCE and module.targets[cell] in copies)]
+    driver = {}
+    flip_flops = []
+    logic = []
+    for cell in cells:
+        if module.cell_kind(cell) == DFF:
+            flip_flops.append(cell)
+        else:
+            logic.append(cell)
+            for signal in module.cell_outputs(cell):
+                driver[signal] = cell
+    pending = {}
+    fanout = {}
+    for cell in logic:
+        count = 0
+        for signal in set(module.cell_inputs(cell)):
+            source = driver.get(copies.get(signal, signal))
+            if source is not None:
+                count += 1
+                fanout.setdefault(source, []).append(cell)
+        pending[cell] = count
+    ready = [cell for cell in reversed(logic) if pending[cell] == 0]
+    order = []
+    while ready:
+        cell = ready.pop()
+        order.append(cell)
+        for successor in fanout.get(cell, ()):
+            pending[successor] -= 1
+            if pending[successor] == 0:
+                ready.append(successor)
+    if len(order) != len(logic):
+        ordered = set(order)
+        order += [cell for cell in logic if cell not in ordered]
+    return flip_flops + order
+
+
+def gate_count(kind, inputs):
+    # Inner components a cell becomes
+    if kind in (NOT, DFF, INSTANCE):
+        return 1
+    if kind in (NAND, NOR):
+        return 1 if inputs == 1 else inputs - 1
+    if kind == XNOR:
+        return 1 if inputs == 1 else inputs
+    return inputs - 1
+
+
+def build_module(component, module, classes):
+    # Wires component up as module, inner components of other modules are built from classes
+    copies = aliases(module)
+    order = order_cells(module, copies)
+    # Source (inner component index or None for the inputs, output index) of every signal
+    sources = {}
+    for index, signal in enumerate(module.inputs):
+        sources.setdefault(signal, (None, index))
+    uses_constants = any(signal < 0 for signal in copies.values()) or any(signal < 0 for signal in module.operands) or \
+        any(signal < 0 for record in module.instances for signal in record[1])
+    next_index = 0
+    if uses_constants:
+        # Constants come from a TieLow and a TieHigh, which validate() takes as deliberately left open
+        sources[ZERO] = (0, 0)
+        sources[ONE] = (1, 0)
+        next_index = 2
+    for cell in order:
+        count = gate_count(module.cell_kind(cell), len(module.cell_inputs(cell)))
+        for output_index, signal in enumerate(module.cell_outputs(cell)):
+            sources[signal] = (next_index + count - 1, output_index)
+        next_index += count
+
+    def source(signal):
+        signal = copies.get(signal, signal)
+        found = sources.get(signal)
+        if found is None:
+            raise ValueError(f"{module.signal_name(signal)} is used in {module.name} but nothing drives it")
+        return found
+
+    wiring = Wiring(component)
+    if uses_constants:
+        wiring.add(TieLow)
+        wiring.add(TieHigh)
+    for cell in order:
+        kind = module.cell_kind(cell)
+        signals = [source(signal) for signal in module.cell_inputs(cell)]
+        if kind == DFF:
+            index = wiring.add(DFlipFlop, *signals)
+            if cell in module.set_flip_flops:
+                component.inner_components[index].outputs[0][0] = 1
+        elif kind == INSTANCE:
+            wiring.add(classes[module.instances[module.targets[cell]][0]], *signals)
+        elif kind == NOT or (kind in (NAND, NOR, XNOR) and len(signals) == 1):
+            wiring.gate(NotGate, *signals)
+        elif kind in (NAND, NOR):
+            half = len(signals) // 2
+            tree_class = AndGate if kind == NAND else OrGate
+            wiring.gate(NandGate if kind == NAND else NorGate, wiring.tree(tree_class, signals[:half]),
+                        wiring.tree(tree_class, signals[half:]))
+        elif kind == XNOR:
+            wiring.gate(NotGate, wiring.tree(XorGate, signals))
+        else:
+            if len(signals) < 2:
+                raise ValueError(f"{module.names[module.targets[cell]]} in {module.name} has no inputs")
+            wiring.tree(TREE_CLASSES[kind], signals)
+    for index, signal in enumerate(module.outputs):
+        found = source(signal)
+        if found[0] is None:
+            # Outputs come from inner components, an input copied to an output goes through an AndGate
+            found = wiring.gate(AndGate, found, found)
+        component.connect_output(index, *found)
+    # Inputs nothing reads still get their place, connect_input() only takes them in order
+    component.inputs = [[0, wiring.input_connections.get(index, [])] for index in range(len(module.inputs))]
+
+
+def component_classes(modules, top):
+    # {module name: Component subclass} for top and every module it uses, each built by its own constructor
+    resolve(modules)
+    classes = {}
+
+    def define(name, visiting):
+        if name in classes:
+            return
+        if name in visiting:
+            raise ValueError(f"Module {name} instantiates itself")
+        module = modules[name]
+        for record in module.instances:
+            if record[0] is not None:
+                define(record[0], visiting | {name})
+
+        def __init__(self):
+            Component.__init__(self)
+            build_module(self, module, classes)
+
+        classes[name] = type(name, (Component,), {"__slots__": (), "__init__": __init__})
+
+    define(top, frozenset())
+    return classes
+
+
+def build_component(modules, top):
+    return component_classes(modules, top)[top]()
+
+
+def build_netlist(modules, top):
+    # A flat Netlist straight from the modules, without building the Component tree
+    resolve(modules)
+    module = modules[top]
+    netlist = Netlist()
+    netlist.input_nets = [netlist.new_net() for _ in module.inputs]
+    netlist.output_nets = [netlist.new_net() for _ in module.outputs]
+    flatten_module(netlist, modules, module, netlist.input_nets, netlist.output_nets, {top})
+    netlist.sort()
+    netlist.reset()
+    return netlist
+
+
+def flatten_module(netlist, modules, module, input_nets, output_nets, path):
+    copies = aliases(module)
+    nets = {ZERO: CONST_0, ONE: CONST_1}
+    for signal, net in zip(module.inputs, input_nets):
+        nets.setdefault(signal, net)
+    cells = [cell for cell in range(len(module.kinds))
+             if not (module.kinds[cell] != INSTANCE and module.targets[cell] in copies)]
+    # Cell outputs drive the output nets directly where they can, extra copies go through BUF gates
+    driven = set()
+    for cell in cells:
+        driven.update(module.cell_outputs(cell))
+    buffers = []
+    for signal, net in zip(module.outputs, output_nets):
+        signal = copies.get(signal, signal)
+        if signal in driven and signal not in nets:
+            nets[signal] = net
+        else:
+            buffers.append((signal, net))
+    for cell in cells:
+        for signal in module.cell_outputs(cell):
+            if signal not in nets:
+                nets[signal] = netlist.new_net()
+
+    def net_of(signal):
+        net = nets.get(copies.get(signal, signal))
+        if net is None:
+            raise ValueError(f"{module.signal_name(signal)} is used in {module.name} but nothing drives it")
+        return net
+
+    def reduce(op, operands, out):
+        # Balanced tree of two input gates like Wiring.tree(), the last one drives out
+        while len(operands) > 2:
+            paired = []
+            for i in range(0, len(operands) - 1, 2):
+                paired.append(netlist.new_net())
+                gate(op, operands[i], operands[i + 1], paired[-1])
+            if len(operands) % 2:
+                paired.append(operands[-1])
+            operands = paired
+        gate(op, operands[0], operands[-1], out)
+
+    def gate(op, a, b, out):
+        if op == XOR:
+            # Like XorGate: (a OR b) AND (a NAND b)
+            either = netlist.new_net()
+            not_both = netlist.new_net()
+            netlist.add_gate(OR, [a, b], either)
+            netlist.add_gate(NAND, [a, b], not_both)
+            netlist.add_gate(AND, [either, not_both], out)
+        else:
+            netlist.add_gate(op, [a, b], out)
+
+    for cell in cells:
+        kind = module.cell_kind(cell)
+        operands = [net_of(signal) for signal in module.cell_inputs(cell)]
+        outputs = [nets[signal] for signal in module.cell_outputs(cell)]
+        if kind == DFF:
+            netlist.registers.append([operands[0], outputs[0], 1 if cell in module.set_flip_flops else 0])
+        elif kind == INSTANCE:
+            name = module.instances[module.targets[cell]][0]
+            if name in path:
+                raise ValueError(f"Module {name} instantiates itself")
+            flatten_module(netlist, modules, modules[name], operands, outputs, path | {name})
+        elif kind == NOT or (kind in (NAND, NOR, XNOR) and len(operands) == 1):
+            netlist.add_gate(NOT, operands, outputs[0])
+        elif kind == XNOR:
+            inner = netlist.new_net()
+            reduce(XOR, operands, inner)
+            netlist.add_gate(NOT, [inner], outputs[0])
+        elif kind in (NAND, NOR):
+            # Same decomposition as build_module(): two trees into one inverting gate
+            half = len(operands) // 2
+            tree_op = AND if kind == NAND else OR
+            left = operands[0]
+            right = operands[half]
+            if half > 1:
+                left = netlist.new_net()
+                reduce(tree_op, operands[:half], left)
+            if len(operands) - half > 1:
+                right = netlist.new_net()
+                reduce(tree_op, operands[half:], right)
+            netlist.add_gate(kind, [left, right], outputs[0])
+        else:
+            if len(operands) < 2:
+                raise ValueError(f"{module.names[module.targets[cell]]} in {module.name} has no inputs")
+            reduce(kind, operands, outputs[0])
+    for signal, net in buffers:
+        netlist.add_gate(BUF, [net_of(signal)], net)
+
+
+def read(source, format):
+    return {"bench": read_bench, "blif": read_blif, "verilog": read_verilog}[format](source)
+
+
+def format_of(filename):
+    extension = os.path.splitext(str(filename))[1].lower()
+    formats = {".bench": "bench", ".blif": "blif", ".v": "verilog", ".sv": "verilog"}
+    if extension not in formats:
+        raise ValueError(f"Unknown netlist format {extension}, use .bench, .blif or .v")
+    return formats[extension]
+
+
+def load(filename, netlist=False, top=None):
+    # A Component (or with netlist=True a flat Netlist, much faster for big files) from a .bench, .blif or .v file.
+    # top picks the module, by default the first BLIF model or the last Verilog module.
+    format = format_of(filename)
+    if format == "bench":
+        modules, default_top = read_bench(filename, os.path.splitext(os.path.basename(str(filename)))[0])
+    else:
+        modules, default_top = read(filename, format)
+    top = top or default_top
+    if top not in modules:
+        raise ValueError(f"No module {top}")
+    return build_netlist(modules, top) if netlist else build_component(modules, top)
+
+
+def as_netlist(circuit):
+    return circuit if isinstance(circuit, Netlist) else compile_component(circuit)
+
+
+def net_names(netlist):
+    # Name of every net and [(output name, net)] of the outputs that have to be copied from a net named otherwise,
+    # like the outputs Optimizer ties straight to an input or a constant
+    names = {CONST_0: "const0", CONST_1: "const1"}
+    for index, net in enumerate(netlist.input_nets):
+        names[net] = f"in{index}"
+    copies = []
+    for index, net in enumerate(netlist.output_nets):
+        if net in names:
+            copies.append((f"out{index}", net))
+        else:
+            names[net] = f"out{index}"
+    return (lambda net: names.get(net) or f"n{net}"), copies
+
+
+def used_constants(netlist):
+    nets = {net for op, a, b, out in netlist.gates for net in (a, b)}
+    nets.update(d for d, q, initial in netlist.registers)
+    nets.update(netlist.output_nets)
+    return [net for net in (CONST_0, CONST_1) if net in nets]
+
+
+def write_bench(circuit, file):
+    # Flat .bench of a Component or Netlist, BUF gates become BUFF
+    netlist = as_netlist(circuit)
+    name, copies = net_names(netlist)
+    gate_names = {AND: "AND", OR: "OR", NAND: "NAND", NOR: "NOR"}
+    file.writelines(f"INPUT({name(net)})\n" for net in netlist.input_nets)
+    file.writelines(f"OUTPUT(out{index})\n" for index in range(len(netlist.output_nets)))
+    constants = used_constants(netlist)
+    if constants:
+        # .bench has no constants, they are made from the first input
+        if not netlist.input_nets:
+            raise ValueError(".bench can't hold a circuit using constants without any input")
+        first = name(netlist.input_nets[0])
+        for net in constants:
+            file.write(f"{name(net)} = {'XOR' if net == CONST_0 else 'XNOR'}({first}, {first})\n")
+    for d, q, initial in netlist.registers:
+        if initial:
+            raise ValueError(".bench flip-flops always start at 0")
+        file.write(f"{name(q)} = DFF({name(d)})\n")
+    for op, a, b, out in netlist.gates:
+        if op == NOT:
+            file.write(f"{name(out)} = NOT({name(a)})\n")
+        elif op == BUF:
+            file.write(f"{name(out)} = BUFF({name(a)})\n")
+        else:
+            file.write(f"{name(out)} = {gate_names[op]}({name(a)}, {name(b)})\n")
+    file.writelines(f"{output} = BUFF({name(net)})\n" for output, net in copies)
+
+
+def write_blif(circuit, file, model="circuit"):
+    # Flat BLIF of a Component or Netlist, one .names per gate and one .latch per DFlipFlop
+    netlist = as_netlist(circuit)
+    name, copies = net_names(netlist)
+    covers = {AND: "11 1", OR: "1- 1\n-1 1", NAND: "0- 1\n-0 1", NOR: "00 1"}
+    file.write(f".model {model}\n")
+    file.write(f".inputs {' '.join(name(net) for net in netlist.input_nets)}\n")
+    file.write(f".outputs {' '.join(f'out{index}' for index in range(len(netlist.output_nets)))}\n")
+    for net in used_constants(netlist):
+        file.write(f".names {name(net)}\n" + ("1\n" if net == CONST_1 else ""))
+    for d, q, initial in netlist.registers:
+        file.write(f".latch {name(d)} {name(q)} {initial}\n")
+    for op, a, b, out in netlist.gates:
+        if op == NOT:
+            file.write(f".names {name(a)} {name(out)}\n0 1\n")
+        elif op == BUF:
+            file.write(f".names {name(a)} {name(out)}\n1 1\n")
+        else:
+            file.write(f".names {name(a)} {name(b)} {name(out)}\n{covers[op]}\n")
+    file.writelines(f".names {name(net)} {output}\n1 1\n" for output, net in copies)
+    file.write(".end\n")
+
+
+def write_verilog(circuit, file):
+    # Structural Verilog keeping the hierarchy: one module per structurally different Component, XorGates and the
+    # basic gates as primitives and DFlipFlops as dff (Q, D) instances. A Netlist becomes one flat module.
+    if isinstance(circuit, Netlist):
+        write_flat_verilog(circuit, file, "circuit")
+        return
+    # {structure key: module name} and the module texts, used modules first
+    module_names = {}
+    names_used = {}
+    texts = []
+    primitives = {op: gate_class.__name__[:-4].lower() for gate_class, op in GATE_TYPES.items()}
+
+    def leaf_primitive(component):
+        if type(component) is XorGate:
+            return "xor"
+        op = gate_type_of(component)
+        return primitives[op] if op is not None else None
+
+    def visit(component):
+        inputs = [f"in{index}" for index in range(len(component.inputs))]
+        outputs = [f"out{index}" for index in range(len(component.outputs))]
+        lines = []
+        wires = []
+        inner_inputs = [[None] * len(inner.inputs) for inner in component.inner_components]
+        for index, inp in enumerate(component.inputs):
+            for inner_index, input_index in inp[1]:
+                inner_inputs[inner_index][input_index] = inputs[index]
+        for source, links in component.inner_links.items():
+            for output_index, inner_index, input_index in links:
+                inner_inputs[inner_index][input_index] = f"w{source}_{output_index}"
+        for inner_index, inner in enumerate(component.inner_components):
+            terminals = [signal if signal is not None else ("1'b1" if inner.inputs[input_index][0] else "1'b0")
+                         for input_index, signal in enumerate(inner_inputs[inner_index])]
+            results = [f"w{inner_index}_{output_index}" for output_index in range(len(inner.outputs))]
+            wires += results
+            primitive = leaf_primitive(inner)
+            if primitive is not None:
+                lines.append(f"  {primitive} g{inner_index} ({', '.join(results + terminals)});")
+            elif isinstance(inner, DFlipFlop):
+                lines.append(f"  dff g{inner_index} ({results[0]}, {terminals[0]});")
+            else:
+                lines.append(f"  {visit(inner)} g{inner_index} ({', '.join(terminals + results)});")
+        for index, out in enumerate(component.outputs):
+            lines.append(f"  assign {outputs[index]} = w{out[1]}_{out[2]};")
+        key = repr([type(component).__name__, lines])
+        name = module_names.get(key)
+        if name is None:
+            base = type(component).__name__
+            count = names_used.get(base, 0)
+            names_used[base] = count + 1
+            name = module_names[key] = base if count == 0 else f"{base}_{count}"
+            text = [f"module {name} ({', '.join(inputs + outputs)});"]
+            if inputs:
+                text.append(f"  input {', '.join(inputs)};")
+            if outputs:
+                text.append(f"  output {', '.join(outputs)};")
+            if wires:
+                text.append(f"  wire {', '.join(wires)};")
+            texts.append("\n".join(text + lines + ["endmodule", ""]))
+        return name
+
+    if leaf_primitive(circuit) is not None or isinstance(circuit, DFlipFlop):
+        write_flat_verilog(compile_component(circuit), file, type(circuit).__name__)
+        return
+    visit(circuit)
+    file.write("\n".join(texts))
+
+
+def write_flat_verilog(netlist, file, module):
+    name, copies = net_names(netlist)
+    primitives = {AND: "and", OR: "or", NAND: "nand", NOR: "nor", NOT: "not", BUF: "buf"}
+    inputs = [name(net) for net in netlist.input_nets]
+    outputs = [f"out{index}" for index in range(len(netlist.output_nets))]
+    port_nets = set(netlist.input_nets) | set(netlist.output_nets) | {CONST_0, CONST_1}
+    wires = sorted({out for op, a, b, out in netlist.gates} | {q for d, q, initial in netlist.registers})
+    wires = [name(net) for net in wires if net not in port_nets]
+    file.write(f"module {module} ({', '.join(inputs + outputs)});\n")
+    if inputs:
+        file.write(f"  input {', '.join(inputs)};\n")
+    if outputs:
+        file.write(f"  output {', '.join(outputs)};\n")
+    if wires:
+        file.write(f"  wire {', '.join(wires)};\n")
+
+    def terminal(net):
+        return "1'b0" if net == CONST_0 else "1'b1" if net == CONST_1 else name(net)
+
+    for index, (d, q, initial) in enumerate(netlist.registers):
+        if initial:
+            raise ValueError("Verilog dff instances always start at 0")
+        file.write(f"  dff r{index} ({name(q)}, {terminal(d)});\n")
+    for index, (op, a, b, out) in enumerate(netlist.gates):
+        operands = [terminal(a)] if op in (NOT, BUF) else [terminal(a), terminal(b)]
+        file.write(f"  {primitives[op]} g{index} ({', '.join([name(out)] + operands)});\n")
+    file.writelines(f"  assign {output} = {terminal(net)};\n" for output, net in copies)
+    file.write("endmodule\n")
+
+
+def save(circuit, filename):
+    format = format_of(filename)
+    with open(filename, "w") as file:
+        if format == "bench":
+            write_bench(circuit, file)
+        elif format == "blif":
+            write_blif(circuit, file, os.path.splitext(os.path.basename(str(filename)))[0])
+        else:
+            write_verilog(circuit, file)
+
+
+if __name__ == "__main__":
+    import io
+    import random
+    import time
+
+    from Circuit import EightBit2sComplementAdderSubtractor, EightBitAccumulator, KoggeStoneAdderSubtractor
+    from Equivalence import check_equivalence
+    from Netlist import int_to_bits
+    from Optimizer import optimize
+
+    c17 = """# ISCAS-85 c17
+INPUT(1)
+INPUT(2)
+INPUT(3)
+INPUT(6)
+INPUT(7)
+OUTPUT(22)
+OUTPUT(23)
+10 = NAND(1, 3)
+11 = NAND(3, 6)
+16 = NAND(2, 11)
+19 = NAND(11, 7)
+22 = NAND(10, 16)
+23 = NAND(16, 19)
+"""
+    component = build_component(*read_bench(io.StringIO(c17), "c17"))
+    netlist = build_netlist(*read_bench(io.StringIO(c17), "c17"))
+    assert type(component).__name__ == "c17" and len(component.inner_components) == 6
+    for vector in range(32):
+        g1, g2, g3, g6, g7 = int_to_bits(vector, 5)
+        g11 = 1 - (g3 & g6)
+        g16 = 1 - (g2 & g11)
+        expected = [1 - ((1 - (g1 & g3)) & g16), 1 - (g16 & (1 - (g11 & g7)))]
+        component.set_inputs_from_array([g1, g2, g3, g6, g7])
+        component.evaluate()
+        assert component.get_all_outputs() == netlist.evaluate([g1, g2, g3, g6, g7]) == expected
+
+    # ISCAS-89 s27, the gates come after the flip-flops reading them and before the ones using them
+    s27 = """INPUT(G0)
+INPUT(G1)
+INPUT(G2)
+INPUT(G3)
+OUTPUT(G17)
+G5 = DFF(G10)
+G6 = DFF(G11)
+G7 = DFF(G13)
+G14 = NOT(G0)
+G17 = NOT(G11)
+G8 = AND(G14, G6)
+G15 = OR(G12, G8)
+G16 = OR(G3, G8)
+G9 = NAND(G16, G15)
+G10 = NOR(G14, G11)
+G11 = NOR(G5, G9)
+G12 = NOR(G1, G7)
+G13 = NOR(G2, G12)
+"""
+    component = build_component(*read_bench(io.StringIO(s27), "s27"))
+    netlist = build_netlist(*read_bench(io.StringIO(s27), "s27"))
+    assert len(netlist.registers) == 3 and not netlist.feedback
+    for _ in range(50):
+        vector = int_to_bits(random.getrandbits(4), 4)
+        component.set_inputs_from_array(vector)
+        component.step()
+        netlist.evaluate(vector)
+        netlist.tick()
+        assert component.get_all_outputs() == netlist.evaluate(vector)
+
+    # Round trips through every format prove equivalent to the original
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    for write, format in [(write_verilog, "verilog"), (write_bench, "bench"), (write_blif, "blif")]:
+        text = io.StringIO()
+        write(adder_subtractor, text)
+        modules, top = read(io.StringIO(text.getvalue()), format)
+        assert check_equivalence(adder_subtractor, build_component(modules, top))["equivalent"], format
+        assert check_equivalence(adder_subtractor, build_netlist(modules, top))["equivalent"], format
+    text = io.StringIO()
+    write_verilog(KoggeStoneAdderSubtractor(16), text)
+    verilog = text.getvalue()
+    # Every inner component of the Kogge-Stone adder is a gate, XorGates become primitives
+    assert verilog.count("endmodule") == 1 and "xor g" in verilog
+    assert check_equivalence(KoggeStoneAdderSubtractor(16),
+                             build_component(*read(io.StringIO(verilog), "verilog")))["equivalent"]
+    text = io.StringIO()
+    write_verilog(adder_subtractor, text)
+    assert text.getvalue().count("module FullAdder ") == 1
+    # Outputs the optimizer ties to an input or a constant are copied
+    optimized = optimize(adder_subtractor, {16: 0})[0]
+    for write, format in [(write_verilog, "verilog"), (write_bench, "bench"), (write_blif, "blif")]:
+        text = io.StringIO()
+        write(optimized, text)
+        assert check_equivalence(optimized, build_netlist(*read(io.StringIO(text.getvalue()), format)))["equivalent"]
+
+    accumulator = EightBitAccumulator()
+    text = io.StringIO()
+    write_verilog(accumulator, text)
+    loaded = build_component(*read(io.StringIO(text.getvalue()), "verilog"))
+    for component in [accumulator, loaded]:
+        component.set_inputs_from_array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+        component.step(86)
+    assert loaded.get_all_outputs() == accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 0, 1, 0]
+
+    # Vectors, wide gates, constants, named and positional instances, dff and comments
+    verilog = """`timescale 1ns / 1ps
+/* a 2-bit
+   register */
+module majority(input a, b, c, output y);
+  wire ab, bc, ca;
+  and (ab, a, b), (bc, b, c);
+  and g3 (ca, c, a);
+  or g4 (y, ab, bc, ca);  // three input OR
+endmodule
+module top (x, s, q, z, one);
+  input [2:0] x;
+  input s;
+  output [1:0] q;
+  output z, one;
+  wire m, n;
+  majority u0 (.a(x[2]), .b(x[1]), .c(x[0]), .y(m));
+  xnor u1 (n, x[2], x[1], x[0]);
+  dff r0 (q[1], m);
+  dff r1 (.Q(q[0]), .D(n));
+  nand u2 (z, s, x[2], x[1], x[0], 1'b1);
+  assign one = 1'b1;
+endmodule
+"""
+    modules, top = read(io.StringIO(verilog), "verilog")
+    component = build_component(modules, top)
+    netlist = build_netlist(modules, top)
+    assert len(component.inputs) == 4 and len(component.outputs) == 4
+    for vector in range(16):
+        bits = int_to_bits(vector, 4)
+        x = bits[:3]
+        component.set_inputs_from_array(bits)
+        component.step()
+        netlist.evaluate(bits)
+        netlist.tick()
+        expected = [1 if sum(x) >= 2 else 0, 1 - (sum(x) % 2), 1 - (bits[3] & x[0] & x[1] & x[2]), 1]
+        assert component.get_all_outputs() == netlist.evaluate(bits) == expected, vector
+
+    # BLIF covers with don't cares, a cover of the 0s, constants, a latch starting at 1 and a subcircuit
+    blif = """.model top
+.inputs a b c
+.outputs y n k q
+.subckt mux s=c x=a z=b o=y
+.names a b n
+00 0
+.names k
+1
+.latch y q 1
+.end
+.model mux
+.inputs s x z
+.outputs o
+.names s x z o
+01- 1
+1-1 1
+.end
+"""
+    modules, top = read(io.StringIO(blif), "blif")
+    component = build_component(modules, top)
+    netlist = build_netlist(modules, top)
+    component.evaluate()
+    assert component.get_all_outputs()[3] == netlist.evaluate([0, 0, 0])[3] == 1
+    for vector in range(8):
+        a, b, c = int_to_bits(vector, 3)
+        component.set_inputs_from_array([a, b, c])
+        component.evaluate()
+        assert component.get_all_outputs()[:3] == netlist.evaluate([a, b, c])[:3] == [b if c else a, a | b, 1]
+
+    # Single pass over a generated 200,000 gate .bench straight into a Netlist
+    lines = [f"INPUT(i{index})\n" for index in range(64)] + [f"OUTPUT(g{199999 - index})\n" for index in range(64)]
+    for index in range(200000):
+        a = f"i{index % 64}" if index < 64 else f"g{index - 64}"
+        b = f"i{(index * 7) % 64}" if index < 128 else f"g{index - 128}"
+        lines.append(f"g{index} = {['AND', 'OR', 'NAND', 'NOR', 'XOR'][index % 5]}({a}, {b})\n")
+    started = time.perf_counter()
+    netlist = build_netlist(*read_bench(iter(lines)))
+    seconds = time.perf_counter() - started
+    assert len(netlist.output_nets) == 64 and len(netlist.gates) == 200000 + 2 * 40000
+    print(f"200,000 .bench gates read into a Netlist in {seconds:.2f} s")
@@ -0,0 +1,174 @@
+from collections import OrderedDict
+
+from Circuit import XorGate, HalfAdder, TwoBitAddressDecoder, TwoToOneMultiplexer, FullAdder, DFlipFlop
+from Netlist import compile_component, exhaustive_words, structural_hash, unpack_words
+
+SMALL_COMPONENTS = [XorGate, HalfAdder, TwoBitAddressDecoder, TwoToOneMultiplexer, FullAdder]
+
+
+class TruthTableCache:
+
+    def __init__(self, max_inputs=8, lru_size=4096):
+        # Components with at most max_inputs inputs get a full truth table, the others an LRU of seen input vectors
+        self.max_inputs = max_inputs
+        self.lru_size = lru_size
+        # {structure: [outputs tuple for every packed input vector]}, see structure()
+        self.tables = {}
+        # {(structure, packed inputs): outputs tuple}
+        self.lru = OrderedDict()
+        # {id(inner_links): (inner_links, structure)}, clones share their inner_links so they share the entry
+        self.structures = {}
+        self.hits = 0
+        self.misses = 0
+        # {component_class: evaluate defined on the class itself, None when it was inherited}
+        self.replaced = {}
+
+    def enable(self, *component_classes):
+        for component_class in component_classes or SMALL_COMPONENTS:
+            if component_class in self.replaced:
+                continue
+            if issubclass(component_class, DFlipFlop):
+                raise ValueError(f"{component_class.__name__} holds state, its outputs can't be cached")
+            try:
+                template = component_class()
+            except TypeError:
+                # Classes taking a width are checked on the first evaluate() of every structure
+                template = None
+            if template is not None:
+                self.check(template)
+            self.replaced[component_class] = component_class.__dict__.get("evaluate")
+            component_class.evaluate = self.make_evaluate(component_class.evaluate)
+
+    def disable(self):
+        for component_class, evaluate in self.replaced.items():
+            if evaluate is None:
+                del component_class.evaluate
+            else:
+                component_class.evaluate = evaluate
+        self.replaced = {}
+
+    def clear(self):
+        self.tables = {}
+        self.lru = OrderedDict()
+        self.structures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "tables": len(self.tables), "lru_entries": len(self.lru)}
+
+    def check(self, component):
+        netlist = compile_component(component)
+        if netlist.registers or netlist.feedback:
+            raise ValueError(f"{type(component).__name__} holds state, its outputs don't only depend on its inputs")
+
+    def structure(self, component):
+        # Instances of one class can differ in width and wiring, like RippleCarryAdder(n), so tables are keyed on
+        # the structural hash. It is worked out once for all clones sharing the same inner_links.
+        if not component.inner_components:
+            return type(component)
+        entry = self.structures.get(id(component.inner_links))
+        if entry is None or entry[0] is not component.inner_links:
+            self.check(component)
+            entry = (component.inner_links, (type(component), len(component.inputs), structural_hash(component)))
+            self.structures[id(component.inner_links)] = entry
+        return entry[1]
+
+    def build_table(self, component):
+        width = len(component.inputs)
+        words, mask = exhaustive_words(width)
+        output_words = compile_component(component).evaluate_words(words, mask)
+        return [tuple(row) for row in unpack_words(output_words, 1 << width)]
+
+    def make_evaluate(self, original_evaluate):
+        cache = self
+
+        def evaluate(component):
+            if component.backend is not None:
+                original_evaluate(component)
+                return
+            key = 0
+            for inp in component.inputs:
+                key = (key << 1) | (1 if inp[0] else 0)
+            structure = cache.structure(component)
+            table = cache.tables.get(structure)
+            if table is not None:
+                cache.hits += 1
+                outputs = table[key]
+            elif len(component.inputs) <= cache.max_inputs:
+                cache.misses += 1
+                table = cache.build_table(component)
+                cache.tables[structure] = table
+                outputs = table[key]
+            else:
+                lru_key = (structure, key)
+                outputs = cache.lru.get(lru_key)
+                if outputs is not None:
+                    cache.hits += 1
+                    cache.lru.move_to_end(lru_key)
+                else:
+                    cache.misses += 1
+                    original_evaluate(component)
+                    outputs = tuple(component.get_all_outputs())
+                    cache.lru[lru_key] = outputs
+                    if len(cache.lru) > cache.lru_size:
+                        cache.lru.popitem(last=False)
+            for out, value in zip(component.outputs, outputs):
+                out[0] = value
+
+        return evaluate
+
+
+if __name__ == "__main__":
+    import random
+
+    from Circuit import (EightBitBinaryAdder, EightBit2sComplementAdderSubtractor, RippleCarryAdder,
+                         EightBitAccumulator, SRLatch)
+    from Netlist import int_to_bits
+
+    vectors = [int_to_bits(random.getrandbits(17), 17) for _ in range(200)]
+    expected = []
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    for vector in vectors:
+        adder_subtractor.set_inputs_from_array(vector)
+        adder_subtractor.evaluate()
+        expected.append(adder_subtractor.get_all_outputs())
+
+    cache = TruthTableCache()
+    cache.enable()
+    for vector, outputs in zip(vectors, expected):
+        adder_subtractor.set_inputs_from_array(vector)
+        adder_subtractor.evaluate()
+        assert adder_subtractor.get_all_outputs() == outputs
+    assert cache.stats()["tables"] == 2  # XorGate and FullAdder
+    assert cache.hits > cache.misses
+    cache.disable()
+    assert "evaluate" not in FullAdder.__dict__
+
+    # EightBitBinaryAdder has 16 inputs, above max_inputs, so it goes through the LRU
+    cache = TruthTableCache(lru_size=2)
+    cache.enable(EightBitBinaryAdder)
+    binary_adder = EightBitBinaryAdder()
+    for vector in [0x6005, 0xAACC, 0x6005, 0xFFFF, 0xAACC]:
+        binary_adder.set_inputs_from_array(int_to_bits(vector, 16))
+        binary_adder.evaluate()
+    assert binary_adder.get_all_outputs() == [1, 0, 1, 1, 1, 0, 1, 1, 0]
+    assert cache.hits == 1 and cache.misses == 4 and len(cache.lru) == 2
+    cache.disable()
+
+    # Widths of one class get their own tables, and circuits holding state are refused
+    cache = TruthTableCache()
+    cache.enable(RippleCarryAdder)
+    for width in (2, 3, 2):
+        adder = RippleCarryAdder(width)
+        adder.set_inputs_from_array(int_to_bits(1, width) + int_to_bits(1, width))
+        adder.evaluate()
+        assert adder.get_all_outputs() == int_to_bits(2, width + 1)
+    assert cache.stats()["tables"] == 2
+    cache.disable()
+    for component_class in (EightBitAccumulator, SRLatch, DFlipFlop):
+        try:
+            TruthTableCache().enable(component_class)
+            assert False
+        except ValueError as error:
+            assert "holds state" in str(error)
@@ -0,0 +1,617 @@
+import hashlib
+from array import array
+from collections import deque
+from heapq import heappush, heappop
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from Circuit import AndGate, OrGate, NandGate, NorGate, NotGate, DFlipFlop
+
+# Gate operations of a flattened netlist
+AND = 0
+OR = 1
+NAND = 2
+NOR = 3
+NOT = 4
+BUF = 5  # Only emitted when one inner output drives several outputs of its parent
+
+GATE_TYPES = {AndGate: AND, OrGate: OR, NandGate: NAND, NorGate: NOR, NotGate: NOT}
+
+# Nets 0 and 1 are tied to constant 0 and 1, used for inner inputs nothing is connected to
+CONST_0 = 0
+CONST_1 = 1
+
+# Maps the ASCII digits of format(word, "b") to bit values
+_BIT_TABLE = bytes.maketrans(b"01", b"\x00\x01")
+
+# Digest of this module's source, part of the key of anything cached on disk from compile_component() so that a
+# changed compiler never reads results of the old one
+with open(__file__, "rb") as _source:
+    COMPILER_HASH = hashlib.sha1(_source.read()).hexdigest()[:16]
+
+
+def gate_type_of(component):
+    for cls in type(component).__mro__:
+        op = GATE_TYPES.get(cls)
+        if op is not None:
+            return op
+    return None
+
+
+class Netlist:
+
+    def __init__(self):
+        self.net_count = 2
+        # [[op, input_net_a, input_net_b, output_net]] in topological order, input_net_b == input_net_a for NOT and BUF
+        self.gates = []
+        self.input_nets = []
+        self.output_nets = []
+        # [[d_net, q_net, initial_value]] for every DFlipFlop, q_net is only written by tick()
+        self.registers = []
+        # True when gates feed back into each other, evaluate() then iterates to a fixed point
+        self.feedback = False
+        self.max_iterations = 64
+        self.values = bytearray()
+        # {instance path: (input nets, output nets)} when compiled with ports=True, paths look like
+        # EightBit2sComplementAdderSubtractor/[3]/TwoBit2sComplementAdderSubtractor/[1]/FullAdder
+        self.ports = None
+
+    def new_net(self):
+        net = self.net_count
+        self.net_count += 1
+        return net
+
+    def add_gate(self, op, input_nets, output_net):
+        a = input_nets[0]
+        b = input_nets[1] if len(input_nets) > 1 else a
+        self.gates.append([op, a, b, output_net])
+
+    def flatten(self, component, input_nets, output_nets, path=None):
+        if self.ports is not None:
+            path = path or type(component).__name__
+            self.ports[path] = (list(input_nets), list(output_nets))
+        if isinstance(component, DFlipFlop):
+            self.registers.append([input_nets[0], output_nets[0], 1 if component.get_output(0) else 0])
+            return
+        op = gate_type_of(component)
+        if op is not None:
+            self.add_gate(op, input_nets, output_nets[0])
+            return
+        if not component.inner_components:
+            raise ValueError(f"{type(component).__name__} has no inner components and is not a known gate")
+        inner_components = component.inner_components
+        inner_inputs = [[None] * len(inner.inputs) for inner in inner_components]
+        inner_outputs = [[None] * len(inner.outputs) for inner in inner_components]
+        for index, out in enumerate(component.outputs):
+            inner_component_index = out[1]
+            inner_component_output_index = out[2]
+            net = inner_outputs[inner_component_index][inner_component_output_index]
+            if net is None:
+                inner_outputs[inner_component_index][inner_component_output_index] = output_nets[index]
+            else:
+                self.add_gate(BUF, [net], output_nets[index])
+        for nets in inner_outputs:
+            for i, net in enumerate(nets):
+                if net is None:
+                    nets[i] = self.new_net()
+        for index, inp in enumerate(component.inputs):
+            for inner_component_index, inner_component_input_index in inp[1]:
+                inner_inputs[inner_component_index][inner_component_input_index] = input_nets[index]
+        # Links are applied after the inputs, a link overrides an input exactly like it does in Component.evaluate()
+        for out_component_index, links in component.inner_links.items():
+            for out_index, inner_component_index, inner_component_input_index in links:
+                net = inner_outputs[out_component_index][out_index]
+                inner_inputs[inner_component_index][inner_component_input_index] = net
+        for index, inner in enumerate(inner_components):
+            nets = inner_inputs[index]
+            for i, net in enumerate(nets):
+                if net is None:
+                    nets[i] = CONST_1 if inner.inputs[i][0] else CONST_0
+            self.flatten(inner, nets, inner_outputs[index],
+                         f"{path}/[{index}]/{type(inner).__name__}" if path is not None else None)
+
+    def sort(self):
+        driver = {}
+        for index, gate in enumerate(self.gates):
+            driver[gate[3]] = index
+        pending = [0] * len(self.gates)
+        fanout = [[] for _ in self.gates]
+        for index, gate in enumerate(self.gates):
+            for net in {gate[1], gate[2]}:
+                source = driver.get(net)
+                if source is not None:
+                    pending[index] += 1
+                    fanout[source].append(index)
+        ready = deque(index for index, count in enumerate(pending) if count == 0)
+        order = []
+        while ready:
+            index = ready.popleft()
+            order.append(index)
+            for successor in fanout[index]:
+                pending[successor] -= 1
+                if pending[successor] == 0:
+                    ready.append(successor)
+        if len(order) != len(self.gates):
+            # Gates in or after a loop keep their order and get iterated by evaluate()
+            self.feedback = True
+            ordered = set(order)
+            order.extend(index for index in range(len(self.gates)) if index not in ordered)
+        self.gates = [self.gates[index] for index in order]
+
+    def reset(self):
+        self.values = bytearray(self.net_count)
+        self.values[CONST_1] = 1
+        for d, q, initial in self.registers:
+            self.values[q] = initial
+
+    def iterate_gates(self):
+        return self.gates
+
+    def depth(self):
+        # Longest path in gates from an input or DFlipFlop to an output
+        depth = [0] * self.net_count
+        for op, a, b, out in self.iterate_gates():
+            depth[out] = max(depth[a], depth[b]) + 1
+        return max([depth[net] for net in self.output_nets], default=0)
+
+    def tick(self):
+        values = self.values
+        captured = [values[d] for d, q, initial in self.registers]
+        for register, value in zip(self.registers, captured):
+            values[register[1]] = value
+
+    def evaluate(self, inputs):
+        values = self.values
+        for net, value in zip(self.input_nets, inputs):
+            values[net] = 1 if value else 0
+        if self.feedback:
+            self.run_to_fixed_point(values)
+        else:
+            self.run(values)
+        return [values[net] for net in self.output_nets]
+
+    def run_to_fixed_point(self, values):
+        seen = set()
+        for _ in range(self.max_iterations):
+            before = bytes(values)
+            self.run(values)
+            if values == before:
+                return
+            if before in seen:
+                raise ValueError("Combinational feedback oscillates")
+            seen.add(before)
+        raise ValueError(f"Combinational feedback did not settle in {self.max_iterations} passes")
+
+    def run(self, values):
+        for op, a, b, out in self.iterate_gates():
+            if op == AND:
+                values[out] = values[a] & values[b]
+            elif op == OR:
+                values[out] = values[a] | values[b]
+            elif op == NAND:
+                values[out] = 1 ^ (values[a] & values[b])
+            elif op == NOR:
+                values[out] = 1 ^ (values[a] | values[b])
+            elif op == NOT:
+                values[out] = 1 ^ values[a]
+            else:
+                values[out] = values[a]
+
+    def evaluate_words(self, words, mask, input_nets=None, output_nets=None):
+        # Bit-parallel evaluation: bit i of every word belongs to test vector i.
+        # Words can be Python ints or NumPy uint64 arrays, mask has every used bit set.
+        # input_nets and output_nets default to the component inputs and outputs, DFlipFlop outputs read as 0
+        # unless they are listed in input_nets.
+        if self.feedback:
+            raise ValueError("Bit-parallel evaluation needs a netlist without combinational feedback")
+        values = [mask ^ mask] * self.net_count
+        values[CONST_1] = mask
+        for net, word in zip(self.input_nets if input_nets is None else input_nets, words):
+            values[net] = word
+        for op, a, b, out in self.iterate_gates():
+            if op == AND:
+                values[out] = values[a] & values[b]
+            elif op == OR:
+                values[out] = values[a] | values[b]
+            elif op == NAND:
+                values[out] = (values[a] & values[b]) ^ mask
+            elif op == NOR:
+                values[out] = (values[a] | values[b]) ^ mask
+            elif op == NOT:
+                values[out] = values[a] ^ mask
+            else:
+                values[out] = values[a]
+        return [values[net] for net in (self.output_nets if output_nets is None else output_nets)]
+
+    def evaluate_batch(self, vectors):
+        # vectors is a 2-D array [vector][input], the result is [vector][output] in get_all_outputs() order
+        if np is not None and isinstance(vectors, np.ndarray):
+            return self.evaluate_batch_numpy(vectors)
+        count = len(vectors)
+        if count == 0:
+            return []
+        words = [pack_column(vectors, i) for i in range(len(self.input_nets))]
+        output_words = self.evaluate_words(words, (1 << count) - 1)
+        return unpack_words(output_words, count)
+
+    def evaluate_batch_numpy(self, vectors):
+        count = vectors.shape[0]
+        word_count = (count + 63) // 64
+        packed = np.packbits(vectors.T != 0, axis=1, bitorder="little")
+        padded = np.zeros((len(self.input_nets), word_count * 8), dtype=np.uint8)
+        padded[:, :packed.shape[1]] = packed
+        words = padded.view("<u8")
+        mask = np.full(word_count, np.iinfo(np.uint64).max, dtype=np.uint64)
+        output_words = np.stack(self.evaluate_words(list(words), mask)).astype("<u8")
+        bits = np.unpackbits(output_words.view(np.uint8), axis=1, bitorder="little")
+        return np.ascontiguousarray(bits[:, :count].T)
+
+
+class CompactNetlist(Netlist):
+
+    def __init__(self, netlist):
+        # Same gates as netlist but held in flat typed arrays instead of one list per gate
+        super().__init__()
+        self.net_count = netlist.net_count
+        self.input_nets = array("i", netlist.input_nets)
+        self.output_nets = array("i", netlist.output_nets)
+        self.registers = netlist.registers
+        self.feedback = netlist.feedback
+        self.gates = None
+        self.ops = bytes(gate[0] for gate in netlist.gates)
+        self.gate_a = array("i", [gate[1] for gate in netlist.gates])
+        self.gate_b = array("i", [gate[2] for gate in netlist.gates])
+        self.gate_out = array("i", [gate[3] for gate in netlist.gates])
+        self.reset()
+
+    def iterate_gates(self):
+        return zip(self.ops, self.gate_a, self.gate_b, self.gate_out)
+
+
+class LevelizedNetlist(Netlist):
+
+    def __init__(self, netlist):
+        if np is None:
+            raise ImportError("The numpy backend needs NumPy installed")
+        if netlist.feedback:
+            raise ValueError("The numpy backend can't levelize combinational feedback")
+        super().__init__()
+        self.net_count = netlist.net_count
+        self.gates = netlist.gates
+        self.input_nets = netlist.input_nets
+        self.output_nets = netlist.output_nets
+        self.registers = netlist.registers
+        self.input_index = np.array(self.input_nets, dtype=np.intp)
+        self.output_index = np.array(self.output_nets, dtype=np.intp)
+        # Group the gates by logic depth, then by op inside each level
+        depth = [0] * self.net_count
+        levels = []
+        for op, a, b, out in self.gates:
+            level = max(depth[a], depth[b])
+            depth[out] = level + 1
+            if level == len(levels):
+                levels.append({})
+            group = levels[level].setdefault(op, ([], [], []))
+            group[0].append(a)
+            group[1].append(b)
+            group[2].append(out)
+        # [[op, input_nets_a, input_nets_b, output_nets]] one entry per op per level
+        self.steps = []
+        for level in levels:
+            for op, (a, b, out) in sorted(level.items()):
+                self.steps.append([op, np.array(a, dtype=np.intp), np.array(b, dtype=np.intp), np.array(out, dtype=np.intp)])
+        self.level_count = len(levels)
+        self.reset()
+
+    def reset(self):
+        self.values = np.zeros(self.net_count, dtype=bool)
+        self.values[CONST_1] = True
+        for d, q, initial in self.registers:
+            self.values[q] = initial
+
+    def run(self, values):
+        # Works on bool vectors (one test vector) and on uint64 [net][word] arrays (packed batches)
+        for op, a, b, out in self.steps:
+            if op == AND:
+                values[out] = values[a] & values[b]
+            elif op == OR:
+                values[out] = values[a] | values[b]
+            elif op == NAND:
+                values[out] = ~(values[a] & values[b])
+            elif op == NOR:
+                values[out] = ~(values[a] | values[b])
+            elif op == NOT:
+                values[out] = ~values[a]
+            else:
+                values[out] = values[a]
+
+    def evaluate(self, inputs):
+        values = self.values
+        values[self.input_index] = np.asarray(inputs) != 0
+        self.run(values)
+        return values[self.output_index].astype(np.uint8).tolist()
+
+    def evaluate_words(self, words, mask, input_nets=None, output_nets=None):
+        if input_nets is not None or output_nets is not None:
+            return super().evaluate_words(words, mask, input_nets, output_nets)
+        if isinstance(mask, int):
+            # Python int words are converted to uint64 arrays and back
+            word_count = max(1, (mask.bit_length() + 63) // 64)
+            arrays = [np.frombuffer(word.to_bytes(word_count * 8, "little"), dtype="<u8") for word in words]
+            outputs = self.evaluate_words(arrays, np.full(word_count, np.iinfo(np.uint64).max, dtype=np.uint64))
+            return [int.from_bytes(output.astype("<u8").tobytes(), "little") & mask for output in outputs]
+        values = np.zeros((self.net_count, len(mask)), dtype=np.uint64)
+        values[CONST_1] = mask
+        if len(words):
+            values[self.input_index] = np.stack(words)
+        self.run(values)
+        return list(values[self.output_index])
+
+
+class EventDrivenNetlist(Netlist):
+
+    def __init__(self, netlist):
+        if netlist.feedback:
+            raise ValueError("The event backend needs a netlist without combinational feedback")
+        super().__init__()
+        self.net_count = netlist.net_count
+        self.gates = netlist.gates
+        self.input_nets = netlist.input_nets
+        self.output_nets = netlist.output_nets
+        self.registers = netlist.registers
+        # Indexes of the gates reading each net
+        self.fanout = [[] for _ in range(self.net_count)]
+        for index, (op, a, b, out) in enumerate(self.gates):
+            self.fanout[a].append(index)
+            if b != a:
+                self.fanout[b].append(index)
+        # Gates evaluated by the last call and since the netlist was built
+        self.evaluated = 0
+        self.total_evaluated = 0
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.settled = False
+        # Nets changed by tick() since the last evaluate()
+        self.changed = []
+
+    def tick(self):
+        values = self.values
+        captured = [values[d] for d, q, initial in self.registers]
+        for (d, q, initial), value in zip(self.registers, captured):
+            if values[q] != value:
+                values[q] = value
+                self.changed.append(q)
+
+    def evaluate(self, inputs):
+        if not self.settled:
+            # Nothing is known about the nets yet, so the first call evaluates every gate
+            self.settled = True
+            self.changed = []
+            self.evaluated = len(self.gates)
+            self.total_evaluated += self.evaluated
+            return super().evaluate(inputs)
+        values = self.values
+        gates = self.gates
+        fanout = self.fanout
+        # Gate indexes are topological, so popping the smallest one never evaluates a gate before its drivers
+        queue = []
+        scheduled = set()
+        for net in self.changed:
+            for index in fanout[net]:
+                if index not in scheduled:
+                    scheduled.add(index)
+                    heappush(queue, index)
+        self.changed = []
+        for net, value in zip(self.input_nets, inputs):
+            value = 1 if value else 0
+            if values[net] != value:
+                values[net] = value
+                for index in fanout[net]:
+                    if index not in scheduled:
+                        scheduled.add(index)
+                        heappush(queue, index)
+        evaluated = 0
+        while queue:
+            index = heappop(queue)
+            evaluated += 1
+            op, a, b, out = gates[index]
+            if op == AND:
+                value = values[a] & values[b]
+            elif op == OR:
+                value = values[a] | values[b]
+            elif op == NAND:
+                value = 1 ^ (values[a] & values[b])
+            elif op == NOR:
+                value = 1 ^ (values[a] | values[b])
+            elif op == NOT:
+                value = 1 ^ values[a]
+            else:
+                value = values[a]
+            if value != values[out]:
+                values[out] = value
+                for successor in fanout[out]:
+                    if successor not in scheduled:
+                        scheduled.add(successor)
+                        heappush(queue, successor)
+        self.evaluated = evaluated
+        self.total_evaluated += evaluated
+        return [values[net] for net in self.output_nets]
+
+
+def generated_backend(component):
+    from Codegen import compile_generated
+    return compile_generated(component)
+
+
+# Backends selectable with Component.set_backend(), each one is built from the component
+BACKENDS = {
+    "netlist": lambda component: compile_component(component),
+    "compact": lambda component: CompactNetlist(compile_component(component)),
+    "numpy": lambda component: LevelizedNetlist(compile_component(component)),
+    "event": lambda component: EventDrivenNetlist(compile_component(component)),
+    "codegen": generated_backend,
+}
+
+
+def compile_backend(component, name):
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown backend {name}, expected one of {['reference'] + list(BACKENDS)}")
+    return backend(component)
+
+
+def pack_column(vectors, index):
+    # Bit i of the result is vectors[i][index]
+    return int("".join(["1" if vector[index] else "0" for vector in reversed(vectors)]), 2)
+
+
+def unpack_word(word, count):
+    # bytes holding bit i of word at index i
+    return format(word, f"0{count}b")[::-1].encode().translate(_BIT_TABLE)
+
+
+def unpack_words(words, count):
+    columns = [unpack_word(word, count) for word in words]
+    return [list(row) for row in zip(*columns)]
+
+
+def exhaustive_words(width):
+    # One word per input holding all 2 ** width vectors, vector v is int_to_bits(v, width)
+    count = 1 << width
+    mask = (1 << count) - 1
+    words = []
+    for i in range(width):
+        half = 1 << (width - 1 - i)
+        block = ((1 << half) - 1) << half
+        words.append(block * (mask // ((1 << (2 * half)) - 1)))
+    return words, mask
+
+
+def compile_component(component, ports=False):
+    netlist = Netlist()
+    if ports:
+        netlist.ports = {}
+    netlist.input_nets = [netlist.new_net() for _ in component.inputs]
+    netlist.output_nets = [netlist.new_net() for _ in component.outputs]
+    netlist.flatten(component, netlist.input_nets, netlist.output_nets)
+    netlist.sort()
+    netlist.reset()
+    return netlist
+
+
+def structural_hash(component):
+    # Hex digest of the class names and wiring of the whole tree, along with the values compile_component() bakes in:
+    # the state of every DFlipFlop and the value of every inner input nothing drives. Other input and output values
+    # are left out.
+    digest = hashlib.sha1()
+    update_structural_hash(digest, component)
+    return digest.hexdigest()
+
+
+def update_structural_hash(digest, component):
+    digest.update(type(component).__name__.encode())
+    if isinstance(component, DFlipFlop):
+        digest.update(b"1" if component.get_output(0) else b"0")
+        return
+    if gate_type_of(component) is not None:
+        return
+    # flatten() ties these to their current value
+    tied = tied_inputs(component)
+    wiring = [[inp[1] for inp in component.inputs], [out[1:] for out in component.outputs],
+              sorted(component.inner_links.items()), len(component.inner_components), tied]
+    digest.update(repr(wiring).encode())
+    for inner_component in component.inner_components:
+        update_structural_hash(digest, inner_component)
+
+
+def tied_inputs(component):
+    # [[inner component index, input index, value]] of the inner inputs that neither an input nor an inner_link drives
+    driven = set()
+    for inp in component.inputs:
+        for inner_component_index, inner_component_input_index in inp[1]:
+            driven.add((inner_component_index, inner_component_input_index))
+    for links in component.inner_links.values():
+        for out_index, inner_component_index, inner_component_input_index in links:
+            driven.add((inner_component_index, inner_component_input_index))
+    return [[index, i, 1 if inp[0] else 0] for index, inner_component in enumerate(component.inner_components)
+            for i, inp in enumerate(inner_component.inputs) if (index, i) not in driven]
+
+
+def int_to_bits(value, width):
+    # Input 0 is the most significant bit, like the operands of the adders
+    return [(value >> (width - 1 - i)) & 1 for i in range(width)]
+
+
+if __name__ == "__main__":
+    import random
+
+    from Circuit import (XorGate, HalfAdder, TwoBitAddressDecoder, TwoToOneMultiplexer, FullAdder, EightBitBinaryAdder,
+                         TwoBit2sComplementAdderSubtractor, EightBit2sComplementAdderSubtractor)
+
+    for component_class in [AndGate, OrGate, NandGate, NorGate, NotGate, XorGate, HalfAdder, TwoBitAddressDecoder,
+                            TwoToOneMultiplexer, FullAdder, EightBitBinaryAdder, TwoBit2sComplementAdderSubtractor,
+                            EightBit2sComplementAdderSubtractor]:
+        component = component_class()
+        netlist = compile_component(component)
+        width = len(component.inputs)
+        if width <= 12:
+            vectors = range(2 ** width)
+        else:
+            vectors = [random.getrandbits(width) for _ in range(500)]
+        for vector in vectors:
+            bits = int_to_bits(vector, width)
+            component.set_inputs_from_array(bits)
+            component.evaluate()
+            assert netlist.evaluate(bits) == component.get_all_outputs(), (component_class.__name__, bits)
+
+    netlist = compile_component(EightBit2sComplementAdderSubtractor())
+    vectors = [int_to_bits(random.getrandbits(17), 17) for _ in range(100)]
+    assert len(netlist.gates) == 8 * (3 + 2 * 3 + 5)
+    # 96 - 5
+    assert netlist.evaluate([0, 1, 1, 0, 0, 0, 0, 0,
+                             0, 0, 0, 0, 0, 1, 0, 1,
+                             1]) == [1, 0, 1, 0, 1, 1, 0, 1, 1]
+
+    from Circuit import AdderSubtractor, KoggeStoneAdderSubtractor
+    assert netlist.depth() == 26
+    assert compile_component(KoggeStoneAdderSubtractor(32)).depth() < compile_component(AdderSubtractor(32)).depth() / 4
+
+    compact = CompactNetlist(netlist)
+    for vector in vectors:
+        assert compact.evaluate(vector) == netlist.evaluate(vector)
+
+    event_driven = EventDrivenNetlist(netlist)
+    for vector in vectors:
+        assert event_driven.evaluate(vector) == netlist.evaluate(vector)
+    vector[16] ^= 1  # Toggle the subtract bit
+    assert event_driven.evaluate(vector) == netlist.evaluate(vector)
+    assert 0 < event_driven.evaluated < len(event_driven.gates)
+    assert event_driven.evaluate(vector) == netlist.evaluate(vector)
+    assert event_driven.evaluated == 0
+
+    words, mask = exhaustive_words(17)
+    output_words = netlist.evaluate_words(words, mask)
+    outputs = unpack_words(output_words, 1 << 17)
+    for vector in [0, 1, 0x1FFFF, 0x0C00B, random.getrandbits(17)]:
+        assert outputs[vector] == netlist.evaluate(int_to_bits(vector, 17))
+    assert netlist.evaluate_batch(vectors) == [netlist.evaluate(vector) for vector in vectors]
+    if np is not None:
+        assert netlist.evaluate_batch(np.array(vectors, dtype=np.uint8)).tolist() == netlist.evaluate_batch(vectors)
+        levelized = LevelizedNetlist(netlist)
+        assert levelized.level_count < len(levelized.gates) and levelized.depth() == netlist.depth()
+        assert levelized.evaluate_words(words, mask) == output_words
+        assert levelized.evaluate_batch(vectors) == netlist.evaluate_batch(vectors)
+        reference = EightBit2sComplementAdderSubtractor()
+        numpy_adder_subtractor = EightBit2sComplementAdderSubtractor()
+        numpy_adder_subtractor.set_backend("numpy")
+        for vector in vectors:
+            reference.set_inputs_from_array(vector)
+            reference.evaluate()
+            numpy_adder_subtractor.set_inputs_from_array(vector)
+            numpy_adder_subtractor.evaluate()
+            assert numpy_adder_subtractor.get_all_outputs() == reference.get_all_outputs()
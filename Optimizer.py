@@ -0,0 +1,181 @@
+import random
+
+from Netlist import AND, OR, NAND, NOR, NOT, BUF, CONST_0, CONST_1, Netlist, compile_component, int_to_bits
+
+# Whether each two input gate inverts, folding a constant or tied input of NAND and NOR leaves a NotGate
+_INVERTING = {AND: False, OR: False, NAND: True, NOR: True}
+# The input value that decides the output of each two input gate on its own
+_DOMINANT = {AND: CONST_0, OR: CONST_1, NAND: CONST_0, NOR: CONST_1}
+
+
+def invert_constant(net):
+    return CONST_1 if net == CONST_0 else CONST_0
+
+
+def optimize_netlist(netlist, constant_inputs=None):
+    # Returns a new Netlist computing the same outputs and a report of what was removed.
+    # constant_inputs is {input index: value} for inputs tied to a constant, their nets are folded away.
+    if netlist.feedback:
+        raise ValueError("Netlists with combinational feedback can't be optimized")
+    report = {"gates_before": len(netlist.gates), "constants_folded": 0, "common_subexpressions": 0,
+              "double_nots": 0, "dead_gates": 0}
+    # {net: equivalent net}, constants are CONST_0 and CONST_1
+    alias = {}
+    for index, value in (constant_inputs or {}).items():
+        alias[netlist.input_nets[index]] = CONST_1 if value else CONST_0
+    # {(op, input_net_a, input_net_b): output_net} for structural hashing
+    existing = {}
+    # {output net of a NotGate: its input net}
+    inverted = {}
+    gates = []
+
+    def emit(op, a, b, out):
+        if op == NOT:
+            source = inverted.get(a)
+            if source is not None:
+                report["double_nots"] += 1
+                alias[out] = source
+                return
+        key = (op, a, b) if a <= b else (op, b, a)
+        net = existing.get(key)
+        if net is not None:
+            report["common_subexpressions"] += 1
+            alias[out] = net
+            return
+        existing[key] = out
+        if op == NOT:
+            inverted[out] = a
+        gates.append([op, a, b, out])
+
+    for op, a, b, out in netlist.gates:
+        a = alias.get(a, a)
+        b = alias.get(b, b)
+        if op == BUF:
+            alias[out] = a
+            continue
+        if op == NOT:
+            if a == CONST_0 or a == CONST_1:
+                report["constants_folded"] += 1
+                alias[out] = invert_constant(a)
+            else:
+                emit(NOT, a, a, out)
+            continue
+        if a == CONST_0 or a == CONST_1:
+            a, b = b, a
+        if b == CONST_0 or b == CONST_1:
+            # A dominant constant decides the output, otherwise the gate passes or inverts a
+            report["constants_folded"] += 1
+            inverting = _INVERTING[op]
+            if b == _DOMINANT[op]:
+                alias[out] = invert_constant(b) if inverting else b
+            elif a == CONST_0 or a == CONST_1:
+                alias[out] = invert_constant(a) if inverting else a
+            elif inverting:
+                emit(NOT, a, a, out)
+            else:
+                alias[out] = a
+            continue
+        if a == b:
+            # Tied inputs, AND and OR pass the net through and NAND and NOR invert it
+            report["constants_folded"] += 1
+            if _INVERTING[op]:
+                emit(NOT, a, a, out)
+            else:
+                alias[out] = a
+            continue
+        emit(op, a, b, out)
+
+    optimized = Netlist()
+    optimized.net_count = netlist.net_count
+    optimized.input_nets = list(netlist.input_nets)
+    optimized.output_nets = [alias.get(net, net) for net in netlist.output_nets]
+    optimized.registers = [[alias.get(d, d), q, initial] for d, q, initial in netlist.registers]
+    # Dead gate removal, walking backwards from the outputs and the DFlipFlops
+    needed = set(optimized.output_nets)
+    needed.update(d for d, q, initial in optimized.registers)
+    live = []
+    for gate in reversed(gates):
+        if gate[3] in needed:
+            live.append(gate)
+            needed.add(gate[1])
+            needed.add(gate[2])
+    live.reverse()
+    report["dead_gates"] = len(gates) - len(live)
+    optimized.gates = live
+    optimized.reset()
+    report["gates_after"] = len(live)
+    return optimized, report
+
+
+def verify(component, netlist, constant_inputs=None, samples=1000, max_exhaustive_inputs=12):
+    # Compares netlist against Component.evaluate(), on every input vector when there are few enough inputs
+    # and on random ones otherwise. Returns [[inputs, expected, got]] for every mismatch.
+    width = len(component.inputs)
+    if width <= max_exhaustive_inputs:
+        vectors = [int_to_bits(vector, width) for vector in range(2 ** width)]
+    else:
+        vectors = [int_to_bits(random.getrandbits(width), width) for _ in range(samples)]
+    for index, value in (constant_inputs or {}).items():
+        for vector in vectors:
+            vector[index] = 1 if value else 0
+    if netlist.registers:
+        got = [netlist.evaluate(vector) for vector in vectors]
+    else:
+        got = netlist.evaluate_batch(vectors)
+    mismatches = []
+    for vector, outputs in zip(vectors, got):
+        component.set_inputs_from_array(vector)
+        component.evaluate()
+        expected = component.get_all_outputs()
+        if outputs != expected:
+            mismatches.append([vector, expected, outputs])
+    return mismatches
+
+
+def optimize(component, constant_inputs=None, check=False):
+    # Compiles and optimizes component. With check, the result is verified against Component.evaluate()
+    # and a ValueError is raised on a mismatch.
+    optimized, report = optimize_netlist(compile_component(component), constant_inputs)
+    if check:
+        mismatches = verify(component, optimized, constant_inputs)
+        if mismatches:
+            raise ValueError(f"Optimized {type(component).__name__} differs on {len(mismatches)} vectors, "
+                             f"first {mismatches[0]}")
+    return optimized, report
+
+
+if __name__ == "__main__":
+    from Circuit import (Component, AndGate, NotGate, HalfAdder, FullAdder, EightBitBinaryAdder,
+                         EightBit2sComplementAdderSubtractor, KoggeStoneAdderSubtractor, EightBitAccumulator)
+
+    for component_class in [HalfAdder, FullAdder, EightBitBinaryAdder, EightBit2sComplementAdderSubtractor,
+                            KoggeStoneAdderSubtractor]:
+        optimized, report = optimize(component_class(), check=True)
+        assert report["gates_after"] <= report["gates_before"]
+
+    # With the subtract bit tied to 0 every XorGate on B folds away
+    optimized, report = optimize(EightBit2sComplementAdderSubtractor(), {16: 0}, check=True)
+    assert report["gates_after"] < report["gates_before"] - 8 * 2
+    assert optimized.evaluate([0, 1, 1, 0, 0, 0, 0, 0,
+                               0, 0, 0, 0, 0, 1, 0, 1,
+                               1]) == [0, 0, 1, 1, 0, 0, 1, 0, 1]  # 96 + 5, the subtract bit is ignored
+
+    # Double NOT, a duplicated AndGate and a gate that reaches no output
+    redundant = Component()
+    redundant.connect_input(0, 0, 0)
+    redundant.connect_input(0, 2, 0)
+    redundant.connect_input(0, 3, 0)
+    redundant.connect_input(1, 2, 1)
+    redundant.connect_input(1, 3, 1)
+    redundant.connect_inner_components(0, 0, 1, 0)
+    redundant.connect_inner_components(1, 0, 4, 0)
+    redundant.connect_inner_components(2, 0, 4, 1)
+    redundant.connect_inner_components(3, 0, 5, 0)
+    redundant.connect_output(0, 4, 0)
+    redundant.inner_components = [NotGate(), NotGate(), AndGate(), AndGate(), AndGate(), NotGate()]
+    optimized, report = optimize(redundant, check=True)
+    assert report["double_nots"] == 1 and report["common_subexpressions"] == 1 and report["dead_gates"] == 2
+    assert report["gates_after"] == 2
+
+    optimized, report = optimize(EightBitAccumulator())
+    assert optimized.registers and report["gates_after"] <= report["gates_before"]
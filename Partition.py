@@ -0,0 +1,304 @@
+import time
+from multiprocessing import Barrier, Process
+from multiprocessing.shared_memory import SharedMemory
+
+from Netlist import AND, OR, NAND, NOR, NOT, CONST_1, Netlist, compile_component
+
+
+def instance_groups(netlist, depth):
+    # Splits the gates by the instance depth levels below the top that they sit in, so group boundaries are
+    # inner_links and inputs of those instances. Returns ([group path], [group index per gate]) with the groups in
+    # inner_components order.
+    root = next(iter(netlist.ports))
+    owner = {}
+    for path, (input_nets, output_nets) in netlist.ports.items():
+        # Parents come before their inner components, so the gate itself ends up owning its output net
+        for net in output_nets:
+            owner[net] = path
+    paths = {}
+    for path in netlist.ports:
+        paths.setdefault("/".join(path.split("/")[:1 + 2 * depth]), len(paths))
+    groups = [paths.get("/".join(owner.get(out, root).split("/")[:1 + 2 * depth]), 0)
+              for op, a, b, out in netlist.gates]
+    return list(paths), groups
+
+
+def crossings(netlist, groups, group_count):
+    # Number of nets crossing each boundary of the groups laid out in order, boundary j sits before group j
+    producer = {}
+    for index, (op, a, b, out) in enumerate(netlist.gates):
+        producer[out] = groups[index]
+    spans = {}
+    for index, (op, a, b, out) in enumerate(netlist.gates):
+        for net in {a, b}:
+            source = producer.get(net)
+            if source is not None and source != groups[index]:
+                low, high = spans.get(net, (source, source))
+                spans[net] = (min(low, groups[index]), max(high, groups[index]))
+    difference = [0] * (group_count + 1)
+    for low, high in spans.values():
+        difference[low + 1] += 1
+        difference[high + 1] -= 1
+    counts = []
+    running = 0
+    for value in difference:
+        running += value
+        counts.append(running)
+    return counts
+
+
+def partition_netlist(netlist, parts, depth=None, imbalance=0.1):
+    # Splits the gates of a netlist compiled with ports=True into parts regions of whole instances. The instances
+    # keep their inner_components order and every boundary goes where the fewest nets cross while the regions stay
+    # within imbalance of the average gate count. depth picks how deep instances are split, by default the
+    # shallowest depth with at least 8 instances per region. Returns [region per gate].
+    if not netlist.ports:
+        raise ValueError("Partitioning needs a netlist compiled with ports=True")
+    max_depth = max(path.count("/") for path in netlist.ports) // 2
+    if depth is None:
+        depth = 1
+        while depth < max_depth and len(instance_groups(netlist, depth)[0]) < 8 * parts:
+            depth += 1
+    paths, groups = instance_groups(netlist, depth)
+    sizes = [0] * len(paths)
+    for group in groups:
+        sizes[group] += 1
+    crossing = crossings(netlist, groups, len(paths))
+    total = len(netlist.gates)
+    # Gates before each boundary
+    before = [0]
+    for size in sizes:
+        before.append(before[-1] + size)
+    boundaries = [0]
+    for region in range(1, parts):
+        ideal = total * region / parts
+        window = total * imbalance / parts / 2
+        candidates = [j for j in range(boundaries[-1] + 1, len(paths)) if abs(before[j] - ideal) <= window]
+        if not candidates:
+            candidates = [min(range(boundaries[-1] + 1, len(paths) + 1), key=lambda j: abs(before[j] - ideal))]
+        boundaries.append(min(candidates, key=lambda j: (crossing[j], abs(before[j] - ideal))))
+    region_of_group = []
+    region = 0
+    for group in range(len(paths)):
+        while region + 1 < len(boundaries) and group >= boundaries[region + 1]:
+            region += 1
+        region_of_group.append(region)
+    return [region_of_group[group] for group in groups]
+
+
+def plan_phases(netlist, regions):
+    # Levels the gates like LevelizedNetlist and puts a barrier only where a net crosses regions, as late as every
+    # crossing net allows so one barrier serves as many of them as possible. Returns ([phase per gate], phase count,
+    # cut nets).
+    level = [0] * netlist.net_count
+    gate_levels = []
+    producer = {}
+    for index, (op, a, b, out) in enumerate(netlist.gates):
+        gate_level = max(level[a], level[b])
+        level[out] = gate_level + 1
+        gate_levels.append(gate_level)
+        producer[out] = index
+    # (consumer level, producer level) of every net read in another region than its own
+    intervals = []
+    cut = set()
+    for index, (op, a, b, out) in enumerate(netlist.gates):
+        for net in {a, b}:
+            source = producer.get(net)
+            if source is not None and regions[source] != regions[index]:
+                cut.add(net)
+                intervals.append((gate_levels[index], gate_levels[source]))
+    barriers = []
+    for consumer_level, producer_level in sorted(intervals):
+        if not barriers or barriers[-1] <= producer_level:
+            barriers.append(consumer_level)
+    phases = []
+    for gate_level in gate_levels:
+        phase = 0
+        while phase < len(barriers) and barriers[phase] <= gate_level:
+            phase += 1
+        phases.append(phase)
+    return phases, len(barriers) + 1, cut
+
+
+def make_phase(gates):
+    # Straight-line code for the gates of one region in one phase, values is the shared memory buffer
+    lines = ["def run(values):"]
+    for op, a, b, out in gates:
+        if op == AND:
+            expression = f"values[{a}] & values[{b}]"
+        elif op == OR:
+            expression = f"values[{a}] | values[{b}]"
+        elif op == NAND:
+            expression = f"1 ^ (values[{a}] & values[{b}])"
+        elif op == NOR:
+            expression = f"1 ^ (values[{a}] | values[{b}])"
+        elif op == NOT:
+            expression = f"1 ^ values[{a}]"
+        else:
+            expression = f"values[{a}]"
+        lines.append(f"    values[{out}] = {expression}")
+    if not gates:
+        lines.append("    pass")
+    namespace = {}
+    exec(compile("\n".join(lines) + "\n", "<phase>", "exec"), namespace)
+    return namespace["run"]
+
+
+def run_worker(memory, stop_index, phases, start_barrier, level_barrier):
+    values = memory.buf
+    functions = [make_phase(gates) for gates in phases]
+    last = len(functions) - 1
+    try:
+        while True:
+            start_barrier.wait()
+            if values[stop_index]:
+                break
+            for phase, function in enumerate(functions):
+                function(values)
+                if phase < last:
+                    level_barrier.wait()
+            start_barrier.wait()
+    finally:
+        del values
+        memory.close()
+
+
+class PartitionedNetlist:
+
+    def __init__(self, component, parts=2, depth=None, imbalance=0.1, timeout=60):
+        # component is a Component or a netlist compiled with ports=True. Each region is evaluated by its own
+        # process, the net values live in one shared memory block and the processes meet at a barrier wherever a
+        # net crosses regions. Call close() (or use a with block) to stop the processes.
+        self.netlist = component if isinstance(component, Netlist) else compile_component(component, ports=True)
+        if self.netlist.feedback:
+            raise ValueError("Partitioned simulation needs a netlist without combinational feedback")
+        self.parts = parts
+        self.regions = partition_netlist(self.netlist, parts, depth, imbalance)
+        phases, self.phase_count, self.cut = plan_phases(self.netlist, self.regions)
+        self.region_gates = [0] * parts
+        worker_phases = [[[] for _ in range(self.phase_count)] for _ in range(parts)]
+        for gate, region, phase in zip(self.netlist.gates, self.regions, phases):
+            self.region_gates[region] += 1
+            worker_phases[region][phase].append(gate)
+        # Net values followed by the stop flag
+        self.stop_index = self.netlist.net_count
+        self.memory = SharedMemory(create=True, size=self.netlist.net_count + 1)
+        self.values = self.memory.buf
+        self.start_barrier = Barrier(parts + 1, timeout=timeout)
+        self.level_barrier = Barrier(parts, timeout=timeout)
+        self.workers = [Process(target=run_worker, args=(self.memory, self.stop_index, worker_phases[region],
+                                                         self.start_barrier, self.level_barrier), daemon=True)
+                        for region in range(parts)]
+        for worker in self.workers:
+            worker.start()
+        self.reset()
+        # Waits until every worker has generated its code, so the first real evaluate() isn't slowed down by it
+        self.evaluate([0] * len(self.netlist.input_nets))
+        self.reset()
+
+    def reset(self):
+        values = self.values
+        values[:self.netlist.net_count] = bytes(self.netlist.net_count)
+        values[CONST_1] = 1
+        for d, q, initial in self.netlist.registers:
+            values[q] = initial
+
+    def evaluate(self, inputs):
+        values = self.values
+        for net, value in zip(self.netlist.input_nets, inputs):
+            values[net] = 1 if value else 0
+        # Once to start the workers and once more when they have all finished
+        self.start_barrier.wait()
+        self.start_barrier.wait()
+        return [values[net] for net in self.netlist.output_nets]
+
+    def evaluate_words(self, words, mask, input_nets=None, output_nets=None):
+        # Packed words don't fit the byte per net shared memory, batches run in this process
+        return self.netlist.evaluate_words(words, mask, input_nets, output_nets)
+
+    def tick(self):
+        values = self.values
+        captured = [values[d] for d, q, initial in self.netlist.registers]
+        for (d, q, initial), value in zip(self.netlist.registers, captured):
+            values[q] = value
+
+    def report(self):
+        average = len(self.netlist.gates) / self.parts
+        return {"parts": self.parts, "region_gates": list(self.region_gates),
+                "balance": max(self.region_gates) / average if average else 1.0, "cut_nets": len(self.cut),
+                "phases": self.phase_count, "gates": len(self.netlist.gates)}
+
+    def measure(self, vectors):
+        # Seconds to evaluate vectors one at a time here and with the same straight-line code for the whole netlist
+        # in this process alone
+        vectors = list(vectors)
+        started = time.perf_counter()
+        for vector in vectors:
+            self.evaluate(vector)
+        parallel_seconds = time.perf_counter() - started
+        run = make_phase(self.netlist.gates)
+        values = bytearray(self.values[:self.netlist.net_count])
+        input_nets = self.netlist.input_nets
+        output_nets = self.netlist.output_nets
+        started = time.perf_counter()
+        for vector in vectors:
+            for net, value in zip(input_nets, vector):
+                values[net] = 1 if value else 0
+            run(values)
+            [values[net] for net in output_nets]
+        single_seconds = time.perf_counter() - started
+        return {"vectors": len(vectors), "single_seconds": single_seconds, "parallel_seconds": parallel_seconds,
+                "speedup": single_seconds / parallel_seconds if parallel_seconds else 0}
+
+    def close(self):
+        if self.memory is None:
+            return
+        self.values[self.stop_index] = 1
+        if all(worker.is_alive() for worker in self.workers):
+            self.start_barrier.wait()
+        for worker in self.workers:
+            worker.join()
+        del self.values
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import os
+    import random
+
+    from Circuit import EightBit2sComplementAdderSubtractor, EightBitAccumulator, KoggeStoneAdderSubtractor
+    from Netlist import int_to_bits
+
+    for component, parts in [(EightBit2sComplementAdderSubtractor(), 2), (KoggeStoneAdderSubtractor(64), 4)]:
+        netlist = compile_component(component)
+        width = len(component.inputs)
+        vectors = [int_to_bits(random.getrandbits(width), width) for _ in range(50)]
+        with PartitionedNetlist(component, parts) as partitioned:
+            for vector in vectors:
+                assert partitioned.evaluate(vector) == netlist.evaluate(vector)
+            report = partitioned.report()
+            assert sum(report["region_gates"]) == report["gates"] and all(report["region_gates"])
+            assert report["balance"] < 1.2 and report["cut_nets"] < report["gates"] / 4
+            report.update(partitioned.measure(vectors))
+            print(f"{type(component).__name__}: {report['gates']} gates in {parts} regions, balance "
+                  f"{report['balance']:.2f}, {report['cut_nets']} cut nets, {report['phases']} phases, speedup "
+                  f"{report['speedup']:.2f} on {os.cpu_count()} cores")
+
+    # The ripple-carry adder-subtractor only needs one barrier per boundary, where the carry crosses
+    with PartitionedNetlist(EightBit2sComplementAdderSubtractor(), 2, depth=1) as partitioned:
+        assert partitioned.report()["phases"] == 2 and partitioned.report()["cut_nets"] == 1
+
+    accumulator = EightBitAccumulator()
+    with PartitionedNetlist(accumulator, 2) as partitioned:
+        accumulator.backend = partitioned
+        accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 1, 1, 1])
+        accumulator.step(86)
+        assert accumulator.get_all_outputs() == [0, 0, 0, 0, 0, 0, 1, 0]
@@ -0,0 +1,185 @@
+from time import perf_counter
+
+from Circuit import Component
+
+
+def component_classes():
+    classes = []
+    pending = [Component]
+    while pending:
+        component_class = pending.pop()
+        classes.append(component_class)
+        pending.extend(component_class.__subclasses__())
+    return classes
+
+
+class Profiler:
+
+    def __init__(self):
+        # {instance path: [calls, cumulative seconds, self seconds, output toggles]}
+        # an instance path looks like EightBit2sComplementAdderSubtractor/[3]/FullAdder/[0]/XorGate
+        self.stats = {}
+        # [[path, component, start, seconds spent in children, output values before]]
+        self.stack = []
+        # Path of the inner component about to be evaluated, set by the parent
+        self.next_path = None
+        # {component_class: evaluate defined on the class}, restored by disable()
+        self.replaced = {}
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def enable(self):
+        # Instrumented methods replace evaluate() on the classes themselves, so nothing is left behind by disable()
+        if self.replaced:
+            return
+        for component_class in component_classes():
+            evaluate = component_class.__dict__.get("evaluate")
+            if evaluate is None:
+                continue
+            self.replaced[component_class] = evaluate
+            if component_class is Component:
+                component_class.evaluate = self.make_composite_evaluate()
+            else:
+                component_class.evaluate = self.make_leaf_evaluate(evaluate)
+
+    def disable(self):
+        for component_class, evaluate in self.replaced.items():
+            component_class.evaluate = evaluate
+        self.replaced = {}
+        self.stack = []
+        self.next_path = None
+
+    def clear(self):
+        self.stats = {}
+
+    def push(self, component):
+        # Returns False when component is already being evaluated, like SRLatch.settle() calling Component.evaluate()
+        if self.stack and self.stack[-1][1] is component:
+            return False
+        path = self.next_path or type(component).__name__
+        self.next_path = None
+        self.stack.append([path, component, perf_counter(), 0.0, [out[0] for out in component.outputs]])
+        return True
+
+    def pop(self):
+        path, component, start, children_seconds, before = self.stack.pop()
+        seconds = perf_counter() - start
+        stats = self.stats.get(path)
+        if stats is None:
+            stats = self.stats[path] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += seconds - children_seconds
+        for out, value in zip(component.outputs, before):
+            if out[0] != value:
+                stats[3] += 1
+        if self.stack:
+            self.stack[-1][3] += seconds
+
+    def make_leaf_evaluate(self, original_evaluate):
+        profiler = self
+
+        def evaluate(component):
+            if not profiler.push(component):
+                original_evaluate(component)
+                return
+            try:
+                original_evaluate(component)
+            finally:
+                profiler.pop()
+
+        return evaluate
+
+    def make_composite_evaluate(self):
+        # Same as Component.evaluate() but tells each inner component its instance path
+        profiler = self
+
+        def evaluate(component):
+            pushed = profiler.push(component)
+            try:
+                if component.backend is not None:
+                    outputs = component.backend.evaluate([inp[0] for inp in component.inputs])
+                    for out, value in zip(component.outputs, outputs):
+                        out[0] = value
+                    return
+                path = profiler.stack[-1][0]
+                for inp in component.inputs:
+                    value = inp[0]
+                    for inner_component_index, inner_component_input_index in inp[1]:
+                        component.inner_components[inner_component_index].set_input(inner_component_input_index, value)
+                for index, inner_component in enumerate(component.inner_components):
+                    profiler.next_path = f"{path}/[{index}]/{type(inner_component).__name__}"
+                    inner_component.evaluate()
+                    links = component.inner_links.get(index)
+                    if links is not None:
+                        for out_index, inner_component_index, inner_component_input_index in links:
+                            component.inner_components[inner_component_index].set_input(
+                                inner_component_input_index, inner_component.get_output(out_index))
+                for out in component.outputs:
+                    out[0] = component.inner_components[out[1]].get_output(out[2])
+            finally:
+                profiler.next_path = None
+                if pushed:
+                    profiler.pop()
+
+        return evaluate
+
+    def class_stats(self):
+        # {class name: [calls, cumulative seconds, self seconds, output toggles]} summed over instance paths
+        totals = {}
+        for path, stats in self.stats.items():
+            name = path.rsplit("/", 1)[-1]
+            total = totals.setdefault(name, [0, 0.0, 0.0, 0])
+            for i, value in enumerate(stats):
+                total[i] += value
+        return totals
+
+    def report(self, top=20, by_class=False):
+        stats = self.class_stats() if by_class else self.stats
+        lines = [f"{'calls':>10} {'cumulative s':>13} {'self s':>10} {'toggles':>10}  {'class' if by_class else 'path'}"]
+        for name, (calls, cumulative, own, toggles) in sorted(stats.items(), key=lambda item: -item[1][2])[:top]:
+            lines.append(f"{calls:>10} {cumulative:>13.6f} {own:>10.6f} {toggles:>10}  {name}")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self):
+        # One "frame;frame;frame self_microseconds" line per instance path, for flamegraph.pl and speedscope
+        lines = []
+        for path, (calls, cumulative, own, toggles) in self.stats.items():
+            segments = path.split("/")
+            frames = [segments[0]] + [f"{segments[i + 1]}{segments[i]}" for i in range(1, len(segments) - 1, 2)]
+            lines.append(f"{';'.join(frames)} {max(1, round(own * 1e6))}")
+        return "\n".join(lines) + "\n"
+
+    def write_collapsed_stacks(self, filename):
+        with open(filename, "w") as file:
+            file.write(self.collapsed_stacks())
+
+
+if __name__ == "__main__":
+    from Circuit import AndGate, SRLatch, EightBit2sComplementAdderSubtractor
+
+    original_evaluate = Component.evaluate
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    adder_subtractor.set_inputs_from_array([0, 1, 1, 0, 0, 0, 0, 0,
+                                            0, 0, 0, 0, 0, 1, 0, 1,
+                                            1])
+    with Profiler() as profiler:
+        adder_subtractor.evaluate()
+        adder_subtractor.evaluate()
+    assert adder_subtractor.get_all_outputs() == [1, 0, 1, 0, 1, 1, 0, 1, 1]
+    assert Component.evaluate is original_evaluate and AndGate.evaluate.__qualname__ == "AndGate.evaluate"
+    assert profiler.stats["EightBit2sComplementAdderSubtractor"][0] == 2
+    assert profiler.stats["EightBit2sComplementAdderSubtractor/[3]/TwoBit2sComplementAdderSubtractor/[1]/FullAdder/[0]/XorGate"][0] == 2
+    assert profiler.class_stats()["XorGate"][0] == 2 * 8 * 3
+    assert "EightBit2sComplementAdderSubtractor;TwoBit2sComplementAdderSubtractor[0];XorGate[0];OrGate[0] " in profiler.collapsed_stacks()
+
+    with Profiler() as profiler:
+        latch = SRLatch()
+        latch.set_inputs_from_array([1, 0])
+        latch.evaluate()
+    assert profiler.stats["SRLatch"][0] == 1 and profiler.stats["SRLatch"][3] == 2
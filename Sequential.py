@@ -0,0 +1,101 @@
+from Netlist import compile_component, exhaustive_words, unpack_word, int_to_bits
+
+
+class ClockedSimulator:
+
+    def __init__(self, component, table_bits=18):
+        self.netlist = compile_component(component)
+        self.input_count = len(self.netlist.input_nets)
+        self.register_count = len(self.netlist.registers)
+        self.output_count = len(self.netlist.output_nets)
+        self.inputs = [0] * self.input_count
+        self.cycles = 0
+        # With few enough input and state bits, every clock cycle becomes a lookup in a transition table
+        # {(inputs << register_count) | state: (next_state << output_count) | outputs}
+        self.table = None
+        if not self.netlist.feedback and self.input_count + self.register_count <= table_bits:
+            self.table = self.build_table()
+        self.state = 0
+        for d, q, initial in self.netlist.registers:
+            self.state = (self.state << 1) | initial
+
+    def build_table(self):
+        netlist = self.netlist
+        q_nets = [q for d, q, initial in netlist.registers]
+        d_nets = [d for d, q, initial in netlist.registers]
+        width = self.input_count + self.register_count
+        words, mask = exhaustive_words(width)
+        output_words = netlist.evaluate_words(words, mask, netlist.input_nets + q_nets, d_nets + netlist.output_nets)
+        count = 1 << width
+        table = [0] * count
+        for word in output_words:
+            table = [(entry << 1) | bit for entry, bit in zip(table, unpack_word(word, count))]
+        return table
+
+    def set_inputs(self, inputs):
+        self.inputs = [1 if value else 0 for value in inputs]
+
+    def get_state(self):
+        # Register values in the order the DFlipFlops were compiled
+        if self.table is None:
+            return [self.netlist.values[q] for d, q, initial in self.netlist.registers]
+        return int_to_bits(self.state, self.register_count)
+
+    def get_outputs(self):
+        if self.table is None:
+            return self.netlist.evaluate(self.inputs)
+        return int_to_bits(self.table[self.key_base() | self.state], self.output_count)
+
+    def key_base(self):
+        key = 0
+        for value in self.inputs:
+            key = (key << 1) | value
+        return key << self.register_count
+
+    def step(self, n_cycles=1, inputs=None):
+        # Runs n_cycles clock edges with the same inputs and returns the outputs settled after the last one
+        if inputs is not None:
+            self.set_inputs(inputs)
+        if self.table is None:
+            netlist = self.netlist
+            for _ in range(n_cycles):
+                netlist.evaluate(self.inputs)
+                netlist.tick()
+        else:
+            table = self.table
+            key_base = self.key_base()
+            shift = self.output_count
+            state = self.state
+            for _ in range(n_cycles):
+                state = table[key_base | state] >> shift
+            self.state = state
+        self.cycles += n_cycles
+        return self.get_outputs()
+
+
+if __name__ == "__main__":
+    import time
+
+    from Circuit import EightBitAccumulator, SRLatch
+
+    simulator = ClockedSimulator(EightBitAccumulator())
+    assert simulator.table is not None
+    assert simulator.step(5, [0, 0, 0, 0, 0, 0, 1, 1, 1]) == [0, 0, 0, 0, 1, 1, 1, 1]  # 15
+    assert simulator.step(81) == [0, 0, 0, 0, 0, 0, 1, 0]  # 258 & 0xFF
+    assert simulator.step(10, [0, 0, 0, 0, 0, 0, 1, 1, 0]) == [0, 0, 0, 0, 0, 0, 1, 0]  # Not loading
+
+    untabled = ClockedSimulator(EightBitAccumulator(), table_bits=0)
+    assert untabled.table is None
+    assert untabled.step(86, [0, 0, 0, 0, 0, 0, 1, 1, 1]) == [0, 0, 0, 0, 0, 0, 1, 0]
+    assert untabled.get_state() == simulator.get_state()
+
+    start = time.perf_counter()
+    simulator.step(1000000, [0, 0, 0, 0, 0, 1, 0, 1, 1])
+    assert time.perf_counter() - start < 10
+    assert simulator.get_outputs() == int_to_bits((2 + 5 * 1000000) & 0xFF, 8)
+
+    latch = ClockedSimulator(SRLatch())
+    assert latch.table is None and latch.netlist.feedback
+    assert latch.step(1, [1, 0]) == [1, 0]
+    assert latch.step(1, [0, 0]) == [1, 0]
+    assert latch.step(1, [0, 1]) == [0, 1]
@@ -0,0 +1,435 @@
+import json
+import os
+import struct
+import sys
+from array import array
+
+import Circuit
+from Circuit import Component, DFlipFlop, instantiate
+from Codegen import CACHE_DIR
+from Netlist import COMPILER_HASH, Netlist, compile_component, gate_type_of, structural_hash, tied_inputs
+
+# Bump when either binary layout or the JSON layout changes, files of other versions are rejected
+FORMAT_VERSION = 2
+
+COMPONENT_MAGIC = b"CCMP"
+# magic, version, structural hash of the tree, byte length of the class names
+COMPONENT_HEADER = struct.Struct("<4sB3x40sI")
+NETLIST_MAGIC = b"CNET"
+NETLIST_HEADER = struct.Struct("<4sB3x")
+
+
+def is_leaf(component):
+    # Leaves are rebuilt from their class alone, the definition of their parent holds the values that matter:
+    # inner inputs tied to 1 and DFlipFlops holding 1
+    return gate_type_of(component) is not None or isinstance(component, DFlipFlop)
+
+
+def collect_definitions(component):
+    # Returns (class names, definitions, root index). Every structurally different subtree is stored once, a
+    # definition is [class index] for leaves and [class index, inputs, outputs, inner_links, inner definition indexes,
+    # [[inner index, input index]] of the inner inputs nothing drives that are 1, [inner index] of the DFlipFlops
+    # holding 1] otherwise. Everything else starts at 0 when the tree is rebuilt, like in new components. Inner
+    # definitions always come before the definitions using them.
+    class_names = []
+    class_indexes = {}
+    definitions = []
+    definition_indexes = {}
+
+    def visit(component):
+        name = type(component).__name__
+        class_index = class_indexes.get(name)
+        if class_index is None:
+            class_index = class_indexes[name] = len(class_names)
+            class_names.append(name)
+        if is_leaf(component):
+            definition = [class_index]
+        else:
+            definition = [class_index, [inp[1] for inp in component.inputs], [out[1:] for out in component.outputs],
+                          sorted(component.inner_links.items()),
+                          [visit(inner_component) for inner_component in component.inner_components],
+                          [[index, i] for index, i, value in tied_inputs(component) if value],
+                          [index for index, inner_component in enumerate(component.inner_components)
+                           if isinstance(inner_component, DFlipFlop) and inner_component.get_output(0)]]
+        key = repr(definition)
+        index = definition_indexes.get(key)
+        if index is None:
+            index = definition_indexes[key] = len(definitions)
+            definitions.append(definition)
+        return index
+
+    root = visit(component)
+    return class_names, definitions, root
+
+
+def find_class(name, classes=None):
+    # classes is {name: class} for components defined outside Circuit
+    component_class = (classes or {}).get(name) or getattr(Circuit, name, None)
+    if not isinstance(component_class, type) or not issubclass(component_class, Component):
+        raise ValueError(f"Unknown component class {name}")
+    return component_class
+
+
+def build_component(class_names, definitions, root, classes=None):
+    # The reverse of collect_definitions(), without running any constructor but the ones of the leaf classes.
+    # Inner components with the same definition share their wiring lists like Component.clone() does.
+    component_classes = [find_class(name, classes) for name in class_names]
+    prototypes = []
+    for definition in definitions:
+        component_class = component_classes[definition[0]]
+        if len(definition) == 1:
+            prototypes.append(instantiate(component_class))
+            continue
+        class_index, inputs, outputs, inner_links, inner_indexes, tied, set_flip_flops = definition
+        component = object.__new__(component_class)
+        component.inputs = [[0, targets] for targets in inputs]
+        # connect_output() starts each output at its own index
+        component.outputs = [[index, inner_index, output_index]
+                             for index, (inner_index, output_index) in enumerate(outputs)]
+        component.inner_links = dict(inner_links)
+        component.inner_components = [prototypes[index].clone() for index in inner_indexes]
+        for inner_index, input_index in tied:
+            component.inner_components[inner_index].inputs[input_index][0] = 1
+        for inner_index in set_flip_flops:
+            component.inner_components[inner_index].outputs[0][0] = 1
+        component.backend = None
+        prototypes.append(component)
+    return prototypes[root]
+
+
+def to_json_dict(component):
+    class_names, definitions, root = collect_definitions(component)
+    records = []
+    for definition in definitions:
+        record = {"class": class_names[definition[0]]}
+        if len(definition) > 1:
+            record["inputs"] = definition[1]
+            record["outputs"] = definition[2]
+            record["inner_links"] = {str(index): links for index, links in definition[3]}
+            record["inner_components"] = definition[4]
+            record["tied_inputs"] = definition[5]
+            record["set_flip_flops"] = definition[6]
+        records.append(record)
+    return {"format": "circuit-simulation", "version": FORMAT_VERSION, "structural_hash": structural_hash(component),
+            "root": root, "definitions": records}
+
+
+def parse_json_dict(data):
+    # Returns (class names, definitions, root index) like collect_definitions()
+    if data.get("format") != "circuit-simulation":
+        raise ValueError("Not a serialized circuit")
+    if data.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported circuit format version {data.get('version')}")
+    class_names = []
+    class_indexes = {}
+    definitions = []
+    for record in data["definitions"]:
+        name = record["class"]
+        if name not in class_indexes:
+            class_indexes[name] = len(class_names)
+            class_names.append(name)
+        if "inner_components" not in record:
+            definitions.append([class_indexes[name]])
+        else:
+            definitions.append([class_indexes[name], record["inputs"], record["outputs"],
+                                [(int(index), links) for index, links in record["inner_links"].items()],
+                                record["inner_components"], record["tied_inputs"], record["set_flip_flops"]])
+    return class_names, definitions, data["root"]
+
+
+def from_json_dict(data, classes=None):
+    return build_component(*parse_json_dict(data), classes)
+
+
+def write_ints(values):
+    # A typecode byte and the values as little-endian unsigned ints of the smallest size holding all of them
+    largest = max(values, default=0)
+    typecode = "B" if largest < 1 << 8 else "H" if largest < 1 << 16 else "I"
+    ints = array(typecode, values)
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return typecode.encode() + ints.tobytes()
+
+
+def read_ints(data):
+    ints = array(chr(data[0]))
+    ints.frombytes(data[1:])
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return ints
+
+
+def to_bytes(component):
+    # Header, class names separated by newlines, then the definitions as ints, see write_ints()
+    class_names, definitions, root = collect_definitions(component)
+    ints = [len(definitions)]
+    for definition in definitions:
+        ints.append(definition[0])
+        if len(definition) == 1:
+            ints.append(0)
+            continue
+        class_index, inputs, outputs, inner_links, inner_indexes, tied, set_flip_flops = definition
+        ints.append(1)
+        ints.append(len(inputs))
+        for targets in inputs:
+            ints.append(len(targets))
+            for inner_index, input_index in targets:
+                ints += (inner_index, input_index)
+        ints.append(len(outputs))
+        for inner_index, output_index in outputs:
+            ints += (inner_index, output_index)
+        ints.append(len(inner_links))
+        for source, links in inner_links:
+            ints += (source, len(links))
+            for link in links:
+                ints += link
+        ints.append(len(inner_indexes))
+        ints += inner_indexes
+        ints.append(len(tied))
+        for inner_index, input_index in tied:
+            ints += (inner_index, input_index)
+        ints.append(len(set_flip_flops))
+        ints += set_flip_flops
+    ints.append(root)
+    names = "\n".join(class_names).encode()
+    header = COMPONENT_HEADER.pack(COMPONENT_MAGIC, FORMAT_VERSION, structural_hash(component).encode(), len(names))
+    return header + names + write_ints(ints)
+
+
+def read_header(data):
+    # Returns (structural hash, byte length of the class names) of binary component data
+    if len(data) < COMPONENT_HEADER.size:
+        raise ValueError("Not a serialized circuit")
+    magic, version, digest, names_size = COMPONENT_HEADER.unpack_from(data)
+    if magic != COMPONENT_MAGIC:
+        raise ValueError("Not a serialized circuit")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported circuit format version {version}")
+    return digest.decode(), names_size
+
+
+def parse_bytes(data):
+    # Returns (class names, definitions, root index) like collect_definitions()
+    digest, names_size = read_header(data)
+    start = COMPONENT_HEADER.size
+    class_names = bytes(data[start:start + names_size]).decode().split("\n")
+    ints = read_ints(data[start + names_size:])
+    position = 1
+    definitions = []
+    for _ in range(ints[0]):
+        class_index, composite = ints[position], ints[position + 1]
+        position += 2
+        if not composite:
+            definitions.append([class_index])
+            continue
+        inputs = []
+        for _ in range(ints[position]):
+            count = ints[position + 1]
+            position += 1
+            inputs.append([[ints[position + 1 + 2 * i], ints[position + 2 + 2 * i]] for i in range(count)])
+            position += 2 * count
+        position += 1
+        count = ints[position]
+        outputs = [[ints[position + 1 + 2 * i], ints[position + 2 + 2 * i]] for i in range(count)]
+        position += 1 + 2 * count
+        inner_links = []
+        for _ in range(ints[position]):
+            source, count = ints[position + 1], ints[position + 2]
+            position += 2
+            inner_links.append((source, [ints[position + 1 + 3 * i:position + 4 + 3 * i].tolist()
+                                         for i in range(count)]))
+            position += 3 * count
+        position += 1
+        count = ints[position]
+        inner_indexes = ints[position + 1:position + 1 + count].tolist()
+        position += 1 + count
+        count = ints[position]
+        tied = [[ints[position + 1 + 2 * i], ints[position + 2 + 2 * i]] for i in range(count)]
+        position += 1 + 2 * count
+        count = ints[position]
+        set_flip_flops = ints[position + 1:position + 1 + count].tolist()
+        position += 1 + count
+        definitions.append([class_index, inputs, outputs, inner_links, inner_indexes, tied, set_flip_flops])
+    return class_names, definitions, ints[position]
+
+
+def from_bytes(data, classes=None):
+    return build_component(*parse_bytes(data), classes)
+
+
+def parse_file(filename):
+    if filename.endswith(".json"):
+        with open(filename) as file:
+            return parse_json_dict(json.load(file))
+    with open(filename, "rb") as file:
+        return parse_bytes(file.read())
+
+
+def save(component, filename):
+    # JSON for .json files, the binary form for everything else
+    if filename.endswith(".json"):
+        with open(filename, "w") as file:
+            json.dump(to_json_dict(component), file, separators=(",", ":"))
+    else:
+        with open(filename, "wb") as file:
+            file.write(to_bytes(component))
+
+
+def load(filename, classes=None):
+    return build_component(*parse_file(filename), classes)
+
+
+def netlist_to_bytes(netlist):
+    ints = [netlist.net_count, 1 if netlist.feedback else 0, netlist.max_iterations,
+            len(netlist.input_nets), *netlist.input_nets, len(netlist.output_nets), *netlist.output_nets,
+            len(netlist.registers)]
+    for register in netlist.registers:
+        ints += register
+    gates = netlist.gates if netlist.gates is not None else list(map(list, netlist.iterate_gates()))
+    ints.append(len(gates))
+    for gate in gates:
+        ints += gate
+    return NETLIST_HEADER.pack(NETLIST_MAGIC, FORMAT_VERSION) + write_ints(ints)
+
+
+def netlist_from_bytes(data):
+    magic, version = NETLIST_HEADER.unpack_from(data)
+    if magic != NETLIST_MAGIC:
+        raise ValueError("Not a serialized netlist")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported netlist format version {version}")
+    ints = read_ints(data[NETLIST_HEADER.size:])
+    netlist = Netlist()
+    netlist.net_count, feedback, netlist.max_iterations = ints[0], ints[1], ints[2]
+    netlist.feedback = bool(feedback)
+    position = 3
+    count = ints[position]
+    netlist.input_nets = ints[position + 1:position + 1 + count].tolist()
+    position += 1 + count
+    count = ints[position]
+    netlist.output_nets = ints[position + 1:position + 1 + count].tolist()
+    position += 1 + count
+    count = ints[position]
+    netlist.registers = [ints[position + 1 + 3 * i:position + 4 + 3 * i].tolist() for i in range(count)]
+    position += 1 + 3 * count
+    count = ints[position]
+    netlist.gates = [ints[position + 1 + 4 * i:position + 5 + 4 * i].tolist() for i in range(count)]
+    netlist.reset()
+    return netlist
+
+
+def netlist_cache_path(key, cache_dir):
+    # key is the structural hash, the netlist also depends on the compiler that made it
+    return os.path.join(cache_dir, f"{key}-netlist-v{FORMAT_VERSION}-{COMPILER_HASH}.bin")
+
+
+def store_netlist(netlist, key, cache_dir):
+    path = netlist_cache_path(key, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(netlist_to_bytes(netlist))
+    os.replace(temporary_path, path)
+
+
+def cached_netlist(component, cache_dir=CACHE_DIR):
+    # compile_component() with the result kept on disk under the component's structural hash
+    key = structural_hash(component)
+    path = netlist_cache_path(key, cache_dir)
+    if os.path.exists(path):
+        with open(path, "rb") as file:
+            return netlist_from_bytes(file.read())
+    netlist = compile_component(component)
+    store_netlist(netlist, key, cache_dir)
+    return netlist
+
+
+def load_compiled(filename, cache_dir=CACHE_DIR, classes=None):
+    # Netlist of a binary component file. On a warm start the structural hash in the file header finds the
+    # cached netlist and the component tree is never built.
+    with open(filename, "rb") as file:
+        data = file.read()
+    key, names_size = read_header(data)
+    path = netlist_cache_path(key, cache_dir)
+    if os.path.exists(path):
+        with open(path, "rb") as file:
+            return netlist_from_bytes(file.read())
+    netlist = compile_component(from_bytes(data, classes))
+    store_netlist(netlist, key, cache_dir)
+    return netlist
+
+
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+
+    from Circuit import (EightBit2sComplementAdderSubtractor, EightBitAccumulator, KoggeStoneAdderSubtractor,
+                         AdderSubtractor, SRLatch, AndGate)
+    from Netlist import int_to_bits
+
+    for component in [EightBit2sComplementAdderSubtractor(), EightBitAccumulator(), KoggeStoneAdderSubtractor(16),
+                      SRLatch()]:
+        for loaded in [from_bytes(to_bytes(component)), from_json_dict(json.loads(json.dumps(to_json_dict(component))))]:
+            assert type(loaded) is type(component)
+            assert structural_hash(loaded) == structural_hash(component)
+        width = len(component.inputs)
+        for _ in range(50):
+            vector = int_to_bits(random.getrandbits(width), width)
+            component.set_inputs_from_array(vector)
+            loaded.set_inputs_from_array(vector)
+            component.settle()
+            loaded.settle()
+            assert loaded.get_all_outputs() == component.get_all_outputs()
+
+    # DFlipFlop state and tied inputs come back, and they are part of the cache key
+    accumulator = EightBitAccumulator()
+    accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+    accumulator.step(5)
+    tied = Component()
+    tied.connect_input(0, 0, 0)
+    tied.connect_output(0, 0, 0)
+    tied.inner_components = [AndGate()]
+    tied.inner_components[0].set_input(1, 1)
+    for component in [accumulator, tied]:
+        for loaded in [from_bytes(to_bytes(component)), from_json_dict(json.loads(json.dumps(to_json_dict(component))))]:
+            assert structural_hash(loaded) == structural_hash(component)
+            assert compile_component(loaded).evaluate([1] * len(component.inputs)) == \
+                compile_component(component).evaluate([1] * len(component.inputs))
+    with tempfile.TemporaryDirectory() as directory:
+        assert cached_netlist(accumulator, directory).evaluate([0] * 9) == [0, 0, 0, 0, 0, 1, 0, 1]
+        assert cached_netlist(EightBitAccumulator(), directory).evaluate([0] * 9) == [0] * 8
+
+    # Every FullAdder of the 8-bit adder-subtractor is stored once
+    class_names, definitions, root = collect_definitions(EightBit2sComplementAdderSubtractor())
+    assert len(definitions) == len(class_names)
+
+    with tempfile.TemporaryDirectory() as directory:
+        adder_subtractor = AdderSubtractor(64)
+        path = os.path.join(directory, "adder_subtractor.bin")
+        save(adder_subtractor, path)
+        save(adder_subtractor, path + ".json")
+        assert structural_hash(load(path + ".json")) == structural_hash(adder_subtractor)
+
+        started = time.perf_counter()
+        AdderSubtractor(64)
+        construct_seconds = time.perf_counter() - started
+        loaded = load(path)
+
+        started = time.perf_counter()
+        cold = load_compiled(path, directory)
+        compile_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        warm = load_compiled(path, directory)
+        warm_seconds = time.perf_counter() - started
+        assert warm_seconds * 5 < construct_seconds + compile_seconds
+        assert warm.gates == cold.gates == compile_component(adder_subtractor).gates
+        assert cached_netlist(loaded, directory).gates == warm.gates
+        # A changed compiler doesn't see the netlists cached by this one
+        assert os.path.exists(netlist_cache_path(structural_hash(adder_subtractor), directory))
+        COMPILER_HASH = "0" * 16
+        assert not os.path.exists(netlist_cache_path(structural_hash(adder_subtractor), directory))
+        vector = int_to_bits(random.getrandbits(129), 129)
+        adder_subtractor.set_inputs_from_array(vector)
+        adder_subtractor.evaluate()
+        assert warm.evaluate(vector) == adder_subtractor.get_all_outputs()
@@ -0,0 +1,429 @@
+import asyncio
+import json
+import struct
+import time
+from collections import deque
+
+from Benchmark import build
+from Stream import row_size, rows_from_words, words_from_rows
+
+# Every message is a little-endian uint32 length followed by that many bytes
+LENGTH = struct.Struct("<I")
+# Requests: operation, request id, length of the circuit spec ("FullAdder" or "AdderSubtractor:32"), followed by the
+# spec and for EVALUATE a vector count, the bits per vector and the vectors packed like Stream's binary files
+REQUEST = struct.Struct("<BIH")
+VECTORS = struct.Struct("<IH")
+# Responses: request id, status, followed by VECTORS and the packed outputs, an error message or JSON stats
+RESPONSE = struct.Struct("<IB")
+
+EVALUATE = 1
+STATS = 2
+
+OK = 0
+ERROR = 1
+
+
+def pack_vectors(vectors, width):
+    # vectors are ints with input 0 as the most significant bit or lists of bits
+    size = row_size(width)
+    padding = size * 8 - width
+    rows = bytearray()
+    for vector in vectors:
+        if not isinstance(vector, int):
+            vector = int("".join("1" if bit else "0" for bit in vector), 2)
+        rows += (vector << padding).to_bytes(size, "big")
+    return bytes(rows)
+
+
+def unpack_vectors(rows, count, width):
+    size = row_size(width)
+    padding = size * 8 - width
+    return [int.from_bytes(rows[i * size:(i + 1) * size], "big") >> padding for i in range(count)]
+
+
+class WarmCircuit:
+
+    def __init__(self, spec, backend):
+        self.component = build(spec)
+        self.component.set_backend(backend)
+        self.input_count = len(self.component.inputs)
+        self.output_count = len(self.component.outputs)
+        # [(packed rows, count, future)] waiting for the next batch
+        self.pending = []
+        self.flush_scheduled = False
+
+    def evaluate(self, rows, count):
+        # One bit-parallel evaluation for every vector in rows
+        words = words_from_rows(rows, self.input_count, count)
+        return rows_from_words(self.component.backend.evaluate_words(words, (1 << count) - 1), count)
+
+
+class SimulationServer:
+
+    def __init__(self, backend="codegen", max_delay=0.0, latency_samples=10000, max_width=256, max_circuits=32,
+                 max_message_bytes=1 << 24):
+        # Requests for the same circuit that arrive within max_delay seconds of each other are evaluated together,
+        # 0 batches whatever arrived in the same event loop iteration. Clients choose what gets built, so specs are
+        # limited to max_width ("AdderSubtractor:256"), at most max_circuits are kept and longer messages than
+        # max_message_bytes close the connection.
+        if backend == "reference":
+            raise ValueError("The server evaluates packed words, which needs a compiled backend")
+        self.backend = backend
+        self.max_delay = max_delay
+        self.max_width = max_width
+        self.max_circuits = max_circuits
+        self.max_message_bytes = max_message_bytes
+        # {spec: future of its WarmCircuit}, built in a worker thread on the first request for each spec, the least
+        # recently used one is dropped first
+        self.circuits = {}
+        self.latencies = deque(maxlen=latency_samples)
+        self.requests = 0
+        self.vectors = 0
+        self.batches = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.server = None
+        # {connection handler task: writer} of every open connection
+        self.connections = {}
+
+    async def start_unix(self, path):
+        self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        return self.server
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        # port 0 picks a free port, see self.server.sockets[0].getsockname()
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # Closing the sockets ends every handler at its next read
+        for writer in self.connections.values():
+            writer.close()
+        if self.connections:
+            await asyncio.gather(*self.connections, return_exceptions=True)
+
+    async def handle_connection(self, reader, writer):
+        # Requests on one connection are handled concurrently, the request id matches responses to requests
+        tasks = set()
+        self.connections[asyncio.current_task()] = writer
+        try:
+            while True:
+                try:
+                    size = LENGTH.unpack(await reader.readexactly(LENGTH.size))[0]
+                    if size > self.max_message_bytes:
+                        # The rest of the stream can't be trusted to be messages any more
+                        self.errors += 1
+                        await self.respond(writer, 0, ERROR, f"Message of {size} bytes is longer than "
+                                                             f"{self.max_message_bytes}".encode())
+                        break
+                    message = await reader.readexactly(size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                task = asyncio.ensure_future(self.handle_request(message, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    async def handle_request(self, message, writer):
+        started = time.perf_counter()
+        # A request too short to hold its id gets its error reply as request 0
+        request_id = 0
+        try:
+            operation, request_id, spec_size = REQUEST.unpack_from(message)
+            spec = message[REQUEST.size:REQUEST.size + spec_size].decode()
+            if operation == EVALUATE:
+                count, width = VECTORS.unpack_from(message, REQUEST.size + spec_size)
+                rows = message[REQUEST.size + spec_size + VECTORS.size:]
+                circuit = await self.circuit(spec)
+                if width != circuit.input_count or len(rows) != count * row_size(width):
+                    raise ValueError(f"{spec} takes {circuit.input_count} bits per vector, got {width}")
+                outputs = await self.submit(circuit, rows, count)
+                body = VECTORS.pack(count, circuit.output_count) + outputs
+                self.requests += 1
+                self.vectors += count
+                self.latencies.append(time.perf_counter() - started)
+            elif operation == STATS:
+                body = json.dumps(self.stats()).encode()
+            else:
+                raise ValueError(f"Unknown operation {operation}")
+            status = OK
+        except Exception as error:
+            self.errors += 1
+            status = ERROR
+            body = str(error).encode()
+        await self.respond(writer, request_id, status, body)
+
+    async def respond(self, writer, request_id, status, body):
+        response = RESPONSE.pack(request_id, status) + body
+        if not writer.is_closing():
+            writer.write(LENGTH.pack(len(response)) + response)
+            await writer.drain()
+
+    async def circuit(self, spec):
+        # Requests arriving while a circuit is built wait for the same build, and the event loop keeps serving the
+        # other circuits meanwhile
+        build = self.circuits.pop(spec, None)
+        if build is None:
+            width = spec.partition(":")[2]
+            if width and int(width) > self.max_width:
+                raise ValueError(f"{spec} is wider than the {self.max_width} bits this server builds")
+            build = asyncio.get_running_loop().run_in_executor(None, WarmCircuit, spec, self.backend)
+        self.circuits[spec] = build
+        while len(self.circuits) > self.max_circuits:
+            # Batches already waiting for an evicted circuit keep their own reference to it
+            del self.circuits[next(iter(self.circuits))]
+        try:
+            return await build
+        except Exception:
+            if self.circuits.get(spec) is build:
+                del self.circuits[spec]
+            raise
+
+    def submit(self, circuit, rows, count):
+        future = asyncio.get_running_loop().create_future()
+        circuit.pending.append((rows, count, future))
+        if not circuit.flush_scheduled:
+            circuit.flush_scheduled = True
+            loop = asyncio.get_running_loop()
+            if self.max_delay:
+                loop.call_later(self.max_delay, self.flush, circuit)
+            else:
+                loop.call_soon(self.flush, circuit)
+        return future
+
+    def flush(self, circuit):
+        pending = circuit.pending
+        circuit.pending = []
+        circuit.flush_scheduled = False
+        count = sum(request_count for rows, request_count, future in pending)
+        try:
+            outputs = circuit.evaluate(b"".join(rows for rows, request_count, future in pending), count)
+        except Exception as error:
+            for rows, request_count, future in pending:
+                future.set_exception(error)
+            return
+        self.batches += 1
+        size = row_size(circuit.output_count)
+        start = 0
+        for rows, request_count, future in pending:
+            future.set_result(outputs[start:start + request_count * size])
+            start += request_count * size
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        percentiles = {}
+        for percentile in (50, 90, 99, 99.9):
+            percentiles[f"p{percentile}"] = latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))] \
+                if latencies else None
+        elapsed = time.perf_counter() - self.started
+        return {"requests": self.requests, "vectors": self.vectors, "batches": self.batches, "errors": self.errors,
+                "requests_per_batch": self.requests / self.batches if self.batches else 0,
+                "requests_per_second": self.requests / elapsed, "vectors_per_second": self.vectors / elapsed,
+                "latency_seconds": percentiles, "circuits": list(self.circuits)}
+
+
+class Client:
+
+    def __init__(self, path=None, host="127.0.0.1", port=None, pool_size=4):
+        # Connects to a Unix socket at path or to host and port, keeping up to pool_size connections open
+        self.path = path
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.idle = []
+        self.open_connections = 0
+        self.available = None
+        self.next_request_id = 0
+        # {spec: (input count, output count)} learnt from the responses
+        self.widths = {}
+
+    async def connect(self):
+        if self.path is not None:
+            return await asyncio.open_unix_connection(self.path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def acquire(self):
+        if self.available is None:
+            self.available = asyncio.Semaphore(self.pool_size)
+        await self.available.acquire()
+        if self.idle:
+            return self.idle.pop()
+        try:
+            connection = await self.connect()
+        except BaseException:
+            self.available.release()
+            raise
+        self.open_connections += 1
+        return connection
+
+    def release(self, connection, reuse=True):
+        if reuse:
+            self.idle.append(connection)
+        else:
+            connection[1].close()
+            self.open_connections -= 1
+        self.available.release()
+
+    async def request(self, operation, spec, body=b""):
+        self.next_request_id += 1
+        request_id = self.next_request_id
+        spec = spec.encode()
+        message = REQUEST.pack(operation, request_id, len(spec)) + spec + body
+        connection = await self.acquire()
+        reader, writer = connection
+        try:
+            writer.write(LENGTH.pack(len(message)) + message)
+            await writer.drain()
+            response = await reader.readexactly(LENGTH.unpack(await reader.readexactly(LENGTH.size))[0])
+        except BaseException:
+            self.release(connection, reuse=False)
+            raise
+        self.release(connection)
+        response_id, status = RESPONSE.unpack_from(response)
+        if response_id != request_id:
+            raise ValueError(f"Response {response_id} to request {request_id}")
+        if status != OK:
+            raise ValueError(response[RESPONSE.size:].decode())
+        return response[RESPONSE.size:]
+
+    async def evaluate(self, spec, vectors, width):
+        # Output ints for vectors of spec, output 0 is the most significant bit
+        vectors = list(vectors)
+        body = await self.request(EVALUATE, spec, VECTORS.pack(len(vectors), width) + pack_vectors(vectors, width))
+        count, output_width = VECTORS.unpack_from(body)
+        return unpack_vectors(body[VECTORS.size:], count, output_width)
+
+    async def stats(self):
+        return json.loads(await self.request(STATS, ""))
+
+    async def close(self):
+        for reader, writer in self.idle:
+            writer.close()
+            await writer.wait_closed()
+        self.idle = []
+        self.open_connections = 0
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import random
+    import tempfile
+
+    from Verify import adder_subtractor_reference
+
+    parser = argparse.ArgumentParser(description="Serve circuit evaluations over a Unix socket or localhost")
+    parser.add_argument("--socket", help="Unix socket path to listen on")
+    parser.add_argument("--port", type=int, help="localhost TCP port to listen on")
+    parser.add_argument("--backend", default="codegen")
+    parser.add_argument("--max-delay", type=float, default=0.0, help="seconds to wait for more requests to batch")
+    parser.add_argument("--max-width", type=int, default=256, help="widest Class:width spec that gets built")
+    parser.add_argument("--max-circuits", type=int, default=32, help="built circuits kept at once")
+    parser.add_argument("--max-message-bytes", type=int, default=1 << 24)
+    options = parser.parse_args()
+
+    async def serve():
+        server = SimulationServer(options.backend, options.max_delay, max_width=options.max_width,
+                                  max_circuits=options.max_circuits, max_message_bytes=options.max_message_bytes)
+        if options.socket is not None:
+            await server.start_unix(options.socket)
+        else:
+            await server.start_tcp(port=options.port)
+        async with server.server:
+            await server.server.serve_forever()
+
+    if options.socket is not None or options.port is not None:
+        asyncio.run(serve())
+    else:
+        async def check(path):
+            server = SimulationServer()
+            await server.start_unix(path)
+            client = Client(path, pool_size=8)
+            spec = "EightBit2sComplementAdderSubtractor"
+            requests = [[random.getrandbits(17) for _ in range(random.randint(1, 50))] for _ in range(200)]
+            results = await asyncio.gather(*[client.evaluate(spec, vectors, 17) for vectors in requests])
+            for vectors, outputs in zip(requests, results):
+                assert outputs == [adder_subtractor_reference(vector) for vector in vectors]
+            stats = await client.stats()
+            assert stats["requests"] == 200 and stats["batches"] < 200 and stats["latency_seconds"]["p99"] > 0
+            assert client.open_connections <= 8
+            try:
+                await client.evaluate(spec, [0], 16)
+                assert False
+            except ValueError as error:
+                assert "17 bits per vector" in str(error)
+            assert (await client.evaluate("FullAdder", [[1, 1, 1]], 3)) == [0b11]
+            for bad_spec in ("instantiate", "Wiring", "NoSuchCircuit"):
+                try:
+                    await client.evaluate(bad_spec, [0], 1)
+                    assert False
+                except ValueError as error:
+                    assert "Unknown component class" in str(error)
+            # A request too short for its header still gets an error reply and the connection keeps working
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(LENGTH.pack(2) + b"\x01\x00")
+            response = await reader.readexactly(LENGTH.unpack(await reader.readexactly(LENGTH.size))[0])
+            assert RESPONSE.unpack_from(response) == (0, ERROR)
+            writer.write(LENGTH.pack(REQUEST.size) + REQUEST.pack(STATS, 7, 0))
+            response = await reader.readexactly(LENGTH.unpack(await reader.readexactly(LENGTH.size))[0])
+            assert RESPONSE.unpack_from(response) == (7, OK)
+            writer.close()
+            await writer.wait_closed()
+
+            # A client leaving in the middle of a body ends its handler quietly
+            handlers = set(server.connections)
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(LENGTH.pack(100) + b"\x01" * 10)
+            await writer.drain()
+            while not set(server.connections) - handlers:
+                await asyncio.sleep(0.01)
+            (handler,) = set(server.connections) - handlers
+            writer.close()
+            await handler
+            # A length over max_message_bytes is refused before any of the body is read
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(LENGTH.pack(server.max_message_bytes + 1))
+            response = await reader.readexactly(LENGTH.unpack(await reader.readexactly(LENGTH.size))[0])
+            assert RESPONSE.unpack_from(response) == (0, ERROR) and b"longer than" in response
+            assert await reader.read() == b""
+            writer.close()
+
+            try:
+                await client.evaluate("AdderSubtractor:100000", [0], 1)
+                assert False
+            except ValueError as error:
+                assert "wider than" in str(error)
+            await client.close()
+            await server.close()
+
+            # Only the most recently used circuits are kept, and a build doesn't hold up the other circuits
+            server = SimulationServer("compact", max_width=2048, max_circuits=2)
+            await server.start_unix(path + "2")
+            client = Client(path + "2")
+            await client.evaluate("FullAdder", [0], 3)
+            await client.evaluate("XorGate", [0], 2)
+            await client.evaluate("FullAdder", [0], 3)
+            slow = asyncio.ensure_future(client.evaluate("AdderSubtractor:2048", [0], 4097))
+            while "AdderSubtractor:2048" not in server.circuits:
+                await asyncio.sleep(0)
+            assert (await client.evaluate("FullAdder", [0b111], 3)) == [0b11]
+            assert not slow.done()
+            assert await slow == [0]
+            assert (await client.stats())["circuits"] == ["AdderSubtractor:2048", "FullAdder"]
+            await client.close()
+            await server.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(check(os.path.join(directory, "circuit.sock")))
+        try:
+            SimulationServer("reference")
+            assert False
+        except ValueError as error:
+            assert "compiled backend" in str(error)
@@ -0,0 +1,305 @@
+import mmap
+import struct
+import sys
+from itertools import chain
+
+from Netlist import np, compile_component
+
+# Binary vector files are a header followed by one row per vector, each row holding the bits of one vector
+# packed most significant bit first (input 0 is bit 7 of the first byte) and padded to whole bytes.
+MAGIC = b"CVEC"
+VERSION = 1
+HEADER = struct.Struct("<4sB3xI")  # magic, version, bits per vector
+
+DEFAULT_CHUNK_SIZE = 16384
+
+
+def row_size(width):
+    return (width + 7) // 8
+
+
+def words_from_rows(data, width, count):
+    # Transposes count packed rows into one word per input, bit i of a word belongs to row i
+    size = row_size(width)
+    if np is not None:
+        rows = np.frombuffer(data, dtype=np.uint8, count=count * size).reshape(count, size)
+        columns = np.packbits(np.unpackbits(rows, axis=1, count=width).T, axis=1, bitorder="little")
+        return [int.from_bytes(column.tobytes(), "little") for column in columns]
+    padding = size * 8 - width
+    rows = [format(int.from_bytes(data[i * size:(i + 1) * size], "big") >> padding, f"0{width}b")
+            for i in range(count)]
+    return [int("".join(column)[::-1], 2) for column in zip(*rows)]
+
+
+def rows_from_words(words, count):
+    # The reverse of words_from_rows, returns the packed rows as bytes
+    width = len(words)
+    size = row_size(width)
+    if np is not None:
+        column_size = (count + 7) // 8
+        columns = np.frombuffer(b"".join(word.to_bytes(column_size, "little") for word in words),
+                                dtype=np.uint8).reshape(width, column_size)
+        bits = np.unpackbits(columns, axis=1, count=count, bitorder="little")
+        return np.packbits(bits.T, axis=1).tobytes()
+    padding = size * 8 - width
+    columns = [format(word, f"0{count}b")[::-1] for word in words]
+    return b"".join((int("".join(row), 2) << padding).to_bytes(size, "big") for row in zip(*columns))
+
+
+class BinaryVectorReader:
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        # source is a filename or a binary file object such as sys.stdin.buffer. Regular files are memory-mapped,
+        # pipes are read one chunk at a time.
+        self.file = open(source, "rb") if isinstance(source, str) else source
+        self.owns_file = isinstance(source, str)
+        self.chunk_size = chunk_size
+        magic, version, self.width = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("Not a binary vector file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary vector file version {version}")
+        self.row_size = row_size(self.width)
+        self.map = None
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            pass
+        self.count = (len(self.map) - HEADER.size) // self.row_size if self.map is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.owns_file:
+            self.file.close()
+
+    def __iter__(self):
+        # Yields (words, count) with at most chunk_size vectors each
+        chunk_bytes = self.chunk_size * self.row_size
+        if self.map is not None:
+            view = memoryview(self.map)
+            try:
+                for start in range(HEADER.size, HEADER.size + self.count * self.row_size, chunk_bytes):
+                    data = view[start:start + chunk_bytes]
+                    count = len(data) // self.row_size
+                    yield words_from_rows(data, self.width, count), count
+                    data.release()
+            finally:
+                view.release()
+            return
+        while True:
+            data = self.file.read(chunk_bytes)
+            count = len(data) // self.row_size
+            if count == 0:
+                return
+            yield words_from_rows(data, self.width, count), count
+
+
+class BinaryVectorWriter:
+
+    def __init__(self, target, width):
+        self.file = open(target, "wb") if isinstance(target, str) else target
+        self.owns_file = isinstance(target, str)
+        self.width = width
+        self.file.write(HEADER.pack(MAGIC, VERSION, width))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def write_words(self, words, count):
+        if len(words) != self.width:
+            raise ValueError(f"Expected {self.width} words, got {len(words)}")
+        if count:
+            self.file.write(rows_from_words(words, count))
+
+    def write_chunks(self, chunks):
+        for words, count in chunks:
+            self.write_words(words, count)
+
+
+def chunk_vectors(vectors, width, chunk_size=DEFAULT_CHUNK_SIZE):
+    # vectors yields lists of bits in set_inputs_from_array() order or ints with input 0 as the most significant bit
+    padding = row_size(width) * 8 - width
+    rows = bytearray()
+    count = 0
+    for vector in vectors:
+        if not isinstance(vector, int):
+            vector = int("".join("1" if bit else "0" for bit in vector), 2)
+        rows += (vector << padding).to_bytes(row_size(width), "big")
+        count += 1
+        if count == chunk_size:
+            yield words_from_rows(rows, width, count), count
+            rows.clear()
+            count = 0
+    if count:
+        yield words_from_rows(rows, width, count), count
+
+
+def read_csv(file, chunk_size=DEFAULT_CHUNK_SIZE):
+    # One vector per line with a 0 or 1 per input separated by commas, header and blank lines are skipped
+    def vectors():
+        for line in file:
+            fields = [field.strip() for field in line.split(",")]
+            if all(field in ("0", "1") for field in fields):
+                yield "".join(fields)
+
+    bits = vectors()
+    first = next(bits, None)
+    if first is None:
+        return
+    yield from chunk_vectors((int(vector, 2) for vector in chain([first], bits)), len(first), chunk_size)
+
+
+def write_csv(file, chunks):
+    for words, count in chunks:
+        columns = [format(word, f"0{count}b")[::-1] for word in words]
+        file.writelines(",".join(row) + "\n" for row in zip(*columns))
+
+
+def open_vectors(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Chunks from a filename, "-" for stdin or a binary or text file object.
+    # Binary vector files are recognised by their header, anything else is read as CSV.
+    if source == "-":
+        source = sys.stdin.buffer
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            binary = file.read(len(MAGIC)) == MAGIC
+        if binary:
+            return iter_closing(BinaryVectorReader(source, chunk_size))
+        return iter_closing(open(source), lambda file: read_csv(file, chunk_size))
+    if hasattr(source, "peek"):
+        if source.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+            return iter(BinaryVectorReader(source, chunk_size))
+        return read_csv((line.decode() for line in source), chunk_size)
+    if hasattr(source, "read"):
+        return read_csv(source, chunk_size)
+    raise ValueError("Iterables of vectors need chunk_vectors() with their width")
+
+
+def iter_closing(resource, chunks=iter):
+    with resource:
+        yield from chunks(resource)
+
+
+def evaluate_chunks(component, chunks):
+    # Yields (output words, count) for every chunk of input words. The component's backend does the evaluation
+    # when it has one, otherwise the component is compiled to a Netlist once.
+    evaluator = component.backend if component.backend is not None else compile_component(component)
+    width = len(component.inputs)
+    for words, count in chunks:
+        if len(words) != width:
+            raise ValueError(f"{type(component).__name__} has {width} inputs, the vectors have {len(words)} bits")
+        yield evaluator.evaluate_words(words, (1 << count) - 1), count
+
+
+def iter_outputs(chunks):
+    # One int per vector, output 0 is the most significant bit like int_to_bits()
+    for words, count in chunks:
+        width = len(words)
+        size = row_size(width)
+        padding = size * 8 - width
+        rows = rows_from_words(words, count)
+        for i in range(0, count * size, size):
+            yield int.from_bytes(rows[i:i + size], "big") >> padding
+
+
+def evaluate_stream(component, source, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Output vectors as ints for every input vector in source, see open_vectors(). Iterables of bit lists or ints
+    # are chunked with the component's input count.
+    if isinstance(source, str) or hasattr(source, "read"):
+        chunks = open_vectors(source, chunk_size)
+    else:
+        chunks = chunk_vectors(source, len(component.inputs), chunk_size)
+    return iter_outputs(evaluate_chunks(component, chunks))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate a stream of input vectors")
+    parser.add_argument("component", nargs="?", help="class name from Circuit, Class:width for the parametric ones")
+    parser.add_argument("input", nargs="?", default="-", help="binary vector or CSV file, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output file, - for stdout")
+    parser.add_argument("--format", choices=["binary", "csv"], default="csv", help="output format")
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    options = parser.parse_args()
+
+    if options.component is not None:
+        from Benchmark import build
+
+        component = build(options.component)
+        if options.backend is not None:
+            component.set_backend(options.backend)
+        output_chunks = evaluate_chunks(component, open_vectors(options.input, options.chunk_size))
+        if options.format == "binary":
+            with BinaryVectorWriter(sys.stdout.buffer if options.output == "-" else options.output,
+                                    len(component.outputs)) as writer:
+                writer.write_chunks(output_chunks)
+        elif options.output == "-":
+            write_csv(sys.stdout, output_chunks)
+        else:
+            with open(options.output, "w") as file:
+                write_csv(file, output_chunks)
+        sys.exit(0)
+
+    import io
+    import os
+    import random
+    import tempfile
+
+    from Circuit import EightBit2sComplementAdderSubtractor
+    from Netlist import int_to_bits
+    from Verify import adder_subtractor_reference
+
+    vectors = [random.getrandbits(17) for _ in range(5000)]
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    expected = [adder_subtractor_reference(vector) for vector in vectors]
+    assert list(evaluate_stream(adder_subtractor, vectors, chunk_size=1000)) == expected
+    assert list(evaluate_stream(adder_subtractor, (int_to_bits(vector, 17) for vector in vectors[:10]))) == expected[:10]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "vectors.bin")
+        with BinaryVectorWriter(path, 17) as writer:
+            writer.write_chunks(chunk_vectors(vectors, 17, 777))
+        assert os.path.getsize(path) == HEADER.size + 3 * len(vectors)
+        with BinaryVectorReader(path, 1000) as reader:
+            assert reader.width == 17 and reader.count == len(vectors)
+        assert list(evaluate_stream(adder_subtractor, path, 1024)) == expected
+
+        # Binary output of one run is the binary input of the next
+        output_path = os.path.join(directory, "outputs.bin")
+        with BinaryVectorWriter(output_path, 9) as writer:
+            writer.write_chunks(evaluate_chunks(adder_subtractor, open_vectors(path)))
+        assert list(iter_outputs(open_vectors(output_path))) == expected
+
+        csv_path = os.path.join(directory, "vectors.csv")
+        with open(csv_path, "w") as file:
+            file.write(",".join(f"in{i}" for i in range(17)) + "\n")
+            write_csv(file, chunk_vectors(vectors[:100], 17))
+        assert list(evaluate_stream(adder_subtractor, csv_path)) == expected[:100]
+
+        # Pipes can't be memory-mapped and are read chunk by chunk
+        with open(path, "rb") as file:
+            piped = io.BufferedReader(io.BytesIO(file.read()))
+        assert list(evaluate_stream(adder_subtractor, piped, 999)) == expected
+
+    output = io.StringIO()
+    write_csv(output, evaluate_chunks(adder_subtractor, chunk_vectors([0b01100000000001011], 17)))
+    assert output.getvalue() == "1,0,1,0,1,1,0,1,1\n"  # 96 - 5 = 91 with the carry set
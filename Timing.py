@@ -0,0 +1,205 @@
+from heapq import heappush, heappop
+
+from Circuit import AndGate, OrGate, NandGate, NorGate, NotGate
+from Netlist import AND, OR, NAND, NOR, NOT, BUF, GATE_TYPES, Netlist, compile_component
+
+# Propagation delay of each gate type in arbitrary time units. In CMOS an AndGate or OrGate is a NandGate or NorGate
+# followed by an inverter, so they take about twice as long.
+DEFAULT_DELAYS = {AndGate: 2, OrGate: 2, NandGate: 1, NorGate: 1, NotGate: 1}
+
+GATE_NAMES = {op: gate_class.__name__ for gate_class, op in GATE_TYPES.items()}
+GATE_NAMES[BUF] = "Buffer"
+
+
+class TimingSimulator:
+
+    def __init__(self, component, delays=None, max_time=100000):
+        # component is a Component or a compiled Netlist, delays is {gate class: delay} on top of DEFAULT_DELAYS.
+        # BUF gates, which only copy an inner output to several outputs, take no time.
+        self.netlist = component if isinstance(component, Netlist) else compile_component(component)
+        op_delays = {GATE_TYPES[gate_class]: delay for gate_class, delay in {**DEFAULT_DELAYS, **(delays or {})}.items()}
+        op_delays[BUF] = 0
+        self.delays = [op_delays[op] for op, a, b, out in self.netlist.gates]
+        self.fanout = [[] for _ in range(self.netlist.net_count)]
+        for index, (op, a, b, out) in enumerate(self.netlist.gates):
+            self.fanout[a].append(index)
+            if b != a:
+                self.fanout[b].append(index)
+        # Combinational feedback can oscillate forever, a vector taking longer than max_time raises a ValueError
+        self.max_time = max_time
+        self.reset()
+
+    def reset(self):
+        # All inputs 0 and every net settled, DFlipFlops hold their initial value
+        netlist = self.netlist
+        netlist.reset()
+        netlist.evaluate([0] * len(netlist.input_nets))
+        self.values = bytearray(netlist.values)
+        # Totals over every apply() since the last reset
+        self.vectors = 0
+        self.events = 0
+        self.glitches = 0
+        self.output_glitches = [0] * len(netlist.output_nets)
+        self.max_settle_times = [0] * len(netlist.output_nets)
+
+    def apply(self, inputs):
+        # Changes the inputs at time 0 and runs until nothing changes. Returns the time each output last changed,
+        # 0 for outputs that didn't change.
+        values = self.values
+        gates = self.netlist.gates
+        delays = self.delays
+        fanout = self.fanout
+        # {time: {net: value}}, every net change scheduled for the same time is applied in one batch
+        pending = {0: {}}
+        times = [0]
+        # Value each net will have once everything scheduled for it has happened
+        projected = {}
+        # {net: [value before the vector, number of changes, time of the last change]}
+        history = {}
+        for net, value in zip(self.netlist.input_nets, inputs):
+            pending[0][net] = 1 if value else 0
+        events = 0
+        while times:
+            time = heappop(times)
+            if time > self.max_time:
+                raise ValueError(f"Still changing after {self.max_time} time units, the circuit oscillates")
+            touched = set()
+            for net, value in pending.pop(time).items():
+                if values[net] == value:
+                    continue
+                changes = history.get(net)
+                if changes is None:
+                    history[net] = [values[net], 1, time]
+                else:
+                    changes[1] += 1
+                    changes[2] = time
+                values[net] = value
+                events += 1
+                touched.update(fanout[net])
+            for index in touched:
+                op, a, b, out = gates[index]
+                if op == AND:
+                    value = values[a] & values[b]
+                elif op == OR:
+                    value = values[a] | values[b]
+                elif op == NAND:
+                    value = 1 ^ (values[a] & values[b])
+                elif op == NOR:
+                    value = 1 ^ (values[a] | values[b])
+                elif op == NOT:
+                    value = 1 ^ values[a]
+                else:
+                    value = values[a]
+                if value == projected.get(out, values[out]):
+                    continue
+                projected[out] = value
+                # Transport delay, pulses shorter than the gate delay still get through and show up as glitches
+                arrival = time + delays[index]
+                batch = pending.get(arrival)
+                if batch is None:
+                    batch = pending[arrival] = {}
+                    heappush(times, arrival)
+                batch[out] = value
+        # A net that ends where it started changed an even number of times, every extra pair of changes is a glitch
+        glitches = 0
+        for net, (before, count, last) in history.items():
+            glitches += (count - (values[net] != before)) // 2
+        settle_times = []
+        for index, net in enumerate(self.netlist.output_nets):
+            changes = history.get(net)
+            if changes is None:
+                settle_times.append(0)
+                continue
+            before, count, last = changes
+            settle_times.append(last)
+            self.output_glitches[index] += (count - (values[net] != before)) // 2
+            if last > self.max_settle_times[index]:
+                self.max_settle_times[index] = last
+        self.vectors += 1
+        self.events += events
+        self.glitches += glitches
+        return settle_times
+
+    def get_all_outputs(self):
+        return [self.values[net] for net in self.netlist.output_nets]
+
+    def run(self, vectors):
+        for vector in vectors:
+            self.apply(vector)
+        return self.report()
+
+    def arrival_times(self):
+        # Static timing: the latest any net can change after an input or DFlipFlop output changes, whatever the
+        # vectors. Returns ([arrival time per net], [gate index driving the latest input of each net or None]).
+        arrival = [0] * self.netlist.net_count
+        driver = [None] * self.netlist.net_count
+        if self.netlist.feedback:
+            raise ValueError("Static timing needs a netlist without combinational feedback")
+        for index, (op, a, b, out) in enumerate(self.netlist.gates):
+            arrival[out] = max(arrival[a], arrival[b]) + self.delays[index]
+            driver[out] = index
+        return arrival, driver
+
+    def critical_path(self):
+        # (delay, [[gate name, output net, arrival time]]) of the slowest path to any output, input side first
+        arrival, driver = self.arrival_times()
+        net = max(self.netlist.output_nets, key=lambda output_net: arrival[output_net])
+        delay = arrival[net]
+        path = []
+        while driver[net] is not None:
+            op, a, b, out = self.netlist.gates[driver[net]]
+            path.append([GATE_NAMES[op], out, arrival[out]])
+            net = a if arrival[a] >= arrival[b] else b
+        path.reverse()
+        return delay, path
+
+    def report(self):
+        arrival, driver = self.arrival_times() if not self.netlist.feedback else (None, None)
+        return {"vectors": self.vectors, "events": self.events, "glitches": self.glitches,
+                "output_glitches": list(self.output_glitches), "max_settle_times": list(self.max_settle_times),
+                "static_arrival_times": [arrival[net] for net in self.netlist.output_nets] if arrival else None}
+
+
+if __name__ == "__main__":
+    import random
+
+    from Circuit import (XorGate, EightBitBinaryAdder, AdderSubtractor, KoggeStoneAdderSubtractor,
+                         EightBit2sComplementAdderSubtractor, SRLatch)
+    from Netlist import int_to_bits
+
+    # From [0, 1] to [1, 1] only the NandGate output changes, at 1, and the AndGate follows at 1 + 2
+    xor = TimingSimulator(XorGate())
+    xor.apply([1, 0])
+    assert xor.apply([0, 1]) == [0] and xor.get_all_outputs() == [1]
+    assert xor.apply([1, 1]) == [3]
+    assert xor.critical_path() == (4, [["OrGate", 5, 2], ["AndGate", 4, 4]])
+
+    adder = EightBitBinaryAdder()
+    simulator = TimingSimulator(adder)
+    netlist = compile_component(adder)
+    for _ in range(300):
+        vector = int_to_bits(random.getrandbits(16), 16)
+        settle_times = simulator.apply(vector)
+        assert simulator.get_all_outputs() == netlist.evaluate(vector)
+        assert max(settle_times) <= simulator.critical_path()[0]
+    report = simulator.report()
+    assert report["glitches"] > 0 and max(report["max_settle_times"]) <= max(report["static_arrival_times"])
+    # Worst case: the carry ripples through all 8 bits
+    simulator.apply([0] * 16)
+    assert simulator.apply([0, 0, 0, 0, 0, 0, 0, 1] + [1] * 8)[0] == simulator.critical_path()[0]
+
+    # With the same delays Kogge-Stone settles much sooner than ripple carry
+    ripple = TimingSimulator(AdderSubtractor(32)).critical_path()[0]
+    kogge_stone = TimingSimulator(KoggeStoneAdderSubtractor(32)).critical_path()[0]
+    assert kogge_stone * 3 < ripple
+
+    # Per gate type delays change the critical path
+    slow_and = TimingSimulator(EightBit2sComplementAdderSubtractor(), {AndGate: 10})
+    assert slow_and.critical_path()[0] > TimingSimulator(EightBit2sComplementAdderSubtractor()).critical_path()[0]
+
+    latch = TimingSimulator(SRLatch())
+    latch.apply([1, 0])
+    latch.apply([0, 0])
+    assert latch.get_all_outputs() == [1, 0]
+    latch.apply([0, 1])
+    assert latch.get_all_outputs() == [0, 1]
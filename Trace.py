@@ -0,0 +1,209 @@
+from array import array
+
+from Netlist import compile_component, unpack_word
+
+# Characters allowed in VCD identifier codes
+_CODE_CHARACTERS = "".join(chr(c) for c in range(33, 127))
+
+
+def vcd_code(index):
+    code = ""
+    while True:
+        code += _CODE_CHARACTERS[index % len(_CODE_CHARACTERS)]
+        index //= len(_CODE_CHARACTERS)
+        if index == 0:
+            return code
+
+
+def scope_names(path):
+    # EightBit2sComplementAdderSubtractor/[0]/TwoBit2sComplementAdderSubtractor becomes
+    # ["EightBit2sComplementAdderSubtractor", "TwoBit2sComplementAdderSubtractor_0"], VCD viewers read [] as bit ranges
+    segments = path.split("/")
+    return [segments[0]] + [f"{segments[i + 1]}_{segments[i][1:-1]}" for i in range(1, len(segments) - 1, 2)]
+
+
+def make_sampler(nets):
+    # Straight-line code copying every traced net into one row of the ring buffer, no objects are created per sample
+    lines = ["def sample(values, buffer, offset):"]
+    lines += [f"    buffer[offset + {column}] = values[{net}]" for column, net in enumerate(nets)]
+    if not nets:
+        lines.append("    pass")
+    namespace = {}
+    exec(compile("\n".join(lines) + "\n", "<sampler>", "exec"), namespace)
+    return namespace["sample"]
+
+
+class WaveformTracer:
+
+    def __init__(self, component, paths=None, depth=None, capacity=65536):
+        # Traces the inputs of component and the outputs of every instance inside the subtrees listed in paths,
+        # depth levels deep at most. Paths are the ones of Netlist.ports, None traces the whole tree. The last
+        # capacity samples are kept.
+        self.netlist = compile_component(component, ports=True)
+        root = type(component).__name__
+        prefixes = [root] if paths is None else list(paths)
+        for prefix in prefixes:
+            if prefix not in self.netlist.ports:
+                raise ValueError(f"{root} has no instance {prefix}")
+        # [[instance path, port name, net]] and the distinct nets they read, one buffer column each
+        self.signals = [[root, f"in{index}", net] for index, net in enumerate(self.netlist.input_nets)]
+        for path, (input_nets, output_nets) in self.netlist.ports.items():
+            for prefix in prefixes:
+                if path == prefix or path.startswith(prefix + "/"):
+                    level = path.count("/", len(prefix)) // 2
+                    if depth is None or level <= depth:
+                        self.signals += [[path, f"out{index}", net] for index, net in enumerate(output_nets)]
+                    break
+        self.nets = list(dict.fromkeys(net for path, name, net in self.signals))
+        self.columns = {net: column for column, net in enumerate(self.nets)}
+        self.sampler = make_sampler(self.nets)
+        self.capacity = capacity
+        self.width = len(self.nets)
+        self.buffer = bytearray(capacity * self.width)
+        self.times = array("q", bytes(8 * capacity))
+        self.reset()
+
+    def reset(self):
+        self.netlist.reset()
+        # Samples taken since the last reset, only the last capacity of them are still in the buffer
+        self.count = 0
+        self.time = 0
+
+    def sample(self, time=None):
+        # Records the current net values at time, one after the previous sample by default
+        if time is None:
+            time = self.time
+        position = self.count % self.capacity
+        self.sampler(self.netlist.values, self.buffer, position * self.width)
+        self.times[position] = time
+        self.count += 1
+        self.time = time + 1
+
+    def evaluate(self, inputs):
+        # Same interface as the backends, so setting component.backend to a tracer traces Component.evaluate()
+        outputs = self.netlist.evaluate(inputs)
+        self.sample()
+        return outputs
+
+    def tick(self):
+        self.netlist.tick()
+
+    def evaluate_words(self, words, mask, count=None):
+        # Samples every vector of a bit-parallel evaluation, bit i of the words is sampled at time + i.
+        # count is the number of vectors in the words, from mask by default.
+        if count is None:
+            count = mask.bit_length()
+        netlist = self.netlist
+        traced = netlist.evaluate_words(words, mask, output_nets=self.nets + netlist.output_nets)
+        start = max(0, count - self.capacity)
+        position = (self.count + start) % self.capacity
+        first = min(count - start, self.capacity - position)
+        for column, word in enumerate(traced[:self.width]):
+            bits = unpack_word(word >> start, count - start)
+            base = position * self.width + column
+            self.buffer[base:base + first * self.width:self.width] = bits[:first]
+            if first < count - start:
+                self.buffer[column:column + (count - start - first) * self.width:self.width] = bits[first:]
+        for i in range(start, count):
+            self.times[(self.count + i) % self.capacity] = self.time + i
+        self.count += count
+        self.time += count
+        return traced[self.width:]
+
+    def samples(self):
+        # (time, row) of every sample still in the buffer, oldest first, rows are memoryviews into the buffer
+        first = max(0, self.count - self.capacity)
+        view = memoryview(self.buffer)
+        for index in range(first, self.count):
+            position = index % self.capacity
+            yield self.times[position], view[position * self.width:(position + 1) * self.width]
+
+    def signal(self, path, name):
+        # [(time, value)] of one traced signal, mostly for tests
+        for signal_path, signal_name, net in self.signals:
+            if signal_path == path and signal_name == name:
+                column = self.columns[net]
+                return [(time, row[column]) for time, row in self.samples()]
+        raise ValueError(f"{path} {name} is not traced")
+
+    def write_vcd(self, file, timescale="1ns"):
+        # Writes the buffer as a Value Change Dump, GTKWave and most other waveform viewers read it
+        file.write("$version Circuit-Simulation $end\n")
+        file.write(f"$timescale {timescale} $end\n")
+        scopes = []
+        for path, name, net in sorted(self.signals, key=lambda signal: scope_names(signal[0])):
+            names = scope_names(path)
+            common = 0
+            while common < min(len(scopes), len(names)) and scopes[common] == names[common]:
+                common += 1
+            for _ in range(len(scopes) - common):
+                file.write("$upscope $end\n")
+            for scope in names[common:]:
+                file.write(f"$scope module {scope} $end\n")
+            scopes = names
+            file.write(f"$var wire 1 {vcd_code(self.columns[net])} {name} $end\n")
+        for _ in scopes:
+            file.write("$upscope $end\n")
+        file.write("$enddefinitions $end\n")
+        codes = [vcd_code(column) for column in range(self.width)]
+        previous = None
+        for time, row in self.samples():
+            if previous is None:
+                file.write(f"#{time}\n$dumpvars\n")
+                file.writelines(f"{value}{code}\n" for value, code in zip(row, codes))
+                file.write("$end\n")
+            else:
+                changes = [f"{value}{code}\n" for value, old, code in zip(row, previous, codes) if value != old]
+                if changes:
+                    file.write(f"#{time}\n")
+                    file.writelines(changes)
+            previous = bytes(row)
+
+
+if __name__ == "__main__":
+    import io
+    import time
+
+    from Circuit import EightBit2sComplementAdderSubtractor, EightBitAccumulator
+    from Netlist import exhaustive_words, int_to_bits
+
+    adder_subtractor = EightBit2sComplementAdderSubtractor()
+    tracer = WaveformTracer(adder_subtractor, ["EightBit2sComplementAdderSubtractor/[0]/TwoBit2sComplementAdderSubtractor"],
+                            depth=1, capacity=4)
+    # The inputs, the TwoBit2sComplementAdderSubtractor, its XorGate and FullAdder but nothing inside them
+    assert len(tracer.signals) == 17 + 2 + 1 + 2 and len(tracer.nets) == 17 + 2 + 1
+    adder_subtractor.backend = tracer
+    for value in range(6):
+        adder_subtractor.set_inputs_from_array(int_to_bits(value << 1, 17))
+        adder_subtractor.evaluate()
+    assert tracer.count == 6
+    assert tracer.signal("EightBit2sComplementAdderSubtractor/[0]/TwoBit2sComplementAdderSubtractor/[1]/FullAdder",
+                         "out0") == [(2, 0), (3, 1), (4, 0), (5, 1)]
+
+    output = io.StringIO()
+    tracer.write_vcd(output)
+    vcd = output.getvalue()
+    assert "$scope module TwoBit2sComplementAdderSubtractor_0 $end" in vcd and "$scope module FullAdder_1 $end" in vcd
+    assert vcd.count("$scope") == vcd.count("$upscope") and vcd.count("\n#") == 4
+
+    # A whole sweep in one bit-parallel evaluation, only the last capacity vectors are kept
+    tracer = WaveformTracer(adder_subtractor, capacity=1000)
+    words, mask = exhaustive_words(17)
+    started = time.perf_counter()
+    outputs = tracer.evaluate_words(words, mask, 1 << 17)
+    traced_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    assert outputs == tracer.netlist.evaluate_words(words, mask)
+    untraced_seconds = time.perf_counter() - started
+    assert traced_seconds < untraced_seconds * 10
+    assert tracer.count == 1 << 17
+    times = [sample_time for sample_time, row in tracer.samples()]
+    assert times == list(range((1 << 17) - 1000, 1 << 17))
+    assert tracer.signal("EightBit2sComplementAdderSubtractor", "out0")[-1] == (131071, 1)  # -1 - -1 = 0, carry set
+
+    accumulator = EightBitAccumulator()
+    tracer = WaveformTracer(accumulator, depth=0)
+    accumulator.backend = tracer
+    accumulator.set_inputs_from_array([0, 0, 0, 0, 0, 0, 0, 1, 1])
+    accumulator.step(3)
+    assert [value for sample_time, value in tracer.signal("EightBitAccumulator", "out7")][-1] == 1
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+
+from Netlist import int_to_bits
+
+# Component built by each worker process once, in init_worker()
+_worker_component = None
+
+
+def bits_to_int(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | (1 if bit else 0)
+    return value
+
+
+def adder_reference(vector, n=8):
+    # EightBitBinaryAdder and RippleCarryAdder(n): A then B, most significant bit first
+    mask = (1 << n) - 1
+    return (vector >> n) + (vector & mask)
+
+
+def adder_subtractor_reference(vector, n=8):
+    # EightBit2sComplementAdderSubtractor and friends: A, B, subtract. Subtracting adds the 1s complement of B
+    # plus 1, so the carry out is set when there is no borrow.
+    mask = (1 << n) - 1
+    a = vector >> (n + 1)
+    b = (vector >> 1) & mask
+    subtract = vector & 1
+    if subtract:
+        b ^= mask
+    return (a + b + subtract) & ((mask << 1) | 1)
+
+
+def init_worker(component_class, args, backend):
+    global _worker_component
+    _worker_component = component_class(*args)
+    if backend is not None:
+        _worker_component.set_backend(backend)
+
+
+def run_shard(start, stop, reference, max_failures):
+    # Returns [pid, vectors checked, seconds, [[vector, expected, got]]]
+    component = _worker_component
+    width = len(component.inputs)
+    mismatches = []
+    started = time.perf_counter()
+    vector = start
+    while vector < stop:
+        component.set_inputs_from_array(int_to_bits(vector, width))
+        component.evaluate()
+        got = bits_to_int(component.get_all_outputs())
+        expected = reference(vector)
+        vector += 1
+        if got != expected:
+            mismatches.append([vector - 1, expected, got])
+            if len(mismatches) >= max_failures:
+                break
+    return [os.getpid(), vector - start, time.perf_counter() - started, mismatches]
+
+
+class VerificationRunner:
+
+    def __init__(self, component_class, reference, args=(), workers=None, shard_size=4096, max_failures=10,
+                 backend=None):
+        # component_class(*args) is built once per worker, reference maps the packed input vector (input 0 is the
+        # most significant bit) to the packed outputs. Both have to be picklable, use functools.partial for arguments.
+        self.component_class = component_class
+        self.args = tuple(args)
+        self.reference = reference
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.max_failures = max_failures
+        self.backend = backend
+        self.width = len(component_class(*args).inputs)
+        # {pid: [vectors, seconds]}
+        self.worker_stats = {}
+        self.vectors = 0
+        self.mismatches = []
+        self.elapsed = 0
+
+    def iter_mismatches(self, start=0, stop=None):
+        # Yields [vector, expected, got] as shards finish and stops after max_failures
+        stop = 2 ** self.width if stop is None else stop
+        started = time.perf_counter()
+        shards = iter(range(start, stop, self.shard_size))
+        with ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                 initargs=(self.component_class, self.args, self.backend)) as executor:
+            pending = set()
+            # A few shards in flight per worker keeps memory bounded for huge input spaces
+            while True:
+                while len(pending) < self.workers * 4:
+                    shard_start = next(shards, None)
+                    if shard_start is None:
+                        break
+                    shard_stop = min(shard_start + self.shard_size, stop)
+                    pending.add(executor.submit(run_shard, shard_start, shard_stop, self.reference,
+                                                self.max_failures))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pid, vectors, seconds, mismatches = future.result()
+                    stats = self.worker_stats.setdefault(pid, [0, 0])
+                    stats[0] += vectors
+                    stats[1] += seconds
+                    self.vectors += vectors
+                    for mismatch in mismatches:
+                        if len(self.mismatches) < self.max_failures:
+                            self.mismatches.append(mismatch)
+                            yield mismatch
+                if len(self.mismatches) >= self.max_failures:
+                    for future in pending:
+                        future.cancel()
+                    break
+        self.elapsed = time.perf_counter() - started
+
+    def run(self, start=0, stop=None):
+        for _ in self.iter_mismatches(start, stop):
+            pass
+        return self.report()
+
+    def report(self):
+        workers = {pid: {"vectors": vectors, "seconds": seconds, "vectors_per_second": vectors / seconds if seconds else 0}
+                   for pid, (vectors, seconds) in self.worker_stats.items()}
+        return {"circuit": self.component_class.__name__, "vectors": self.vectors, "mismatches": self.mismatches,
+                "seconds": self.elapsed, "vectors_per_second": self.vectors / self.elapsed if self.elapsed else 0,
+                "workers": workers}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from Circuit import (EightBitBinaryAdder, EightBit2sComplementAdderSubtractor, RippleCarryAdder, AdderSubtractor,
+                         CarryLookaheadAdderSubtractor, CarrySelectAdderSubtractor, KoggeStoneAdderSubtractor,
+                         BrentKungAdderSubtractor)
+
+    circuits = {
+        "EightBitBinaryAdder": (EightBitBinaryAdder, (), adder_reference),
+        "EightBit2sComplementAdderSubtractor": (EightBit2sComplementAdderSubtractor, (), adder_subtractor_reference),
+        "RippleCarryAdder": (RippleCarryAdder, (8,), adder_reference),
+        "AdderSubtractor": (AdderSubtractor, (8,), adder_subtractor_reference),
+        "CarryLookaheadAdderSubtractor": (CarryLookaheadAdderSubtractor, (8,), adder_subtractor_reference),
+        "CarrySelectAdderSubtractor": (CarrySelectAdderSubtractor, (8,), adder_subtractor_reference),
+        "KoggeStoneAdderSubtractor": (KoggeStoneAdderSubtractor, (8,), adder_subtractor_reference),
+        "BrentKungAdderSubtractor": (BrentKungAdderSubtractor, (8,), adder_subtractor_reference),
+    }
+    parser = argparse.ArgumentParser(description="Exhaustively verify circuits against a Python reference")
+    # Names are checked below, argparse checks even an empty default against choices
+    parser.add_argument("circuits", nargs="*", metavar="circuit", help=f"any of {', '.join(circuits)}, default all")
+    parser.add_argument("--width", type=int, default=None, help="operand width for the parametric circuits")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shard-size", type=int, default=4096)
+    parser.add_argument("--max-failures", type=int, default=10)
+    parser.add_argument("--backend", default=None, help="evaluate with Component.set_backend(backend)")
+    options = parser.parse_args()
+    for name in options.circuits:
+        if name not in circuits:
+            parser.error(f"argument circuit: invalid choice: {name!r}")
+
+    failed = False
+    for name in options.circuits or list(circuits):
+        component_class, args, reference = circuits[name]
+        if args and options.width is not None:
+            args = (options.width,)
+        runner = VerificationRunner(component_class, partial(reference, n=args[0] if args else 8), args,
+                                    options.workers, options.shard_size, options.max_failures, options.backend)
+        for vector, expected, got in runner.iter_mismatches():
+            print(f"{name}: input {vector:#x} expected {expected:#x} got {got:#x}", flush=True)
+        report = runner.report()
+        failed = failed or bool(report["mismatches"])
+        per_worker = ", ".join(f"{stats['vectors_per_second']:.0f}" for stats in report["workers"].values())
+        print(f"{name}: {report['vectors']} vectors in {report['seconds']:.2f} s, "
+              f"{report['vectors_per_second']:.0f} vectors/s, per worker {per_worker}, "
+              f"{len(report['mismatches'])} mismatches")
+    sys.exit(1 if failed else 0)